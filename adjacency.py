@@ -0,0 +1,59 @@
+'''
+Production bonuses for squares next to other squares, e.g.
+
+    {('Farm', 'Stream'): 0.2, ('Mine', 'Mine'): -0.1}
+
+makes a farm produce 20% more for each stream among its eight neighbours, and a
+mine 10% less for each neighbouring mine. The bonuses of a square add up, and
+its output is never less than nothing. Each level can have its own rules (see
+Level.adjacency). The shipped levels have none, because VecEnv and the solver's
+Model don't model the bonuses; they refuse levels that have them.
+
+The type of every square is kept in a NumPy array with a border of -1 around
+it, and the bonus of every square is the sum of the eight shifted copies of it
+looked up in a table of (type, neighbour type) weights, so working out the
+whole map is a few array operations. When a square changes only the bonuses of
+it and its neighbours are worked out again.
+'''
+
+import numpy as np
+
+import square
+
+offsets = [(dr, dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1) if (dr, dc) != (0, 0)]
+
+
+class Adjacency(object):
+
+    def __init__(self, rules):
+        codes = dict((t.__name__, t.code) for t in square.types)
+        n = len(square.types)
+        # The extra last row and column are for the border, which is -1.
+        self.weights = np.zeros((n + 1, n + 1))
+        for (name, neighbour), bonus in rules.items():
+            self.weights[codes[name], codes[neighbour]] = bonus
+        self.codes = None       # square types, with a border of -1
+        self.multipliers = None # what each square's output is multiplied by
+
+    def rebuild(self, squares):
+        rows, cols = len(squares), len(squares[0])
+        self.codes = np.full((rows + 2, cols + 2), -1, np.int16)
+        self.codes[1:-1, 1:-1] = [[sq.code for sq in row] for row in squares]
+        self.multipliers = self.compute(0, rows, 0, cols)
+
+    def compute(self, r0, r1, c0, c1):
+        ''' The multipliers of the squares in rows r0:r1 and columns c0:c1.'''
+        # self.codes[r + 1, c + 1] is square (r, c)
+        centre = self.codes[r0 + 1:r1 + 1, c0 + 1:c1 + 1]
+        bonus = np.zeros(centre.shape)
+        for dr, dc in offsets:
+            bonus += self.weights[centre, self.codes[r0 + 1 + dr:r1 + 1 + dr, c0 + 1 + dc:c1 + 1 + dc]]
+        return np.maximum(1.0 + bonus, 0.0)
+
+    def update(self, r, c, code):
+        ''' Square (r, c) is now of the given type.'''
+        self.codes[r + 1, c + 1] = code
+        rows, cols = self.multipliers.shape
+        r0, r1 = max(r - 1, 0), min(r + 2, rows)
+        c0, c1 = max(c - 1, 0), min(c + 2, cols)
+        self.multipliers[r0:r1, c0:c1] = self.compute(r0, r1, c0, c1)
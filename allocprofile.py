@@ -0,0 +1,144 @@
+'''
+Where the memory goes, tick by tick (application.py --profile-alloc PATH).
+
+An AllocationProfiler watches each phase of Application.tick (process_events,
+logic and render) with tracemalloc. At the start of a phase the
+traces are cleared, so at its end a snapshot holds just the blocks the phase
+allocated and still holds, and the peak is the most the phase had allocated
+at once, garbage included. Over a window of ticks these are added up per
+phase, with the sites that allocated the most, and written out as one line
+of JSON:
+
+    {"tick": 0, "ticks": 100, "phases": {"logic": {
+        "blocks": 5200, "bytes": 410000, "peak_bytes": 9800,
+        "top": [{"site": "grid.py:120", "blocks": 2000, "bytes": 160000}, ...]},
+     ...}}
+
+blocks and bytes are what was still allocated at the end of each phase,
+summed over the window; peak_bytes is the largest peak of any one tick.
+Memory freed before the phase ends (most of a tick's garbage) only shows in
+the peak; tracemalloc has no count of blocks allocated and freed since.
+
+Tracing slows the game down several times over, so the frame rate governor
+is kept at the full rate and every frame is one tick. To compare two runs,
+e.g. before and after a change:
+
+    python allocprofile.py before.jsonl after.jsonl
+'''
+
+import os
+import sys
+import json
+import tracemalloc
+
+phases = ('process_events', 'logic', 'render')
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+
+def site(frame):
+    ''' file:line, with the game's own files relative to it so runs from
+    different checkouts can be compared.'''
+    filename = frame.filename
+    if filename.startswith(here + os.sep):
+        filename = os.path.relpath(filename, here)
+    return '{0}:{1}'.format(filename, frame.lineno)
+
+
+class AllocationProfiler(object):
+
+    def __init__(self, path, window=100, top=10):
+        self.window = window
+        self.top = top
+        self.ticks = 0
+        self.file = open(path, 'w')
+        self.filters = [tracemalloc.Filter(False, tracemalloc.__file__),
+                        tracemalloc.Filter(False, __file__)]
+        self.reset()
+        tracemalloc.start()
+
+    def reset(self):
+        self.first_tick = self.ticks
+        self.totals = dict((name, {'blocks': 0, 'bytes': 0, 'peak_bytes': 0}) for name in phases)
+        self.sites = dict((name, {}) for name in phases) # site -> [blocks, bytes]
+
+    def begin(self):
+        ''' A phase starts now.'''
+        tracemalloc.clear_traces()
+        tracemalloc.reset_peak()
+
+    def end(self, name):
+        ''' Phase name ended now; the next one begins.'''
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces(self.filters)
+        totals, sites = self.totals[name], self.sites[name]
+        for stat in snapshot.statistics('lineno'):
+            key = site(stat.traceback[0])
+            counts = sites.setdefault(key, [0, 0])
+            counts[0] += stat.count
+            counts[1] += stat.size
+            totals['blocks'] += stat.count
+            totals['bytes'] += stat.size
+        totals['peak_bytes'] = max(totals['peak_bytes'], peak)
+        self.begin()
+
+    def tick(self):
+        ''' A tick's phases are all over.'''
+        self.ticks += 1
+        if self.ticks - self.first_tick >= self.window:
+            self.write()
+
+    def write(self):
+        ticks = self.ticks - self.first_tick
+        if ticks == 0:
+            return
+        report = {'tick': self.first_tick, 'ticks': ticks, 'phases': {}}
+        for name in phases:
+            phase = dict(self.totals[name])
+            top = sorted(self.sites[name].items(), key=lambda item: (-item[1][1], item[0]))
+            phase['top'] = [{'site': key, 'blocks': blocks, 'bytes': size}
+                            for key, (blocks, size) in top[:self.top]]
+            report['phases'][name] = phase
+        self.file.write(json.dumps(report) + '\n')
+        self.file.flush()
+        self.reset()
+
+    def close(self):
+        ''' Write what there is of the last window, and stop tracing.'''
+        self.write()
+        self.file.close()
+        tracemalloc.stop()
+
+
+def load(path):
+    ''' The windows in a report, as dicts.'''
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def per_tick(windows):
+    ''' {phase: (blocks, bytes, peak_bytes)} over a whole report, with blocks
+    and bytes per tick.'''
+    ticks = sum(window['ticks'] for window in windows)
+    result = {}
+    for name in phases:
+        found = [window['phases'][name] for window in windows if name in window['phases']]
+        result[name] = (sum(phase['blocks'] for phase in found) / max(ticks, 1),
+                        sum(phase['bytes'] for phase in found) / max(ticks, 1),
+                        max([phase['peak_bytes'] for phase in found] or [0]))
+    return result
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="Compare allocation reports from application.py --profile-alloc.")
+    parser.add_argument('reports', nargs='+', help="report files, the first being the baseline")
+    args = parser.parse_args(argv)
+    runs = [per_tick(load(path)) for path in args.reports]
+    print('{0:<16}{1:>14}{2:>14}{3:>14}  {4}'.format('phase', 'blocks/tick', 'bytes/tick', 'peak bytes', 'report'))
+    for name in phases:
+        for path, run in zip(args.reports, runs):
+            blocks, size, peak = run[name]
+            print('{0:<16}{1:>14.1f}{2:>14.1f}{3:>14}  {4}'.format(name, blocks, size, peak, path))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -8,7 +8,6 @@ also has a bit of startup and shutdown code.
 '''
 
 import sys
-import time
 
 import pygame
 # import pygame._view
@@ -18,23 +17,67 @@ pygame.init()
 
 import interface
 from interface import singleton_interface
-from resource import singleton_resource
-from grid import singleton_grid
+from gamestate import global_state
 from message import show_message, get_input, show_main_menu
+from events import CellChanged, WorkersChanged
+from governor import FrameGovernor
 
 
 window_size = (800, 600)
 bg_color = Color(255, 255, 255)
 fps = 100
+scroll_keys = {K_UP: (-1, 0), K_DOWN: (1, 0), K_LEFT: (0, -1), K_RIGHT: (0, 1)}
 
 class Application():
 
+    def __init__(self, threaded=False, capture=None, record=None, profiler=None):
+        # Whether the game runs on a thread of its own (see simthread.py).
+        self.threaded = threaded
+        self.simulation = None
+        self.capture = capture # a capture.Capture to give every frame to
+        self.record = record   # a capture.Recorder to tell about clicks on the grid
+        self.governor = FrameGovernor(fps)
+        # An allocprofile.AllocationProfiler watching each tick.
+        self.profiler = profiler
+        if profiler is not None:
+            self.governor.idle_after = float('inf') # one tick a frame
+        # Counts changes to the grid, for screen_key().
+        self.grid_changes = 0
+        global_state.events.subscribe(CellChanged, self.on_grid_change)
+        global_state.events.subscribe(WorkersChanged, self.on_grid_change)
+
+    def on_grid_change(self, event):
+        self.grid_changes += 1
+
+    def screen_key(self):
+        ''' Something that is different whenever the picture is (apart from
+        what the mouse does), for the frame rate governor.'''
+        from message import warning_panel
+        resource = global_state.resource
+        panels = resource.panels + resource.sparklines + [warning_panel,
+                 singleton_interface.level_panel, singleton_interface.goal_panel, singleton_interface.time_panel]
+        return (tuple(panel.key for panel in panels), self.grid_changes, global_state.grid.origin,
+                singleton_interface.heatmap.key, singleton_interface.get_mode())
+
+    def record_click(self, pos):
+        ''' Add a click on the grid to the session being recorded, for
+        capture.py to play back.'''
+        cell = global_state.grid.get_mouse_cell(pos)
+        if cell is None:
+            return
+        # The recorder takes the time from the game, so it has to be told on
+        # the game's thread, just before the click itself is carried out.
+        global_state.command(self.record.click, singleton_interface.get_mode(), cell)
+
     def process_events(self):
-        '''Handle any events that may have accumulated in pygame's event queue'''
-        for event in pygame.event.get():
+        '''Handle any events that may have accumulated in pygame's event queue.
+        Returns whether there were any.'''
+        events = pygame.event.get()
+        for event in events:
             # process mouse events
             if event.type == MOUSEBUTTONDOWN:
-                singleton_grid.mouse_click(event.pos)
+                if self.record is not None:
+                    self.record_click(event.pos)
                 singleton_interface.mouse_press(event.pos)
 
             # process key events
@@ -43,6 +86,17 @@ class Application():
                     sys.exit(0)
                 elif event.key == K_ESCAPE:
                     singleton_interface.set_mode(interface.NORMAL)
+                elif event.key in scroll_keys:
+                    # scroll the map, when it is bigger than the screen
+                    grid = global_state.grid
+                    dr, dc = scroll_keys[event.key]
+                    grid.scroll_to(grid.origin[0] + dr, grid.origin[1] + dc)
+                elif event.key == K_t:
+                    # show the history by tick, month or year
+                    global_state.resource.next_history_tier()
+                elif event.key == K_h:
+                    # tint the grid by food, wood or gold output, or stop
+                    singleton_interface.heatmap.toggle()
                 elif event.key == K_2 and (get_mods() & KMOD_SHIFT):
                     try:
                         code = get_input("Enter some code to execute.")
@@ -54,11 +108,11 @@ class Application():
             elif event.type == QUIT:
                 pygame.quit()
                 sys.exit(0)
+        return len(events) > 0
 
     def logic(self):
         ''' Updates the state of the grid, resources and then updates the levels.'''
-        singleton_grid.harvest()
-        singleton_resource.update()
+        global_state.tick()
 
 
     def render(self):
@@ -68,52 +122,136 @@ class Application():
         screen.fill(bg_color)
 
         # Paint the grid
-        singleton_grid.paint()
+        global_state.grid.paint()
 
         # Paint the buttons, resources, etc.
         singleton_interface.paint()
 
         # Update the display
         pygame.display.flip()
+        if self.capture is not None:
+            self.capture.frame()
         
-    def check_win(self):
-        '''checks if the victory conditions have been met'''
-        from level import levels, current_level
-        levels[current_level].update()        
-
-    def tick(self):
-        ''' Gets input, updates the state, and repaints the screen.  Basically executes one unit of game time.'''
-        self.process_events() # handle any new events
-        self.logic()          # perform step-by-step logic
+    def tick(self, ticks=1):
+        ''' Gets input, updates the state, and repaints the screen.  Basically executes one unit of game time.
+        If more than one tick is asked for, the others are played first without
+        being drawn. Returns whether there was any input.'''
+        profiler = self.profiler
+        if profiler is not None:
+            return self.profiled_tick(profiler)
+        had_input = self.process_events() # handle any new events
+        for i in range(ticks - 1):
+            self.logic()
+        self.logic()          # perform step-by-step logic, and check the level
         self.render()         # render the game
-        self.check_win()      # checks if victory conditions have been met
+        return had_input
+
+    def profiled_tick(self, profiler):
+        ''' tick(), telling the profiler where each phase ends.'''
+        profiler.begin()
+        had_input = self.process_events()
+        profiler.end('process_events')
+        self.logic()
+        profiler.end('logic')
+        self.render()
+        profiler.end('render')
+        profiler.tick()
+        return had_input
 
     def start(self):   
         '''initiates the game '''
         pygame.display.set_caption("Migration Sensation")
         pygame.display.set_mode(window_size, 0) # 0 means no interesting options
         show_main_menu()
+        if self.threaded:
+            from simthread import SimulationThread
+            self.simulation = SimulationThread(global_state, fps)
+            self.simulation.start()
         self.loop()
+
+    def show_messages(self):
+        ''' Show the messages the simulation thread has left for us. The game
+        carries on while they are up.'''
+        while not self.simulation.messages.empty():
+            show_message(self.simulation.messages.get())
         
     def loop(self):
         ''' main game loop '''
         try:
             # Main game loop
+            governor = self.governor
             while True:
-                if not singleton_interface.pause_button.is_active():
-                    self.tick()
+                had_input = False
+                if self.simulation is not None:
+                    # the game ticks by itself; just keep the screen up to date
+                    had_input = self.process_events()
+                    self.show_messages()
+                    self.render()
+                elif not singleton_interface.pause_button.is_active():
+                    # fewer frames when idle, so more ticks in each
+                    had_input = self.tick(governor.ticks_per_frame)
                 else:
                     self.render()         # render the game
-                # Sleep for 10ms. This is a quick & dirty way to prevent the
-                # game from hogging a whole CPU. Assuming that our code doesn't
-                # take much time to execute, the frame rate should be around
-                # 100 fps.
-                time.sleep(1.0/fps)
+                # Wait until the next frame: 10ms normally, longer when nothing
+                # on the screen has changed for a while (see governor.py).
+                governor.frame(self.screen_key(), had_input)
+                governor.wait()
         finally:
+            if self.simulation is not None:
+                self.simulation.stop()
+                self.simulation.join()
+            if global_state.telemetry is not None:
+                global_state.telemetry.close()
+            if self.capture is not None:
+                self.capture.close()
+            if self.record is not None:
+                self.record.close()
+            if self.profiler is not None:
+                self.profiler.close()
             # Let pygame do whatever cleanup it wants to do
             pygame.quit()
             sys.exit()
             
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="Migration Sensation")
+    parser.add_argument('--telemetry', metavar='PATH',
+                        help="record every tick of the economy to PATH (see telemetry.py)")
+    parser.add_argument('--workers', action='store_true',
+                        help="simulate every worker individually (see workers.py)")
+    parser.add_argument('--threaded', action='store_true',
+                        help="run the game on its own thread, so slow frames don't slow it down")
+    parser.add_argument('--capture', metavar='DIR',
+                        help="save the screen to DIR as PNG files (see capture.py)")
+    parser.add_argument('--capture-every', metavar='N', type=int, default=1,
+                        help="only save every Nth frame")
+    parser.add_argument('--record', metavar='PATH',
+                        help="write the clicks on the grid to PATH, for capture.py to play back")
+    parser.add_argument('--profile-alloc', metavar='PATH',
+                        help="report the memory each phase of a tick allocates to PATH (see allocprofile.py)")
+    parser.add_argument('--profile-window', metavar='N', type=int, default=100,
+                        help="ticks in each line of the allocation report")
+    args = parser.parse_args(argv)
+    if args.profile_alloc and args.threaded:
+        parser.error("--profile-alloc can't be used with --threaded, which doesn't tick between frames")
+    if args.workers:
+        global_state.track_workers()
+    if args.telemetry:
+        from telemetry import Telemetry
+        global_state.telemetry = Telemetry(args.telemetry)
+    capture = record = None
+    if args.capture:
+        from capture import Capture
+        capture = Capture(args.capture, args.capture_every, frame_ms=1000 // fps)
+    if args.record:
+        from capture import Recorder
+        record = Recorder(global_state, args.record)
+    profiler = None
+    if args.profile_alloc:
+        from allocprofile import AllocationProfiler
+        profiler = AllocationProfiler(args.profile_alloc, args.profile_window)
+    Application(args.threaded, capture, record, profiler).start()
+
 if __name__ == '__main__':
-    Application().start()
+    main(sys.argv[1:])
 
@@ -5,12 +5,18 @@ import pygame
 from pygame.locals import *
 
 import level
-from message import show_message, get_input, show_pause_menu
+from message import show_message, get_input, show_pause_menu, save_game, load_game
 from constants import *
 
 
 class Button(object):
 
+    state_colors = {
+        'normal' : (230, 230, 230),
+        'hovered': (215, 215, 215),
+        'active' : (200, 200, 200),
+    }
+
     def __init__(self, x, y, label, tip=None, width=110, height=32):
         self.x = x
         self.y = y
@@ -21,9 +27,14 @@ class Button(object):
 
         font = pygame.font.Font("arial.ttf",14)
         self.text = font.render(label, True, (0, 0, 0))
-        self.textpos = self.text.get_rect(top=y+10, left=x+width/2-self.text.get_width()/2)
+        self.textpos = self.text.get_rect(top=10, left=width/2-self.text.get_width()/2)
         self.rect = pygame.Rect(x, y, width, height)
 
+        # The button looks the same every frame, so each of its states is
+        # drawn once up front.
+        self.sprites = dict((state, self.render(color))
+                            for state, color in Button.state_colors.items())
+
     def tooltip(self):
         return self.tip
 
@@ -50,23 +61,25 @@ class Button(object):
         if self.contains_point(pos):
             self.activate()
 
-    def paint(self):
-        '''Updates the button display'''
-        from interface import singleton_interface
-        screen = pygame.display.get_surface()
-        color = (200, 200, 200) if self.is_active() else (230, 230, 230)
-        pygame.draw.rect(screen, color, self.rect)
-        pygame.draw.rect(screen, (150, 150, 150), self.rect, 1)
-        screen.blit(self.text, self.textpos)
+    def render(self, color):
+        ''' Draw the button with the given background color.'''
+        sprite = pygame.Surface((self.width, self.height))
+        sprite.fill(color)
+        pygame.draw.rect(sprite, (150, 150, 150), sprite.get_rect(), 1)
+        sprite.blit(self.text, self.textpos)
+        return sprite
 
-        # Display some helpful tip if the user is hovering over us.
-        if self.mouse_over():
-            singleton_interface.tip = self.tooltip()
+    def state(self, hovered=False):
+        if self.is_active():
+            return 'active'
+        return 'hovered' if hovered else 'normal'
 
+    def paint(self, hovered=False):
+        '''Updates the button display. hovered says whether the mouse is over
+        the button this frame.'''
+        screen = pygame.display.get_surface()
+        screen.blit(self.sprites[self.state(hovered)], self.rect)
 
-def get_save_path(name):
-    '''Convert a save name into a proper file path'''
-    return 'saves/' + name + '.sav'
 
 class SaveButton(Button):
     ''' A button for saving the level one is on. '''
@@ -75,13 +88,7 @@ class SaveButton(Button):
 
     def activate(self):
         ''' When the save button is clicked, bring up a menu to save the level.'''
-        name = get_input("What should this saved game be called? (You may want to use your first name.)")
-        if name.strip() == '':
-            return
-        path = get_save_path(name)
-        with open(path, 'w') as f:
-            f.write(str(level.current_level))
-            f.close()
+        save_game()
 
 class LoadButton(Button):
     ''' A button for loading a saved game.'''
@@ -90,19 +97,9 @@ class LoadButton(Button):
         super(LoadButton, self).__init__(x, y, 'Load Game', ['Load a game which you saved previously'])
 
     def activate(self):
-        ''' When the load button is pressed, get a filename and then jump to the
-        level given in the file.'''
-        name = get_input("Enter the name of the saved game.")
-        if name.strip() == '':
-            return
-        path = get_save_path(name)
-        try:
-            with open(path, 'r') as f:
-                saved_level = int(f.read())
-                level.current_level = saved_level
-                level.levels[level.current_level].begin()
-        except IOError:
-            show_message("No save file with that name was found.")
+        ''' When the load button is pressed, let the user pick a saved game
+        and then jump to its level.'''
+        load_game()
 
 class PauseButton(Button):
     ''' A button that pauses the game'''
@@ -125,8 +122,8 @@ class ModeButton(Button):
     ''' A button that sets and unsets an interface mode when clicked.
         mode_buttons() returns the list of buttons to create.'''
                     
-    def __init__(self, x, y, label, mode, tip):
-        super(ModeButton, self).__init__(x, y, label, tip)
+    def __init__(self, x, y, label, mode, tip, width=110):
+        super(ModeButton, self).__init__(x, y, label, tip, width)
         self.mode = mode
 
     def is_active(self):
@@ -143,13 +140,23 @@ class ModeButton(Button):
             singleton_interface.set_mode(self.mode)
 
 
+def button_row(count, left=20, right=800, gap=20, width=110):
+    ''' The x positions and the width of count buttons side by side, made
+    narrower than width if that's what it takes to fit them between left and
+    right.'''
+    step = min(width + gap, (right - left) // count)
+    return [left + step*i for i in range(count)], step - gap
+
 def mode_buttons():
-    ''' A list of buttons (name, interface_mode, x_pos, y_pos, tooltip) '''
+    ''' A list of buttons (name, interface_mode, x_pos, y_pos, tooltip, width).
+    There is one for each kind of building in buildings.json, then the worker
+    buttons.'''
     from grid import cost_description
-    return [("Build House"     , BUILD_HOUSE     , 20+130*0, 560, ("Build a house", "Cost: " + cost_description(BUILD_HOUSE))),
-            ("Plant Crops"      , BUILD_FARM      , 20+130*1, 560, ("Build a farm", "Cost: "  + cost_description(BUILD_FARM))),
-            ("Build Mine"      , BUILD_MINE      , 20+130*2, 560, ("Build a mine", "Cost: "  + cost_description(BUILD_MINE))),
-            ("Destroy", DESTROY_BUILDING, 20+130*3, 560, ("Destroy a building",)),
-            ("Assign Worker"   , ASSIGN_WORKER   , 20+130*4, 560, ("Place a worker on a resource",)),
-            ("Remove Worker"   , REMOVE_WORKER   , 20+130*5, 560, ("Remove a worker from a resource",))]
-
+    from square import build_types
+    buttons = [(build['label'], mode, (build['tip'], "Cost: " + cost_description(mode)))
+               for mode, (code, build) in sorted(build_types.items())]
+    buttons += [("Destroy", DESTROY_BUILDING, ("Destroy a building",)),
+                ("Assign Worker"   , ASSIGN_WORKER   , ("Place a worker on a resource",)),
+                ("Remove Worker"   , REMOVE_WORKER   , ("Remove a worker from a resource",))]
+    xs, width = button_row(len(buttons))
+    return [(label, mode, x, 560, tip, width) for x, (label, mode, tip) in zip(xs, buttons)]
@@ -0,0 +1,236 @@
+'''
+Recording the game as a sequence of pictures.
+
+A Capture takes a copy of the screen every frame (or every few frames) and
+puts the raw pixels in a bounded queue. A separate process takes them off the
+queue and saves them, as numbered PNG files or as one animated GIF (which
+needs Pillow). Copying the pixels is all the game itself does, so recording
+costs it little. If the encoder falls behind and the queue fills up, frames
+are dropped rather than waiting for it, according to the policy:
+
+    drop-newest  the new frame is thrown away (the recording stutters)
+    drop-oldest  the oldest waiting frame is thrown away (keeps it current)
+
+    capture = Capture('frames', every=2)
+    ...                     # every frame, after painting:
+    capture.frame()
+    capture.close()         # waits for the encoder to finish
+
+The game records itself with application.py --capture DIR. A session recorded
+with application.py --record PATH can also be played back without a window,
+as fast as it can be drawn, and turned into frames:
+
+    python capture.py session.jsonl frames/ [--every N] [--gif]
+
+A session is a JSON line for every click on the grid, with the level and how
+many ticks into it the click came, and a line whenever a level begins, saying
+how long the one before lasted. (Only these are recorded, so anything left to
+chance, such as who starves or when a level is won, may turn out differently.
+The playback starts each level when the session did, unless the game has got
+there by itself.)
+'''
+
+import os
+import sys
+import json
+import queue
+import multiprocessing
+
+policies = ('drop-newest', 'drop-oldest')
+
+
+def encode(frames, directory, gif, frame_ms):
+    ''' The encoder process: save frames from the queue until it sends None.'''
+    import pygame
+    images = []
+    while True:
+        item = frames.get()
+        if item is None:
+            break
+        index, size, pixels = item
+        if gif:
+            from PIL import Image
+            images.append(Image.frombytes('RGB', size, pixels).quantize())
+        else:
+            picture = pygame.image.frombytes(pixels, size, 'RGB')
+            pygame.image.save(picture, os.path.join(directory, 'frame{0:06d}.png'.format(index)))
+    if images:
+        images[0].save(os.path.join(directory, 'capture.gif'), save_all=True,
+                       append_images=images[1:], duration=frame_ms, loop=0)
+
+
+class Capture(object):
+
+    def __init__(self, directory, every=1, gif=False, queue_size=16, policy='drop-newest', frame_ms=10):
+        ''' frame_ms is the time between frames offered to frame(), for
+        timing the GIF.'''
+        if policy not in policies:
+            raise ValueError("unknown drop policy {0!r}; use one of {1}".format(policy, ', '.join(policies)))
+        if gif:
+            import PIL.Image # fail now rather than in the encoder
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.every = every
+        self.policy = policy
+        self.frames = 0  # frames offered
+        self.queued = 0  # frames sent to the encoder
+        self.dropped = 0 # frames thrown away
+        self.queue = multiprocessing.Queue(queue_size)
+        self.encoder = multiprocessing.Process(target=encode, name='capture',
+                                               args=(self.queue, directory, gif, frame_ms * every))
+        self.encoder.daemon = True
+        self.encoder.start()
+
+    def frame(self, surface=None, wait=False):
+        ''' Record the surface (the screen by default), if this is one of the
+        frames being kept. With wait=True, wait for room in the queue instead
+        of dropping anything.'''
+        import pygame
+        index = self.frames
+        self.frames += 1
+        if index % self.every:
+            return
+        surface = surface or pygame.display.get_surface()
+        item = (index, surface.get_size(), pygame.image.tobytes(surface, 'RGB'))
+        try:
+            self.queue.put(item, block=wait)
+            self.queued += 1
+            return
+        except queue.Full:
+            self.dropped += 1
+        if self.policy == 'drop-newest':
+            return
+        try:
+            self.queue.get_nowait() # the frame that has waited longest
+            self.queued -= 1
+        except queue.Empty:
+            # The frames are still on their way into the queue; give up on
+            # this one instead.
+            return
+        try:
+            self.queue.put_nowait(item)
+            self.queued += 1
+        except queue.Full:
+            pass
+
+    def close(self):
+        ''' Wait for the encoder to save everything that was queued.'''
+        self.queue.put(None)
+        self.encoder.join()
+        self.queue.close()
+
+
+class Recorder(object):
+    ''' Writes a session (application.py --record) to a file. It must be
+    told about clicks, and hears about levels, on the thread that plays the
+    game, so it sees the game's own clock.'''
+
+    def __init__(self, state, path):
+        from events import LevelChanged
+        self.state = state
+        self.file = open(path, 'w')
+        self.level, self.level_start = state.current_level, state.level_start
+        self.write({'level': state.current_level, 'begin': True})
+        state.events.subscribe(LevelChanged, self.on_level)
+
+    def write(self, line):
+        self.file.write(json.dumps(line) + '\n')
+
+    def on_level(self, event):
+        state = self.state
+        self.write({'level': state.current_level, 'begin': True,
+                    'from': self.level, 'tick': state.ticks - self.level_start})
+        self.level, self.level_start = state.current_level, state.level_start
+
+    def click(self, mode, cell):
+        ''' The player clicked cell (r, c) in the given interface mode.'''
+        self.write({'level': self.state.current_level, 'tick': self.state.level_ticks(),
+                    'mode': mode, 'r': cell[0], 'c': cell[1]})
+
+    def close(self):
+        from events import LevelChanged
+        self.state.events.unsubscribe(LevelChanged, self.on_level)
+        self.file.close()
+
+
+def replay(session, directory, every=1, gif=False, ticks=None):
+    ''' Play the lines of a recorded session in the interactive game, without
+    waiting between ticks, capturing every `every`th tick. Plays until the
+    last line, or for `ticks` ticks.'''
+    import pygame
+    from gamestate import global_state as state
+    from events import LevelChanged
+    import application
+    pygame.display.set_mode(application.window_size)
+    app = application.Application()
+    capture = Capture(directory, 1, gif, frame_ms=1000 * every // application.fps)
+    played = 0
+    begun = 0 # levels begun, including by the game itself
+    def on_level(event):
+        nonlocal begun
+        begun += 1
+    def play_until(level_ticks):
+        ''' Tick until the level has had level_ticks ticks. Returns False if
+        it ended first, or the replay ran out of ticks.'''
+        nonlocal played
+        level = begun
+        while state.level_ticks() < level_ticks:
+            if begun != level or (ticks is not None and played >= ticks):
+                return False
+            state.tick()
+            if played % every == 0:
+                app.render()
+                # Nothing need be dropped here; the replay waits for the encoder.
+                capture.frame(wait=True)
+            played += 1
+        return begun == level
+
+    # Nobody is there to acknowledge messages, such as the level being won.
+    headless, state.headless = state.headless, True
+    state.events.subscribe(LevelChanged, on_level)
+    try:
+        for line in session:
+            if ticks is not None and played >= ticks:
+                break
+            if line.get('begin'):
+                if 'from' in line and not play_until(line['tick']) \
+                                  and state.current_level == line['level']:
+                    continue # the game got there by itself
+                state.goto_level(line['level'])
+            elif play_until(line['tick']) and state.current_level == line['level']:
+                state.grid.perform(line['mode'], (line['r'], line['c']))
+        if ticks is not None:
+            while played < ticks:
+                play_until(state.level_ticks() + ticks - played)
+    finally:
+        state.events.unsubscribe(LevelChanged, on_level)
+        state.headless = headless
+        capture.close()
+    return capture
+
+def read_session(path):
+    ''' The lines of a file written by application.py --record.'''
+    with open(path) as f:
+        return [json.loads(text) for text in f if text.strip()]
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="Turn a recorded session into frames.")
+    parser.add_argument('session', help="a file written by application.py --record")
+    parser.add_argument('directory', help="where to save the frames")
+    parser.add_argument('--every', type=int, default=1, help="keep every Nth tick")
+    parser.add_argument('--ticks', type=int, help="how long to play (default: to the end of the session)")
+    parser.add_argument('--gif', action='store_true', help="save one animated GIF (needs Pillow)")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    import pygame
+    pygame.init()
+    capture = replay(read_session(args.session), args.directory, args.every,
+                     args.gif, args.ticks)
+    print("{0} frames saved to {1}".format(capture.queued, args.directory))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,43 @@
+'''
+Change notifications for a game. Every GameState has an EventBus in
+state.events; the grid, the resources and the levels post events to it when
+something changes, and anything that depends on those things subscribes
+instead of checking every tick.
+
+    state.events.subscribe(CellChanged, lambda event: ...)
+'''
+
+from collections import namedtuple
+
+# A square was replaced. pos is (r, c), or None when the whole grid was.
+CellChanged = namedtuple('CellChanged', 'pos')
+
+# The number of workers on a square changed.
+WorkersChanged = namedtuple('WorkersChanged', 'pos num_workers')
+
+# A resource went above or below a value someone is watching for (see
+# Resource.watch). above is True if it is now at or above the threshold.
+ResourceCrossed = namedtuple('ResourceCrossed', 'name threshold above')
+
+# A level was started or restarted.
+LevelChanged = namedtuple('LevelChanged', 'level')
+
+# The warning in the corner of the screen changed.
+WarningChanged = namedtuple('WarningChanged', 'warning')
+
+
+class EventBus(object):
+
+    def __init__(self):
+        self.handlers = {} # event type -> list of handlers
+
+    def subscribe(self, kind, handler):
+        ''' Call handler(event) for every event of the given type.'''
+        self.handlers.setdefault(kind, []).append(handler)
+
+    def unsubscribe(self, kind, handler):
+        self.handlers.get(kind, []).remove(handler)
+
+    def emit(self, event):
+        for handler in self.handlers.get(type(event), ()):
+            handler(event)
@@ -0,0 +1,133 @@
+'''
+A GameState holds everything that makes up one game: the grid, the resources,
+which level is being played and how much time is left, the current warning
+and (for the interactive game) the interface. The grid, resource and level code
+work on the state they are given instead of on module singletons, so any
+number of games can run side by side in one process.
+
+The interactive game is global_state. The old module-level names
+(singleton_grid, singleton_resource, singleton_interface, level.current_level
+and message.current_warning) all refer to parts of it. It is put together the
+first time it is asked for (get_global_state(), or importing global_state from
+here), so importing the grid or resource modules doesn't build it.
+'''
+
+
+class GameState(object):
+
+    default_warning = "Without food, your workers will starve. Start by building " \
+                    + "farms and placing workers on them."
+
+    def __init__(self, grid=None, resource=None, headless=True):
+        ''' Create a game. The grid and resource manager are created unless
+        they are given. A headless game never shows modal messages; they are
+        collected in self.messages instead.'''
+        from grid import Grid
+        from resource import Resource
+        from events import EventBus, CellChanged, WorkersChanged, ResourceCrossed
+        import level
+        self.events = EventBus()
+        self.grid = grid if grid is not None else Grid()
+        self.resource = resource if resource is not None else Resource()
+        self.grid.state = self
+        self.resource.state = self
+        self.interface = None
+        self.levels = level.levels
+        self.current_level = 0
+        self.time_remaining = None
+        self.ticks = 0       # ticks played, over all levels
+        self.level_start = 0 # self.ticks when the level began
+        self.warning = GameState.default_warning
+        self.headless = headless
+        self.messages = []
+        self.telemetry = None # a telemetry.Telemetry recording each tick
+        self.workers = None   # a workers.WorkerStore; see track_workers()
+        # The simthread.SimulationThread running this game, if any, and the
+        # last Snapshot it published, which is what gets drawn.
+        self.simulation = None
+        self.snapshot = None
+        # Whether the level's goals need checking; set when a resource
+        # crosses one of them.
+        self.goals_changed = True
+        self.events.subscribe(ResourceCrossed, self.on_resource_crossed)
+        self.events.subscribe(ResourceCrossed, self.resource.on_crossed)
+        self.events.subscribe(CellChanged, self.grid.invalidate)
+        self.events.subscribe(WorkersChanged, self.grid.invalidate)
+
+    def level(self):
+        ''' The Level being played.'''
+        return self.levels[self.current_level]
+
+    def level_ticks(self):
+        ''' The number of ticks played since the level began.'''
+        return self.ticks - self.level_start
+
+    def goto_level(self, n):
+        self.current_level = n
+        self.levels[n].begin(self)
+
+    def track_workers(self):
+        ''' Simulate every worker individually from now on (see workers.py).'''
+        from workers import WorkerStore
+        self.workers = WorkerStore()
+        self.workers.attach(self)
+
+    def on_resource_crossed(self, event):
+        self.goals_changed = True
+
+    def show_warning(self, warning):
+        ''' Replace the warning shown in the corner of the screen.'''
+        if warning != self.warning:
+            from events import WarningChanged
+            self.warning = warning
+            self.events.emit(WarningChanged(warning))
+
+    def command(self, function, *args):
+        ''' Carry out something the player did: call function(*args), on the
+        simulation thread if the game runs on one.'''
+        if self.simulation is not None:
+            self.simulation.submit(function, *args)
+        else:
+            function(*args)
+
+    def show_message(self, msg):
+        ''' Show a message that pauses the game until it is acknowledged. (If
+        the game runs on a simulation thread, the main thread shows it and the
+        game carries on.)'''
+        if self.simulation is not None:
+            self.simulation.messages.put(str(msg))
+        elif self.headless:
+            self.messages.append(str(msg))
+        else:
+            from message import show_message
+            show_message(msg)
+
+    def tick(self, roll=None):
+        ''' One unit of game time: harvest, feed and grow the population, then
+        check the level's goals and clock. There is no input or rendering.
+        roll is passed on to Resource.update.'''
+        self.grid.harvest()
+        self.resource.update(roll)
+        if self.telemetry is not None:
+            self.telemetry.record_tick(self)
+        self.ticks += 1
+        self.level().update(self)
+
+
+def get_global_state():
+    ''' The interactive game, made from singleton_grid and singleton_resource
+    on the first call.'''
+    global global_state
+    state = globals().get('global_state')
+    if state is None:
+        from grid import singleton_grid
+        from resource import singleton_resource
+        state = GameState(singleton_grid, singleton_resource, headless=False)
+        global_state = state
+        state.goto_level(0)
+    return state
+
+def __getattr__(name):
+    if name == 'global_state':
+        return get_global_state()
+    raise AttributeError("module 'gamestate' has no attribute " + repr(name))
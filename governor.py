@@ -0,0 +1,78 @@
+'''
+Choosing the frame rate. Drawing 100 frames a second of a screen that isn't
+changing keeps a core busy for nothing, so a FrameGovernor drops to a few
+frames a second once nothing has been drawn differently, and nothing has
+been pressed or moved, for a while. Any input brings it straight back: while
+it is idle it waits in short naps, and stops waiting as soon as pygame has
+an event.
+
+The main loop tells it what each frame showed, as any value that changes
+whenever the picture does (see Application.screen_key), and asks it how long
+to wait. If the game only ticks between frames, it should play ticks_per_frame
+ticks each frame, so the game runs at the same speed either way.
+
+For instrumentation, state is 'active' or 'idle', fps is the current rate, and
+stats() gives those and how many frames have been drawn in each state.
+'''
+
+import time
+
+import pygame
+
+ACTIVE, IDLE = 'active', 'idle'
+
+
+class FrameGovernor(object):
+
+    def __init__(self, fps=100, idle_fps=4, idle_after=2.0, nap=0.01):
+        self.full_fps = fps
+        self.idle_fps = idle_fps
+        self.idle_after = idle_after # seconds without change before idling
+        self.nap = nap               # how often to look for input when idle
+        self.state = ACTIVE
+        self.key = None
+        self.last_change = time.time()
+        self.frames = {ACTIVE: 0, IDLE: 0}
+
+    @property
+    def fps(self):
+        return self.full_fps if self.state == ACTIVE else self.idle_fps
+
+    @property
+    def ticks_per_frame(self):
+        return max(1, self.full_fps // self.fps)
+
+    def stats(self):
+        return {'state': self.state, 'fps': self.fps,
+                'active_frames': self.frames[ACTIVE], 'idle_frames': self.frames[IDLE]}
+
+    def wake(self):
+        ''' Something happened (e.g. input); go back to the full rate now.'''
+        self.last_change = time.time()
+        self.state = ACTIVE
+
+    def frame(self, key, had_input=False):
+        ''' A frame was drawn showing key.'''
+        self.frames[self.state] += 1
+        if had_input or key != self.key:
+            self.key = key
+            self.wake()
+        elif self.state == ACTIVE and time.time() - self.last_change >= self.idle_after:
+            self.state = IDLE
+
+    def wait(self):
+        ''' Sleep until it is time for the next frame, or until there is
+        input if that comes first.'''
+        if self.state == ACTIVE:
+            # A quick & dirty way to stay near the frame rate, assuming
+            # drawing a frame doesn't take long.
+            time.sleep(1.0 / self.fps)
+            return
+        until = time.time() + 1.0 / self.fps
+        now = time.time()
+        while now < until:
+            if pygame.event.peek():
+                self.wake()
+                return
+            time.sleep(min(self.nap, until - now))
+            now = time.time()
@@ -1,20 +1,23 @@
 import random
 import pygame
 from square import *
+from resource import cost_vector, UNEMPLOYED
+from events import CellChanged, WorkersChanged
+from adjacency import Adjacency
 
 grid_size = rows, cols = (11, 12)
 
-buildings = {
-    BUILD_HOUSE: House,
-    BUILD_MINE: Mine,
-    BUILD_FARM: Farm
-}
+# What each build mode builds, and what it costs; both come from
+# buildings.json (see square.load_types).
+buildings = dict((mode, types[code]) for mode, (code, build) in build_types.items())
+building_costs = dict((mode, build['cost']) for mode, (code, build) in build_types.items())
 
-building_costs = {
-    BUILD_HOUSE: {'Wood': 50},
-    BUILD_MINE: {'Wood': 50, 'Food': 20},
-    BUILD_FARM: {'Wood': 35}
-}
+# The same costs, compiled for Resource.spend_vector.
+building_cost_vectors = dict((mode, cost_vector(cost)) for mode, cost in building_costs.items())
+
+# What one worker on a square of each type produces per tick, as
+# (resource id, amount) pairs.
+production_vectors = tuple(cost_vector(dict(produces)) for produces in PRODUCES)
 
 def cost_description(blding):
     cost_map = building_costs[blding]
@@ -26,9 +29,102 @@ def grid_from_description(desc):
 
 class Grid:
     cell_width = cell_height = 50
+    # How many cells fit on the screen. Bigger grids scroll; see scroll_to().
+    view_rows, view_cols = rows, cols
 
     def __init__(self):
-        pass
+        # The GameState this grid belongs to; set when it joins one.
+        self.state = None
+        self._squares = []
+        # The painted grid, kept until a square changes (see paint()).
+        self.view = None
+        # The top-left cell on the screen.
+        self.origin = (0, 0)
+        # The level's adjacency bonuses, if it has any (see set_adjacency()).
+        self.adjacency = None
+        # The snapshot version the view was painted from (see simthread.py).
+        self.painted_version = None
+
+    @property
+    def squares(self):
+        return self._squares
+
+    @squares.setter
+    def squares(self, squares):
+        self._squares = squares
+        self.origin = (0, 0)
+        if self.adjacency is not None:
+            self.adjacency.rebuild(squares)
+        self.emit(CellChanged(None))
+
+    def emit(self, event):
+        if self.state is not None:
+            self.state.events.emit(event)
+
+    def set_square(self, r, c, square):
+        self._squares[r][c] = square
+        if self.adjacency is not None:
+            self.adjacency.update(r, c, square.code)
+        self.emit(CellChanged((r, c)))
+
+    def set_adjacency(self, rules):
+        ''' Use the given adjacency rules (see adjacency.py), or none.'''
+        self.adjacency = Adjacency(rules) if rules else None
+        if self.adjacency is not None and self._squares:
+            self.adjacency.rebuild(self._squares)
+
+    def output_multipliers(self):
+        ''' What the output of each square is multiplied by, because of its
+        neighbours or the skill of its workers, as a (rows, cols) array; None
+        if nothing changes it.'''
+        multipliers = None if self.adjacency is None else self.adjacency.multipliers
+        store = self.state.workers if self.state is not None else None
+        if store is not None:
+            factors = store.factors()
+            multipliers = factors if multipliers is None else multipliers * factors
+        return multipliers
+
+    def multiplier(self, r, c):
+        multipliers = self.output_multipliers()
+        return 1.0 if multipliers is None else multipliers[r, c]
+
+    def set_workers(self, r, c, n):
+        self._squares[r][c].num_workers = n
+        self.emit(WorkersChanged((r, c), n))
+
+    def invalidate(self, event=None):
+        ''' Forget the painted grid, so it is painted again next frame. Changes
+        to cells that are off the screen are ignored.'''
+        if self.state is not None and self.state.simulation is not None:
+            # The change happened on the simulation thread; paint() sees it
+            # in the snapshot's grid_version instead.
+            return
+        pos = getattr(event, 'pos', None)
+        if pos is None or self.on_screen(pos):
+            self.view = None
+
+    def visible_size(self):
+        ''' The number of (rows, cols) on the screen.'''
+        return min(self.rows(), Grid.view_rows), min(self.cols(), Grid.view_cols)
+
+    def on_screen(self, pos):
+        r, c = pos
+        r0, c0 = self.origin
+        vr, vc = self.visible_size()
+        return r0 <= r < r0 + vr and c0 <= c < c0 + vc
+
+    def scroll_to(self, r, c):
+        ''' Scroll so that cell (r, c) is at the top left of the screen, or as
+        near as the edges of the grid allow.'''
+        vr, vc = self.visible_size()
+        origin = (max(0, min(r, self.rows() - vr)), max(0, min(c, self.cols() - vc)))
+        if origin != self.origin:
+            self.origin = origin
+            self.view = None
+
+    def center_on(self, r, c):
+        vr, vc = self.visible_size()
+        self.scroll_to(r - vr//2, c - vc//2)
 
     def rows(self):
         return len(self.squares)
@@ -37,26 +133,33 @@ class Grid:
         return len(self.squares[0])
 
     def num_houses(self):
-        ''' Returns the number of houses on the grid.'''
+        ''' Returns the number of houses on the grid (squares of any type that
+        workers live in).'''
         n = 0
         for row in self.squares:
             for sq in row:
-                if isinstance(sq, House):
+                if HOUSING[sq.code] > 0:
                     n += 1
         return n
 
     def population_limit(self):
-        return self.num_houses() * 10
+        return sum(HOUSING[square.code] for row in self.squares for square in row)
 
     def get_mouse_cell(self, pos):
         ''' takes a mouse position and translates that into a cell in the grid. '''
         mouse_x, mouse_y = pos
         c = mouse_x // Grid.cell_width
         r = mouse_y // Grid.cell_height
-        if c < self.cols() and r < self.rows():
-            return (r, c)
+        vr, vc = self.visible_size()
+        if 0 <= c < vc and 0 <= r < vr:
+            return (r + self.origin[0], c + self.origin[1])
         return None
 
+    def rect(self):
+        ''' The part of the screen the grid is drawn on.'''
+        vr, vc = self.visible_size()
+        return pygame.Rect(0, 0, Grid.cell_width * vc, Grid.cell_height * vr)
+
     def mouse_click(self, pos):
         ''' The user clicked the mouse, so check whether it was on a cell in the
         grid.  If so, tell that cell that it was clicked.'''
@@ -65,49 +168,53 @@ class Grid:
             r, c = mouse_cell
             self.cell_clicked((r, c))
 
+    mouse_press = mouse_click
+
     def cell_clicked(self, pos):
         ''' Method runs when the user clicks on a cell in the grid.'''
-        from interface import singleton_interface        
-        from resource  import singleton_resource
+        self.state.command(self.perform, self.state.interface.get_mode(), pos)
+
+    def perform(self, mode, pos):
+        ''' Apply an interface mode (build, assign, remove, destroy) to a cell,
+        exactly as if the user had clicked it in that mode.'''
+        resource = self.state.resource
         
         r,c = pos
 
         # check for building construction
-        if self.squares[r][c].buildable():
+        if BUILDABLE[self.squares[r][c].code]:
             try:
-                mode = singleton_interface.get_mode()
-                cost = building_costs[mode]
-                if singleton_resource.spend(cost):
-                    self.squares[r][c] = buildings[mode]()
+                cost = building_cost_vectors[mode]
+                if resource.spend_vector(cost):
+                    self.set_square(r, c, buildings[mode]())
             except KeyError:
                 pass
 
         # check for worker assigning;
-        if self.squares[r][c].workable():
+        if WORKABLE[self.squares[r][c].code]:
             # if we want to assign a worker, we have to have one available.
-            if singleton_interface.get_mode() == ASSIGN_WORKER \
-                       and singleton_resource.get('Unemployed') >= 1 \
+            if mode == ASSIGN_WORKER \
+                       and resource.get('Unemployed') >= 1 \
                        and self.squares[r][c].num_workers < 5:
                 # then use up the worker and assign it to the square
-                self.squares[r][c].num_workers += 1
-                singleton_resource.resources['Unemployed'] -= 1
-            if singleton_interface.get_mode() == REMOVE_WORKER \
+                self.set_workers(r, c, self.squares[r][c].num_workers + 1)
+                resource.amounts[UNEMPLOYED] -= 1
+            if mode == REMOVE_WORKER \
                        and self.squares[r][c].num_workers > 0:
-                self.squares[r][c].num_workers -= 1
-                singleton_resource.resources['Unemployed'] += 1
+                self.set_workers(r, c, self.squares[r][c].num_workers - 1)
+                resource.amounts[UNEMPLOYED] += 1
 
         # demolish a building if requested
-        if singleton_interface.get_mode() == DESTROY_BUILDING:
+        if mode == DESTROY_BUILDING:
             self.demolish(r,c)
     
     def demolish(self, r, c):     
-        from resource  import singleton_resource
         '''attempts to demolish a building. Returns True if a building is sucessfully demolished'''
-        if self.squares[r][c].destroyable() and (self.num_houses() > 1 or not (isinstance(self.squares[r][c], House))):
+        if self.squares[r][c].destroyable() and (self.num_houses() > 1 or HOUSING[self.squares[r][c].code] == 0):
             # Free the workers
-            singleton_resource.give({'Unemployed': self.squares[r][c].num_workers})
+            self.state.resource.amounts[UNEMPLOYED] += self.squares[r][c].num_workers
             # Replace building with grass patch
-            self.squares[r][c] = Grass()
+            self.set_square(r, c, Grass())
             return True
         return False
             
@@ -128,35 +235,63 @@ class Grid:
         return tally
     def add_grave(self):
         '''adds a grave to the map. If there are no available squares it destrays a random destroyable building'''
-        from message import show_warning
-        if self.num_houses() != 0:
-            not_assigned = True
-            if self.is_full():
-                while not_assigned:
-                    r = random.randint(0, rows-1)
-                    c = random.randint(0,cols-1)
-                    if self.squares[r][c].destroyable() or self.destroyables < 2:
-                        if self.demolish(r,c):
-                            self.squares[r][c] = Grave()
-                            not_assigned = False
-            else:
-                while not_assigned:
-                    r = random.randint(0, rows-1)
-                    c = random.randint(0,cols-1)
-                    if self.squares[r][c].buildable():
-                        self.squares[r][c] = Grave()
-                        not_assigned = False
-        else:
-            from message import show_warning
-            show_warning("Your whole town is one big Cemetery! This might be a good time to restart the level.")
-            
+        self.add_graves(1)
+
+    def add_graves(self, count):
+        '''adds count graves to the map in one pass. Graves go on free grass
+        first; once that runs out, random buildings are demolished to make room
+        (the last house is always spared).'''
+        if count <= 0:
+            return
+        free, destroyable, houses = [], [], 0
+        for r, row in enumerate(self.squares):
+            for c, square in enumerate(row):
+                if square.buildable():
+                    free.append((r, c))
+                elif square.destroyable():
+                    destroyable.append((r, c))
+                if HOUSING[square.code] > 0:
+                    houses += 1
+        if houses == 0:
+            self.state.show_warning("Your whole town is one big Cemetery! This might be a good time to restart the level.")
+            return
+
+        spots = random.sample(free, min(count, len(free)))
+        random.shuffle(destroyable)
+        for r, c in destroyable[:count - len(spots)]:
+            square = self.squares[r][c]
+            if HOUSING[square.code] > 0:
+                if houses == 1:
+                    continue
+                houses -= 1
+            # Free the workers, just like demolish() would
+            self.state.resource.amounts[UNEMPLOYED] += square.num_workers
+            spots.append((r, c))
+        for r, c in spots:
+            self.set_square(r, c, Grave())
             
     def harvest(self):
         ''' Called once per tick.  Updates the resources based on the production of the buildings in the grid.'''
-        from resource import singleton_resource
-        for row in self.squares:
-            for square in row:
-                singleton_resource.give(square.produce())
+        resource = self.state.resource
+        amounts = resource.amounts
+        multipliers = self.output_multipliers()
+        if multipliers is None:
+            for row in self.squares:
+                for square in row:
+                    n = square.num_workers
+                    if n:
+                        output = productivity(n)
+                        for i, rate in production_vectors[square.code]:
+                            amounts[i] += rate * output
+        else:
+            for r, row in enumerate(self.squares):
+                for c, square in enumerate(row):
+                    n = square.num_workers
+                    if n:
+                        output = productivity(n) * multipliers[r, c]
+                        for i, rate in production_vectors[square.code]:
+                            amounts[i] += rate * output
+        resource.check_watches()
 
     def num_workers_on_grid(self):
         '''Returns the number of workers on the grid.  Useful for counting how
@@ -171,52 +306,81 @@ class Grid:
         '''selects a random worker on the grid and "eliminates" it".  This
         happens when the population is starving and there are no idle workers to
         kill.'''
+        self.kill_workers_on_grid(1)
 
-        # the number of workers left to consider
-        n = self.num_workers_on_grid()
-        for row in self.squares:
-            for square in row:
-                # the chance that we should choose one of the workers on the
-                # current square
-                if isinstance(square, Farm) and n > 1: # don't remove farmers if we don't have to
-                    p = 0.0
-                else:
-                    try:
-                        p = float(square.num_workers) / n
-                    except ZeroDivisionError:
-                        p = 0.0
-                    if random.random() < p:
-                        square.num_workers -= 1
-                        return
-                # if we don't pick a worker on the current square, reduce the
-                # number of workers left to consider
-                n -= square.num_workers
+    def kill_workers_on_grid(self, count):
+        '''"eliminates" count random workers on the grid in a single pass.
+        Farmers are only chosen once nobody else is left. Returns the number of
+        workers still on the grid.'''
+        # one entry per worker, so sampling is uniform over workers
+        others, farmers = [], []
+        for r, row in enumerate(self.squares):
+            for c, square in enumerate(row):
+                pool = farmers if isinstance(square, Farm) else others
+                pool.extend([(r, c)] * square.num_workers)
+        total = len(others) + len(farmers)
+        if count <= 0:
+            return total
+
+        victims = random.sample(others, min(count, len(others)))
+        victims += random.sample(farmers, min(count - len(victims), len(farmers)))
+        for r, c in victims:
+            self.set_workers(r, c, self.squares[r][c].num_workers - 1)
+        return total - len(victims)
 
     def paint(self):
-        ''' Update the display of the grid. ''' 
+        ''' Update the display of the grid. The squares are only painted again
+        after something on the grid has changed.'''
         screen = pygame.display.get_surface()
+        snapshot = self.state.snapshot if self.state is not None else None
+        view = self.view
+        if snapshot is not None and snapshot.grid_version != self.painted_version:
+            view = None
+        if view is None:
+            w, h = self.rect().size
+            # one pixel extra for the lines along the right and bottom edges
+            view = pygame.Surface((w + 1, h + 1))
+            view.fill((255, 255, 255))
+            self.paint_squares(view, snapshot)
+            self.view = view
+            self.painted_version = snapshot.grid_version if snapshot is not None else None
+        screen.blit(view, (0, 0))
 
+    def paint_squares(self, screen, snapshot=None):
+        ''' Paint every square, and the lines between them, onto screen. If a
+        snapshot is given, the squares are drawn from it.'''
 
-        # paint each square
-        for r, row in enumerate(self.squares):
-            for c, sq in enumerate(row):
-                sq.paint(c*Grid.cell_width, r*Grid.cell_height,
-                        Grid.cell_width, Grid.cell_height)
+        # paint each square on the screen
+        r0, c0 = self.origin
+        vr, vc = self.visible_size()
+        if snapshot is not None:
+            # the snapshot may be from before the grid changed size
+            vr, vc = min(vr, snapshot.codes.shape[0] - r0), min(vc, snapshot.codes.shape[1] - c0)
+        for r in range(vr):
+            for c in range(vc):
+                if snapshot is None:
+                    square = self.squares[r0 + r][c0 + c]
+                else:
+                    # the game runs on another thread; draw what it published
+                    square = Cell(int(snapshot.codes[r0 + r, c0 + c]),
+                                  int(snapshot.workers[r0 + r, c0 + c]))
+                Square.paint(square, c*Grid.cell_width, r*Grid.cell_height,
+                             Grid.cell_width, Grid.cell_height, screen)
                 
         # paint the lines between squares
-        grid_w = Grid.cell_width * self.cols()
-        grid_h = Grid.cell_height * self.rows()
+        grid_w = Grid.cell_width * vc
+        grid_h = Grid.cell_height * vr
         line_color = (170, 200, 170)
-        for r in range(self.rows() + 1):
+        for r in range(vr + 1):
             y = Grid.cell_height * r
             pygame.draw.line(screen, line_color,
                 (0, y), (grid_w, y))
-        for c in range(self.cols() + 1):
+        for c in range(vc + 1):
             x = Grid.cell_width * c
             pygame.draw.line(screen, line_color,
                 (x, 0), (x, grid_h))
 
 
-# There is only one instance of Grid per game.
+# The grid of the interactive game (see gamestate.global_state).
 singleton_grid = Grid()
 
@@ -0,0 +1,102 @@
+'''
+An overlay that tints each square on the screen by how much of one resource it
+produces per tick. A square with all the workers it can take is tinted the
+most, so under-staffed squares stand out, and since output grows with the
+square root of the workers, crowding a square only deepens its tint a little.
+
+The tints of all the squares on the screen are worked out at once in a NumPy
+array and written into a small alpha surface, one pixel per square, which is
+scaled up and blitted over the grid in one go. That is only redone when
+workers or squares change or the view scrolls (or on every tick, if the game
+tracks each worker's skill).
+'''
+
+import numpy as np
+import pygame
+
+import square
+from square import productivity
+from grid import Grid
+from events import CellChanged, WorkersChanged
+
+max_workers = 5
+
+# The tint used for each resource.
+tints = {
+    'Food': (255, 220, 0),
+    'Wood': (0, 160, 0),
+    'Gold': (255, 140, 0),
+}
+modes = (None, 'Food', 'Wood', 'Gold')
+
+
+class Heatmap(object):
+
+    def __init__(self, state):
+        self.state = state
+        self.resource = None # which resource is shown, or None when off
+        self.overlay = None
+        self.key = None      # what the overlay was made from
+        self.version = 0     # goes up whenever squares or workers change
+        state.events.subscribe(CellChanged, self.on_change)
+        state.events.subscribe(WorkersChanged, self.on_change)
+
+    def on_change(self, event):
+        self.version += 1
+
+    def toggle(self):
+        ''' Show the next resource, or turn the overlay off after the last.'''
+        self.resource = modes[(modes.index(self.resource) + 1) % len(modes)]
+
+    def rates(self):
+        ''' Output of one worker on each type of square.'''
+        return np.array([dict(produces).get(self.resource, 0.0) for produces in square.PRODUCES])
+
+    def output(self):
+        ''' The output of every square on the screen, indexed [c, r].'''
+        grid = self.state.grid
+        r0, c0 = grid.origin
+        vr, vc = grid.visible_size()
+        snapshot = self.state.snapshot
+        if snapshot is not None:
+            codes = snapshot.codes[r0:r0 + vr, c0:c0 + vc].T
+            workers = snapshot.workers[r0:r0 + vr, c0:c0 + vc].T
+        else:
+            rows = grid.squares[r0:r0 + vr]
+            codes = np.array([[sq.code for sq in row[c0:c0 + vc]] for row in rows]).T
+            workers = np.array([[sq.num_workers for sq in row[c0:c0 + vc]] for row in rows]).T
+        output = self.rates()[codes] * np.sqrt(workers)
+        multipliers = grid.output_multipliers()
+        if multipliers is not None:
+            output *= multipliers[r0:r0 + vr, c0:c0 + vc].T
+        return output
+
+    def render(self):
+        output = self.output()
+        best = self.rates().max() * productivity(max_workers)
+        strength = np.clip(output / best, 0.0, 1.0) if best > 0 else np.zeros(output.shape)
+        w, h = output.shape
+        small = pygame.Surface((w, h), pygame.SRCALPHA)
+        rgb = pygame.surfarray.pixels3d(small)
+        rgb[...] = tints[self.resource]
+        del rgb
+        alpha = pygame.surfarray.pixels_alpha(small)
+        alpha[...] = (strength * 160).astype(np.uint8)
+        del alpha
+        return pygame.transform.scale(small, (w * Grid.cell_width, h * Grid.cell_height))
+
+    def paint(self):
+        if self.resource is None:
+            return
+        state = self.state
+        snapshot = state.snapshot
+        version = snapshot.grid_version if snapshot is not None else self.version
+        key = (self.resource, state.grid.origin, version)
+        if state.workers is not None:
+            # Workers get more skilled every tick, which changes the output
+            # without any event.
+            key += ((snapshot or state).ticks,)
+        if key != self.key:
+            self.overlay = self.render()
+            self.key = key
+        pygame.display.get_surface().blit(self.overlay, (0, 0))
@@ -0,0 +1,94 @@
+'''
+Recent history of the resources, for drawing trends.
+
+Every tick's amounts go into a fixed-size ring buffer, and are also averaged
+into coarser tiers (one sample per month and per year of game time), each with
+its own ring buffer of the same size. Old samples are overwritten, so the
+memory used stays the same however long the game goes on.
+'''
+
+import numpy as np
+
+from level import months_per_tick
+
+# (name, ticks per sample) for each tier, finest first.
+tiers = (
+    ('tick' , 1),
+    ('month', int(round(1 / months_per_tick))),
+    ('year' , int(round(12 / months_per_tick))),
+)
+tier_names = tuple(name for name, ticks in tiers)
+
+
+class Ring(object):
+    ''' The last `length` samples of a few series.'''
+
+    def __init__(self, length, width):
+        self.samples = np.zeros((length, width))
+        self.count = 0 # samples pushed so far, including overwritten ones
+        self.changes = 0 # pushes and clears, ever
+
+    def push(self, values):
+        self.samples[self.count % len(self.samples)] = values
+        self.count += 1
+        self.changes += 1
+
+    def clear(self):
+        self.count = 0
+        self.changes += 1
+
+    def series(self, i):
+        ''' The samples of series i that are still kept, oldest first.'''
+        length = len(self.samples)
+        if self.count <= length:
+            return self.samples[:self.count, i]
+        start = self.count % length
+        return np.concatenate((self.samples[start:, i], self.samples[:start, i]))
+
+    def kept(self):
+        ''' A copy of all the samples still kept, oldest first, one row per
+        sample.'''
+        length = len(self.samples)
+        if self.count <= length:
+            return self.samples[:self.count].copy()
+        start = self.count % length
+        return np.concatenate((self.samples[start:], self.samples[:start]))
+
+
+class History(object):
+
+    def __init__(self, width, length=120):
+        self.rings = dict((name, Ring(length, width)) for name in tier_names)
+        self.ticks_per_sample = dict(tiers)
+        # running sums for the coarser tiers
+        self.sums = dict((name, np.zeros(width)) for name in tier_names[1:])
+        self.ticks = 0
+
+    def push(self, values):
+        ''' Record one tick's values.'''
+        self.rings['tick'].push(values)
+        self.ticks += 1
+        for name in tier_names[1:]:
+            total = self.sums[name]
+            total += values
+            n = self.ticks_per_sample[name]
+            if self.ticks % n == 0:
+                self.rings[name].push(total / n)
+                total[:] = 0.0
+
+    def clear(self):
+        for ring in self.rings.values():
+            ring.clear()
+        for total in self.sums.values():
+            total[:] = 0.0
+        self.ticks = 0
+
+    def series(self, tier, i):
+        return self.rings[tier].series(i)
+
+    def version(self, tier):
+        ''' Changes whenever the tier gets a new sample or is cleared.'''
+        return self.rings[tier].changes
+
+    def kept(self, tier):
+        return self.rings[tier].kept()
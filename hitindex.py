@@ -0,0 +1,49 @@
+'''
+A uniform-grid spatial index for finding what is under the mouse. The screen
+is split into square buckets, and each widget is listed in every bucket its
+rectangle touches, so a lookup only looks at the few widgets near the point
+no matter how many there are.
+'''
+
+import pygame
+
+
+class HitIndex:
+
+    def __init__(self, size, bucket_size=50):
+        self.bucket_size = bucket_size
+        width, height = size
+        self.cols = (width + bucket_size - 1) // bucket_size
+        self.rows = (height + bucket_size - 1) // bucket_size
+        self.buckets = [[] for i in range(self.rows * self.cols)]
+
+    def add(self, rect, target):
+        ''' Register target as covering rect. Targets added later are on top
+        of the ones added before.'''
+        rect = pygame.Rect(rect)
+        b = self.bucket_size
+        c0, c1 = max(rect.left // b, 0), min((rect.right - 1) // b, self.cols - 1)
+        r0, r1 = max(rect.top // b, 0), min((rect.bottom - 1) // b, self.rows - 1)
+        for r in range(r0, r1 + 1):
+            for c in range(c0, c1 + 1):
+                self.buckets[r * self.cols + c].append((rect, target))
+
+    def remove(self, target):
+        for bucket in self.buckets:
+            bucket[:] = [entry for entry in bucket if entry[1] is not target]
+
+    def find(self, pos):
+        ''' The topmost target whose rectangle holds pos, or None.'''
+        for target in self.find_all(pos):
+            return target
+        return None
+
+    def find_all(self, pos):
+        ''' Every target whose rectangle holds pos, topmost first.'''
+        x, y = pos
+        c, r = int(x) // self.bucket_size, int(y) // self.bucket_size
+        if not (0 <= r < self.rows and 0 <= c < self.cols):
+            return
+        for rect, target in reversed(self.buckets[r * self.cols + c]):
+            if rect.collidepoint(x, y):
+                yield target
@@ -0,0 +1,189 @@
+'''
+
+A host for many headless games in one process. Each session is its own
+GameState; a single asyncio task steps every session at its own rate, and
+clients drive the sessions over a local socket.
+
+The protocol is one JSON object per line in each direction. Every request has
+an "op", and every reply has "ok" (and "error" when ok is false):
+
+    {"op": "new", "level": 0, "rate": 100}      -> {"ok": true, "session": 1}
+    {"op": "act", "session": 1, "action": "assign", "r": 3, "c": 4}
+    {"op": "step", "session": 1, "ticks": 500}
+    {"op": "state", "session": 1}               -> {"ok": true, "state": {...}}
+    {"op": "rate", "session": 1, "rate": 0}
+    {"op": "close", "session": 1}
+    {"op": "list"}                              -> {"ok": true, "sessions": [1, ...]}
+
+The rate is in ticks per second; a session with rate 0 only moves when it is
+sent "step". The actions are the ones in action_modes.
+
+Usage: python host.py [--host 127.0.0.1] [--port 8765]
+
+'''
+
+import os
+import sys
+import json
+import asyncio
+import itertools
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pygame
+pygame.init()
+
+from gamestate import GameState
+from skipahead import fast_forward
+from square import toString
+from constants import *
+
+action_modes = {
+    'build_house': BUILD_HOUSE,
+    'build_farm' : BUILD_FARM,
+    'build_mine' : BUILD_MINE,
+    'destroy'    : DESTROY_BUILDING,
+    'assign'     : ASSIGN_WORKER,
+    'remove'     : REMOVE_WORKER,
+}
+
+
+class Session:
+    ''' One headless game.'''
+
+    def __init__(self, session_id, level_index=0, rate=100):
+        self.id = session_id
+        self.state = GameState()
+        self.state.goto_level(level_index)
+        self.rate = rate
+        self.ticks = 0
+        self.pending = 0.0 # fractional ticks owed by the scheduler
+
+    def act(self, action, r, c):
+        ''' Perform an action on a cell, as if it were clicked.'''
+        grid = self.state.grid
+        if not (0 <= r < grid.rows() and 0 <= c < grid.cols()):
+            raise ValueError("cell ({0}, {1}) is off the grid".format(r, c))
+        grid.perform(action_modes[action], (r, c))
+
+    def step(self, ticks):
+        fast_forward(self.state, ticks)
+        self.ticks += ticks
+
+    def advance(self, seconds):
+        ''' Step as many ticks as the rate allows in the given time.'''
+        self.pending += self.rate * seconds
+        ticks = int(self.pending)
+        self.pending -= ticks
+        self.step(ticks)
+
+    def snapshot(self):
+        ''' The state of the game as plain data. Messages are only reported
+        once.'''
+        state = self.state
+        squares = state.grid.squares
+        messages, state.messages = state.messages, []
+        return {
+            'ticks': self.ticks,
+            'level': state.current_level,
+            'time_remaining': state.time_remaining,
+            'resources': dict(state.resource.resources),
+            'warning': state.warning,
+            'messages': messages,
+            'grid': [[toString(sq) for sq in row] for row in squares],
+            'workers': [[sq.num_workers for sq in row] for row in squares],
+        }
+
+
+class Host:
+
+    def __init__(self, frame_rate=100):
+        self.frame_rate = frame_rate
+        self.sessions = {}
+        self.ids = itertools.count(1)
+
+    def session(self, request):
+        try:
+            return self.sessions[request['session']]
+        except KeyError:
+            raise ValueError("no such session: {0}".format(request.get('session')))
+
+    def handle(self, request):
+        ''' Carry out one request and return the reply.'''
+        op = request.get('op')
+        if op == 'new':
+            session = Session(next(self.ids), request.get('level', 0), request.get('rate', 100))
+            self.sessions[session.id] = session
+            return {'ok': True, 'session': session.id}
+        if op == 'list':
+            return {'ok': True, 'sessions': sorted(self.sessions)}
+        if op == 'act':
+            self.session(request).act(request['action'], request['r'], request['c'])
+        elif op == 'step':
+            self.session(request).step(request.get('ticks', 1))
+        elif op == 'state':
+            return {'ok': True, 'state': self.session(request).snapshot()}
+        elif op == 'rate':
+            self.session(request).rate = request['rate']
+        elif op == 'close':
+            del self.sessions[self.session(request).id]
+        else:
+            raise ValueError("unknown op: {0}".format(op))
+        return {'ok': True}
+
+    async def serve_client(self, reader, writer):
+        ''' Answer one client's requests until it disconnects.'''
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    reply = self.handle(json.loads(line))
+                except Exception as e:
+                    reply = {'ok': False, 'error': str(e)}
+                writer.write((json.dumps(reply) + '\n').encode('utf-8'))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def run_sessions(self):
+        ''' Step every session once per frame. Control goes back to the event
+        loop every few sessions so that clients are answered promptly.'''
+        loop = asyncio.get_running_loop()
+        frame = 1.0 / self.frame_rate
+        next_frame = loop.time()
+        while True:
+            for i, session in enumerate(list(self.sessions.values())):
+                session.advance(frame)
+                if i % 50 == 49:
+                    await asyncio.sleep(0)
+            next_frame += frame
+            # If we have fallen behind, don't try to catch up in a burst.
+            next_frame = max(next_frame, loop.time())
+            await asyncio.sleep(next_frame - loop.time())
+
+    async def serve(self, host='127.0.0.1', port=8765, ready=None):
+        server = await asyncio.start_server(self.serve_client, host, port)
+        if ready is not None:
+            ready(server)
+        stepper = asyncio.ensure_future(self.run_sessions())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            stepper.cancel()
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--frame-rate', type=int, default=100)
+    args = parser.parse_args(argv)
+    asyncio.run(Host(args.frame_rate).serve(args.host, args.port))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
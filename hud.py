@@ -0,0 +1,85 @@
+'''
+Cached surfaces for the heads-up display. Rendering text with pygame is slow,
+and most of the HUD (resource counts, the level goal, the time left, tooltips)
+only changes now and then. A Panel remembers the inputs it was last rendered
+from and only renders again when they change. A panel whose inputs change on
+an event is told so with set() instead, and draws with current(), so nothing
+has to be compared on frames when nothing happened.
+'''
+
+import pygame
+
+
+class Panel:
+    ''' A surface made by render(key), which is re-rendered only when the key
+    is different from last time.'''
+
+    def __init__(self, render):
+        self.render = render
+        self.key = None
+        self.surface = None
+        self.renders = 0 # how many times it has actually been rendered
+        # For set() and current(): (key,), replaced whenever the key is.
+        self.wanted = None
+        self.shown = None
+
+    def get(self, key):
+        if self.surface is None or key != self.key:
+            self.surface = self.render(key)
+            self.key = key
+            self.renders += 1
+        return self.surface
+
+    def set(self, key):
+        ''' Draw key from now on. It isn't rendered until current() is
+        called, so this can be called from the simulation thread.'''
+        self.wanted = (key,)
+
+    def current(self):
+        ''' The surface for the key last given to set().'''
+        wanted = self.wanted
+        if wanted is not self.shown:
+            self.surface = self.render(wanted[0])
+            self.key = wanted[0]
+            self.shown = wanted
+            self.renders += 1
+        return self.surface
+
+
+def stack_lines(lines, font, color):
+    ''' Render some lines of text on top of each other, on a transparent
+    surface just big enough to hold them.'''
+    texts = [font.render(line, True, color) for line in lines]
+    w = max([t.get_width() for t in texts] + [1])
+    h = max(sum(t.get_height() for t in texts), 1)
+    surface = pygame.Surface((w, h), pygame.SRCALPHA)
+    y = 0
+    for t in texts:
+        surface.blit(t, (0, y))
+        y += t.get_height()
+    return surface
+
+
+def sparkline(values, size, color, background=(255, 255, 255)):
+    ''' A small line graph of values, stretched to fill size. It is drawn
+    straight into a pixel array with pygame.surfarray, and the background is
+    made transparent with a colorkey.'''
+    import numpy as np
+    w, h = size
+    pixels = np.empty((w, h, 3), np.uint8)
+    pixels[:] = background
+    values = np.asarray(values, float)
+    if len(values) > 1:
+        # one value per column, scaled so the lowest is at the bottom
+        ys = np.interp(np.linspace(0, len(values) - 1, w), np.arange(len(values)), values)
+        low, high = ys.min(), ys.max()
+        span = high - low if high > low else 1.0
+        rows = ((h - 1) - (ys - low) / span * (h - 1)).round().astype(int)
+        # join each column to the next, so steep changes don't leave gaps
+        top = np.minimum(rows, np.append(rows[1:], rows[-1]))
+        bottom = np.maximum(rows, np.append(rows[1:], rows[-1]))
+        y = np.arange(h)
+        pixels[(y >= top[:, None]) & (y <= bottom[:, None])] = color
+    surface = pygame.surfarray.make_surface(pixels)
+    surface.set_colorkey(background)
+    return surface
@@ -2,37 +2,65 @@ import pygame
 from resource import singleton_resource
 from button import *
 from constants import *
-from message import render_warning, word_wrap, width_warning, current_warning
+from message import render_warning, word_wrap, width_warning
+from hud import Panel, stack_lines
+from hitindex import HitIndex
+from square import build_types
 
 
 class Interface:
     cursor_map = {
         NORMAL           : pygame.image.load('img/normal.png'),
-        BUILD_HOUSE      : pygame.image.load('img/house.png'),
-        BUILD_FARM       : pygame.image.load('img/farm.png'),
-        BUILD_MINE       : pygame.image.load('img/mine.png'),
         DESTROY_BUILDING : pygame.image.load('img/remove worker.png'),
         ASSIGN_WORKER    : pygame.image.load('img/assign worker.png'),
         REMOVE_WORKER    : pygame.image.load('img/remove worker.png')
     }
+    # the build modes, from buildings.json
+    cursor_map.update((mode, pygame.image.load('img/' + build['cursor']))
+                      for mode, (code, build) in build_types.items())
 
     def __init__(self):
         ''' Initialize an interface by creating the Mode buttons and the fonts
         for tooltips, level and time.  Set the default mode to be NORMAL,
         i.e. no button is activated.'''
         self.buttons = []
-        for label, mode, x, y, tip in mode_buttons():
-            btn = ModeButton(x, y, label, mode, tip)
+        for label, mode, x, y, tip, width in mode_buttons():
+            btn = ModeButton(x, y, label, mode, tip, width)
             self.buttons.append(btn)
 
         self.pause_button = PauseButton(650, 180)
         self.buttons.append(self.pause_button)
 
+        # Everything that can be clicked, so a click or hover only has to
+        # look at what is near the mouse.
+        self.hit_index = HitIndex((800, 600))
+        for btn in self.buttons:
+            self.hit_index.add(btn.rect, btn)
+        self.hovered = None
+        self.minimap = None # set up once the game state exists
+        self.heatmap = None
+
+        # The mode images as colour cursors, which the OS draws and moves by
+        # itself. If they can't be used, the image is drawn by paint_cursor
+        # instead.
+        self.cursors = {}
+        try:
+            for mode, img in Interface.cursor_map.items():
+                hotspot = (img.get_width()//2, img.get_height()//2)
+                self.cursors[mode] = pygame.cursors.Cursor(hotspot, img)
+        except (AttributeError, TypeError, pygame.error):
+            self.cursors = {}
+        self.hardware_cursor = bool(self.cursors)
+
         self.__mode__ = NORMAL
         self.tip = None
         self.font_tips = pygame.font.SysFont("arial", 20)
         self.font_level = pygame.font.SysFont("arial", 28)
         self.font_time = pygame.font.SysFont("arial", 14)
+        self.level_panel = Panel(self.render_level)
+        self.goal_panel = Panel(self.render_goal)
+        self.time_panel = Panel(self.render_time)
+        self.tooltip_panel = Panel(self.render_tooltip)
 
     def get_mode(self):
         return self.__mode__
@@ -41,77 +69,121 @@ class Interface:
         """set_mode sets the interface mode to the given value (which is a
         number in the enum given above).  Any active buttons are deactivated."""
         self.__mode__ = mode
+        if self.hardware_cursor:
+            self.restore_cursor()
+
+    def restore_cursor(self):
+        ''' Show the cursor for the current mode, after something else (like
+        the pause menu) has changed it.'''
+        if self.hardware_cursor:
+            try:
+                pygame.mouse.set_cursor(self.cursors[self.__mode__])
+                pygame.mouse.set_visible(True)
+                return
+            except pygame.error:
+                # e.g. the video driver has no cursors
+                self.hardware_cursor = False
+        pygame.mouse.set_visible(False)
+
+    def add_widget(self, rect, widget):
+        ''' Make widget.mouse_press(pos) get the clicks inside rect. If it
+        returns False, the click goes on to whatever is under it.'''
+        self.hit_index.add(rect, widget)
 
     def mouse_press(self, pos):
-        ''' The user pressed the mouse.  Check whether it pressed one of our buttons!'''
-        for btn in self.buttons:
-            btn.mouse_press(pos)
+        ''' The user pressed the mouse.  Pass the click on to the button or
+        map under it, if any.'''
+        for widget in self.hit_index.find_all(pos):
+            if widget.mouse_press(pos) is not False:
+                return
+
+    def render_tooltip(self, tip):
+        ''' The tooltip box for some help text, with its background and
+        border.'''
+        PADDING = 3
+        text = stack_lines(tip, self.font_tips, (0, 0, 0))
+        w, h = text.get_width() + 2*PADDING, text.get_height() + 2*PADDING
+        box = pygame.Surface((w, h))
+        box.fill((240, 240, 200))
+        pygame.draw.rect(box, (100, 100, 100), (0, 0, w, h), 1)
+        box.blit(text, (PADDING, PADDING))
+        return box
 
     def draw_tooltip(self, tip):
         ''' If the user is hovering over a button with a tooltip, this method is
-        called.  It renders some help text next to the cursor.'''
+        called.  It draws some help text next to the cursor.'''
         screen = pygame.display.get_surface()
-        texts = [self.font_tips.render(line, True, (0, 0, 0)) for line in tip]
-        w = max(line.get_width() for line in texts)
-        h = sum(line.get_height() for line in texts)
-        all_text = pygame.Surface((w, h), pygame.SRCALPHA)
-        y = 0
-        for line in texts:
-            all_text.blit(line, (0, y))
-            y += line.get_height()
+        box = self.tooltip_panel.get(tip)
 
         # make sure that the text isn't drawn outside of the screen.
-        x, y = pygame.mouse.get_pos()
-        if x + all_text.get_width() > screen.get_width():
-            x -= all_text.get_width()
-        if y + all_text.get_height() > screen.get_height():
-            y -= all_text.get_height()
-
         PADDING = 3
-        x_padded = x - PADDING
-        y_padded = y - PADDING
-        w_padded = w + 2*PADDING
-        h_padded = h + 2*PADDING
+        x, y = pygame.mouse.get_pos()
+        if x + box.get_width() - 2*PADDING > screen.get_width():
+            x -= box.get_width() - 2*PADDING
+        if y + box.get_height() - 2*PADDING > screen.get_height():
+            y -= box.get_height() - 2*PADDING
+        screen.blit(box, (x - PADDING, y - PADDING))
+
+    def render_level(self, level_index):
+        return self.font_level.render("Level {0}".format(level_index + 1), True, (0, 0, 0))
+
+    def render_goal(self, level_index):
+        ''' The level help text.'''
+        from level import time_description, SandboxLevel
+        from gamestate import global_state
+        lvl = global_state.levels[level_index]
+        if isinstance(lvl, SandboxLevel):
+            txt = ["\"The point is that"]
+        else:
+            txt = word_wrap("Raise {0} gold and have {1} workers in {2}".format(lvl.gold_goal, lvl.population_goal, time_description(lvl.duration)), width_warning, self.font_time)
+        txt.append("")
+        return stack_lines(txt, self.font_time, (0, 0, 0))
 
-        pygame.draw.rect(screen, (240, 240, 200), (x_padded, y_padded, w_padded, h_padded))
-        pygame.draw.rect(screen, (100, 100, 100), (x_padded, y_padded, w_padded, h_padded), 1)
-        screen.blit(all_text, (x, y))
+    def render_time(self, txt):
+        return self.font_time.render(txt, True, (0, 0, 0))
 
     def paint(self, flag = True):
-        ''' Redraw all the buttons, the level help, the cursor, and maybe draw a tooltip.'''
-        from level import levels, current_level, time_description, SandboxLevel
+        ''' Redraw all the buttons, the level help, the cursor, and maybe draw a tooltip.
+        The text is kept in panels which are only re-rendered when what they
+        show changes.'''
+        from level import time_description, SandboxLevel
+        from gamestate import global_state
         screen = pygame.display.get_surface()
-        lvl = levels[current_level]
+        # What the game looked like after its last tick; the snapshot has the
+        # same names for these as the state (see simthread.py).
+        view = global_state.snapshot or global_state
+        lvl = global_state.levels[view.current_level]
+
+        # The production overlay goes over the grid, under everything else.
+        if self.heatmap is not None:
+            self.heatmap.paint()
 
         x_center = screen.get_width() - 100
         singleton_resource.paint(x_center, 250)
 
-        txt = "Level {0}".format(current_level + 1)
-        txt = self.font_level.render(txt, True, (0, 0, 0))
+        txt = self.level_panel.current()
         screen.blit(txt, txt.get_rect(centerx=x_center, centery=40))
 
         # Draw the level help text.
-        if isinstance(lvl, SandboxLevel):
-            txt = ["\"The point is that"]
-        else:
-            txt = word_wrap("Raise {0} gold and have {1} workers in {2}".format(lvl.gold_goal, lvl.population_goal, time_description(lvl.duration)), width_warning, self.font_time)
-        txt.append("")
-        lines = [self.font_time.render(line, True, (0, 0, 0)) for line in txt]
-        height = sum([l.get_height() for l in lines])
-        y = 100 - height/2
-        x = screen.get_width() - width_warning
-        for line in lines:
-            screen.blit(line, (x,y))
-            y += line.get_height()
+        txt = self.goal_panel.current()
+        screen.blit(txt, (screen.get_width() - width_warning, 100 - txt.get_height()/2))
+
         if isinstance(lvl, SandboxLevel):
             txt = "there ain't no point.\""
         else:
-            txt = "{0} remaining".format(time_description(lvl.time_remaining))
-        txt = self.font_time.render(txt, True, (0, 0, 0))
+            txt = "{0} remaining".format(time_description(view.time_remaining))
+        txt = self.time_panel.get(txt)
         screen.blit(txt, txt.get_rect(centerx=x_center, centery=120))
 
+        # Work out once what the mouse is over, for the buttons and the tooltip.
+        self.hovered = self.hit_index.find(pygame.mouse.get_pos())
+        if self.minimap is not None and self.minimap.needed():
+            self.minimap.paint()
+
         for btn in self.buttons:
-            btn.paint()
+            btn.paint(btn is self.hovered)
+        if isinstance(self.hovered, Button):
+            self.tip = self.hovered.tooltip()
 
         # Paint the cursor.
         if flag:
@@ -124,7 +196,10 @@ class Interface:
             self.tip = None
     
     def paint_cursor(self):
-    
+        ''' Draw the mode image at the mouse, unless the OS is drawing it
+        for us.'''
+        if self.hardware_cursor:
+            return
         screen = pygame.display.get_surface()
         mouse_x, mouse_y = pygame.mouse.get_pos()
         cursor_img = Interface.cursor_map[self.__mode__]
@@ -136,4 +211,27 @@ class Interface:
     
 
 singleton_interface = Interface()
-pygame.mouse.set_visible(False)
+singleton_interface.restore_cursor()
+
+from gamestate import global_state
+global_state.interface = singleton_interface
+singleton_interface.add_widget(global_state.grid.rect(), global_state.grid)
+
+from minimap import Minimap
+singleton_interface.minimap = Minimap(global_state, (610, 470, 180, 80))
+singleton_interface.add_widget(singleton_interface.minimap.rect, singleton_interface.minimap)
+
+from heatmap import Heatmap
+singleton_interface.heatmap = Heatmap(global_state)
+
+# The warning, level number and goal are only rendered again when the game
+# says they changed.
+from events import WarningChanged, LevelChanged
+from message import warning_panel
+def on_level(event):
+    singleton_interface.level_panel.set(event.level)
+    singleton_interface.goal_panel.set(event.level)
+on_level(LevelChanged(global_state.current_level))
+warning_panel.set(global_state.warning)
+global_state.events.subscribe(LevelChanged, on_level)
+global_state.events.subscribe(WarningChanged, lambda event: warning_panel.set(event.warning))
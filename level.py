@@ -1,18 +1,24 @@
-from random import randint
-from message import show_message, show_warning
+import random
 
-def random_grid_desc(rows, cols, square_counts):
+def random_grid_desc(rows, cols, square_counts, seed=None):
+    ''' Scatter square_counts squares over a grass grid. The same seed always
+    gives the same grid.'''
+    rng = random.Random(seed)
     grid = [['G' for c in range(cols)] for r in range(rows)]
-    for sq, count in square_counts.items():
+    # sorted, so the layout doesn't depend on dict ordering
+    for sq, count in sorted(square_counts.items()):
         for i in range(count):
-            r = randint(0, rows - 1)
-            c = randint(0, cols - 1)
+            r = rng.randint(0, rows - 1)
+            c = rng.randint(0, cols - 1)
             while grid[r][c] != 'G':
-                r = randint(0, rows - 1)
-                c = randint(0, cols - 1)
+                r = rng.randint(0, rows - 1)
+                c = rng.randint(0, cols - 1)
             grid[r][c] = sq
     return grid
 
+# How many months pass on each tick of the game.
+months_per_tick = 0.01
+
 def time_description(months):
     if months == float('inf'):
         return 'infinite'
@@ -27,71 +33,130 @@ def time_description(months):
     return ', '.join(components)
 
 class Level(object):
-    def __init__(self, duration, gold_goal, population_goal, square_counts):
-        from grid import rows, cols
+    def __init__(self, duration, gold_goal, population_goal, square_counts, seed=None, adjacency=None):
         self.duration = duration
         self.gold_goal = gold_goal
         self.population_goal = population_goal
-        self.grid = random_grid_desc(rows, cols, square_counts)
-
-    def begin(self):
-        from grid import singleton_grid, grid_from_description
-        from resource import singleton_resource
-        singleton_grid.squares = grid_from_description(self.grid)
-        self.time_remaining = self.duration
-        singleton_resource.restore_defaults()
-        show_warning("")
-
-    def update(self):
-        from resource import singleton_resource
-        global current_level
-        # Check if victory condition has been met
-        bool0 = singleton_resource.get_total_workers() >= self.population_goal
-        bool1 = singleton_resource.get('Gold') >= self.gold_goal
-        if (bool0 and bool1):
-            try:
-                current_level += 1
-                levels[current_level].begin()
-                show_message("You have conquered this level! Next is level {0}.".format(current_level + 1))
-            except IndexError:
-                show_message("You have beaten each level in the game! We will now take you back to the first level.")
-                current_level = 0
-                levels[current_level].begin()
+        # How many of each square to scatter over the grass, or None for
+        # generated terrain (see terrain.py).
+        self.square_counts = square_counts
+        self.seed = seed
+        # Production bonuses for neighbouring squares; see adjacency.py.
+        self.adjacency = adjacency
+        self._grid = None
+
+    @property
+    def grid(self):
+        ''' The level's map description. It is generated from the seed the
+        first time it is needed and cached as a tuple of square codes per row
+        (codes may be more than one letter, like a grave's 'Gr'), so restarting
+        the level reuses the same layout.'''
+        if self._grid is None:
+            from grid import rows, cols
+            if self.square_counts is None:
+                from terrain import terrain_grid_desc
+                desc = terrain_grid_desc(rows, cols, self.seed)
+            else:
+                desc = random_grid_desc(rows, cols, self.square_counts, self.seed)
+            self._grid = tuple(tuple(row) for row in desc)
+        return self._grid
+
+    def begin(self, state=None):
+        ''' Start (or restart) this level in the given GameState, or in the
+        interactive game if none is given.'''
+        from grid import grid_from_description
+        state = state or _global_state()
+        state.grid.set_adjacency(None)
+        state.grid.squares = grid_from_description(self.grid)
+        state.grid.set_adjacency(self.adjacency)
+        state.time_remaining = self.duration
+        state.level_start = state.ticks
+        state.resource.restore_defaults()
+        state.show_warning("")
+        # Level.update only checks the goals after one of them is crossed.
+        state.resource.clear_watches()
+        state.resource.watch_warnings()
+        if self.gold_goal is not None:
+            state.resource.watch('Gold', self.gold_goal)
+            state.resource.watch('Total Workers', self.population_goal)
+        state.goals_changed = True
+        from events import LevelChanged
+        state.events.emit(LevelChanged(state.current_level))
+
+    def won(self, state=None):
+        ''' Whether the gold and population goals have both been met.'''
+        resource = (state or _global_state()).resource
+        return resource.get_total_workers() >= self.population_goal \
+           and resource.get('Gold') >= self.gold_goal
+
+    def update(self, state=None):
+        state = state or _global_state()
+        # Check if victory condition has been met. That can only have changed
+        # if a resource went past one of the goals.
+        if state.goals_changed:
+            state.goals_changed = False
+            won = self.won(state)
+        else:
+            won = False
+        if won:
+            if state.telemetry is not None:
+                from telemetry import WON
+                state.telemetry.mark(WON)
+            if state.current_level + 1 < len(state.levels):
+                state.goto_level(state.current_level + 1)
+                state.show_message("You have conquered this level! Next is level {0}.".format(state.current_level + 1))
+            else:
+                state.show_message("You have beaten each level in the game! We will now take you back to the first level.")
+                state.goto_level(0)
+            return
 
         # Check if player has run out of time
-        self.time_remaining -= 0.01
-        if self.time_remaining <= 0:
+        state.time_remaining -= months_per_tick
+        if state.time_remaining <= 0:
+            if state.telemetry is not None:
+                from telemetry import TIMED_OUT
+                state.telemetry.mark(TIMED_OUT)
             # Restart the current level
-            show_message("Oh no, you have run out of time!")
-            levels[current_level].begin()
+            state.show_message("Oh no, you have run out of time!")
+            self.begin(state)
 
 class SandboxLevel(Level):
-    def __init__(self, square_counts): ## crashed for unknown reason. Switched to the type(self) thing
-        super(SandboxLevel, self).__init__(None, None, None, square_counts)
+    def __init__(self, square_counts, seed=None, adjacency=None): ## crashed for unknown reason. Switched to the type(self) thing
+        super(SandboxLevel, self).__init__(None, None, None, square_counts, seed, adjacency)
+
+    def begin(self, state=None):
+        state = state or _global_state()
+        super(SandboxLevel, self).begin(state)
+        state.show_warning("You're on your own, now. Have fun.")
 
-    def begin(self):
-        super(SandboxLevel, self).begin()
-        show_warning("You're on your own, now. Have fun.")
+    def won(self, state=None):
+        return False
 
-    def update(self):
+    def update(self, state=None):
         pass
 
 levels = (
-    Level(15*12, 200, 10, {'H': 2, 'M': 1, 'F': 1, 'S': 2, 'T': 2}),
-    Level(8*12, 1500, 20, {'H': 1, 'M': 1, 'F': 1, 'S': 5, 'T': 5}),
-    Level(5*12, 3000, 30, {'H': 1, 'M': 1, 'F': 1, 'S': 5, 'T': 3}),
-    Level(5*12, 5000, 40, {'H': 1, 'M': 1, 'F': 1, 'S': 5, 'T': 3}),
-    Level(6*12, 7000, 60, {'H': 1, 'M': 0, 'F': 0, 'S': 2, 'T': 2}),
-    Level(10*12, 30000, 180 , {'H': 1, 'M': 0, 'F': 0, 'S': 0, 'T': 2}),
-    SandboxLevel({'H': 1, 'T': 2}),
+    Level(15*12, 200, 10, {'H': 2, 'M': 1, 'F': 1, 'S': 2, 'T': 2}, seed=1),
+    Level(8*12, 1500, 20, {'H': 1, 'M': 1, 'F': 1, 'S': 5, 'T': 5}, seed=2),
+    Level(5*12, 3000, 30, {'H': 1, 'M': 1, 'F': 1, 'S': 5, 'T': 3}, seed=3),
+    Level(5*12, 5000, 40, {'H': 1, 'M': 1, 'F': 1, 'S': 5, 'T': 3}, seed=4),
+    Level(6*12, 7000, 60, {'H': 1, 'M': 0, 'F': 0, 'S': 2, 'T': 2}, seed=5),
+    Level(10*12, 30000, 180 , {'H': 1, 'M': 0, 'F': 0, 'S': 0, 'T': 2}, seed=6),
+    SandboxLevel({'H': 1, 'T': 2}, seed=7),
 #    SandboxLevel({'H': 20, 'M': 20, 'F': 20, 'S': 5, 'T': 5}) # boundry case debug level
 )
 
 def goto_level(n):
-    global current_level
-    current_level = n
-    levels[n].begin()
+    _global_state().goto_level(n)
+
+def _global_state():
+    from gamestate import global_state
+    return global_state
 
-current_level = 0
-levels[current_level].begin()
+def __getattr__(name):
+    # The level being played is part of the GameState now, but the
+    # interactive game's is still available as level.current_level.
+    if name == 'current_level':
+        return _global_state().current_level
+    raise AttributeError("module 'level' has no attribute " + repr(name))
 
@@ -16,6 +16,7 @@ from pygame.locals import *
 import time
 import sys
 from imagecache import singleton_image_cache
+from hud import Panel, stack_lines
 
 
 default_cursor = ((16, 19), (0, 0), (128, 0, 192, 0, 160, 0, 144, 0, 136, 0, 132, 0, 130, 0, 129, 0, 128, 128, 128, 64, 128, 32, 128, 16, 129, 240, 137, 0, 148, 128, 164, 128, 194, 64, 2, 64, 1, 128), (128, 0, 192, 0, 224, 0, 240, 0, 248, 0, 252, 0, 254, 0, 255, 0, 255, 128, 255, 192, 255, 224, 255, 240, 255, 240, 255, 0, 247, 128, 231, 128, 195, 192, 3, 192, 1, 128))
@@ -68,8 +69,8 @@ def show_main_menu(paused = False):
                 if key == 'i':
                     draw_instructions(paused)
                 elif key == 's':
-                    from level import goto_level
-                    goto_level(0)
+                    from gamestate import global_state
+                    global_state.command(global_state.goto_level, 0)
                     proceed = True
                 elif key == 'q':
                     pygame.quit()
@@ -331,42 +332,50 @@ def get_input(msg):
     return user_input
 
 
-current_warning = "Without food, your workers will starve. Start by building " \
-                + "farms and placing workers on them."
-
 def show_warning(warning):
     """
     Present the user with a warning, which will be displayed in the corner
     of the screen. This will replace whatever the previous warning was, and it
     will persist until show_warning is called again with a different warning.
     """
-    global current_warning
-    current_warning = warning
+    from gamestate import global_state
+    global_state.show_warning(warning)
+
+def __getattr__(name):
+    # The warning is part of the GameState now, but the interactive game's is
+    # still available as message.current_warning.
+    if name == 'current_warning':
+        from gamestate import global_state
+        return global_state.warning
+    raise AttributeError("module 'message' has no attribute " + repr(name))
+
 
+def _render_warning_lines(warning):
+    # Split the warning into separate lines, and render each line using a
+    # dark gray color
+    return stack_lines(word_wrap(warning, width_warning, font_warning), font_warning, (50, 50, 50))
+
+# The rendered warning, set on every WarningChanged (see interface.py).
+warning_panel = Panel(_render_warning_lines)
 
 def render_warning():
     """Paint the most recent warning to the screen."""
+    from gamestate import global_state
     screen = pygame.display.get_surface()
 
-    # Split the warning into separate lines
-    lines = word_wrap(current_warning, width_warning, font_warning)
-
-    # Render each line using a dark gray color
-    lines = [font_warning.render(l, True, (50, 50, 50)) for l in lines]
-
     # The top-left corner of the warning box
     X_0, Y_0 = 620, 400
-
-    # Blit each line to the screen
-    y = Y_0
-    for line in lines:
-        screen.blit(line, (X_0, y))
-        y += line.get_height()
+    screen.blit(warning_panel.current(), (X_0, Y_0))
 
 def show_pause_menu():
     ''' Show pause menu to the user'''
     from interface import singleton_interface
+    from gamestate import global_state
     screen = pygame.display.get_surface()
+    # A game on a simulation thread doesn't stop by itself.
+    simulation = global_state.simulation
+    if simulation is not None:
+        was_paused, simulation.paused = simulation.paused, True
     #pygame.set_cursor(NORMAL)
     pygame.mouse.set_cursor(default_cursor[0],default_cursor[1],default_cursor[2],default_cursor[3])
     pygame.mouse.set_visible(True)
@@ -408,8 +417,8 @@ def show_pause_menu():
                 elif key == 'c':
                     proceed = True
                 elif key == 'r':
-                    from level import levels, current_level
-                    levels[current_level].begin()
+                    from gamestate import global_state
+                    global_state.command(global_state.level().begin, global_state)
                     proceed= True
                 elif key == 's':
                     save_game()
@@ -425,37 +434,106 @@ def show_pause_menu():
                 
                 
         time.sleep(0.02) # avoid hogging the CPU
-    pygame.mouse.set_visible(False)
+    if simulation is not None:
+        simulation.paused = was_paused
+    singleton_interface.restore_cursor()
     new_render()
     
     
 def save_game():
-    from level import levels, current_level
+    from gamestate import global_state
+    from savegame import save_index
     name = get_input("What should this saved game be called? (You may want to use your first name.)")
     if name.strip() == '':
         return
-    path = get_save_path(name)
-    with open(path, 'w') as f:
-        f.write(str(current_level))
-        f.close()
+    if not save_index.valid_name(name):
+        show_message("Save names can't contain tabs or line breaks.")
+        return
+    global_state.command(save_index.save, name, global_state)
 
 def get_save_path(name):
     '''Convert a save name into a proper file path'''
-    return 'saves/' + name + '.sav'
+    from savegame import save_index
+    return save_index.path(name)
     
 def load_game():
-    from level import goto_level
-    name = get_input("Enter the name of the saved game.")
-    if name.strip() == '':
+    from gamestate import global_state
+    from savegame import save_index
+    name = show_load_menu()
+    if name is None:
         return
-    path = get_save_path(name)
     try:
-        with open(path, 'r') as f:
-            saved_level = int(f.read())
-            goto_level(saved_level)
+        save_index.load(name, global_state)
     except IOError:
         show_message("No save file with that name was found.")
 
+def show_load_menu(per_page=6):
+    ''' Let the user pick a saved game from a list, a page at a time. Returns
+    the name of the save, or None if they cancel.'''
+    from savegame import save_index
+    screen = pygame.display.get_surface()
+    if screen is None:
+        return None
+    entries = save_index.entries()
+    if not entries:
+        show_message("There are no saved games yet.")
+        return None
+
+    pages = (len(entries) + per_page - 1) // per_page
+    page = 0
+    # Each page is drawn over what was on the screen before the menu, so a
+    # shorter page doesn't leave the edge of a longer one showing.
+    background = screen.copy()
+    while True:
+        screen.blit(background, (0, 0))
+        shown = entries[page*per_page:(page + 1)*per_page]
+        x1 = screen.get_width()/2 - width_msg/2
+        PAD = 30
+        ROW = 60
+        height = 2*font_msg.get_linesize() + ROW*len(shown)
+        y1 = screen.get_height()/2 - height/2
+        pygame.draw.rect(screen, (240, 240, 240), (x1 - PAD, y1 - PAD, width_msg + 2*PAD, height + 2*PAD))
+        pygame.draw.rect(screen, (50, 50, 50), (x1 - PAD, y1 - PAD, width_msg + 2*PAD, height + 2*PAD), 4)
+
+        title = "Load Game (page {0} of {1})".format(page + 1, pages)
+        screen.blit(font_msg.render(title, True, (50, 50, 50)), (x1, y1))
+        y = y1 + font_msg.get_linesize()
+        for i, entry in enumerate(shown):
+            thumb = entry.thumbnail()
+            if thumb is not None:
+                screen.blit(thumb, (x1, y + (ROW - thumb.get_height())/2))
+            info = "{0}. {1} - Level {2}".format(i + 1, entry.name, entry.level() + 1)
+            screen.blit(font_msg.render(info, True, (50, 50, 50)), (x1 + 60, y + 4))
+            details = []
+            if entry.time() is not None:
+                details.append(time.strftime("%Y-%m-%d %H:%M", time.localtime(entry.time())))
+            res = entry.resources()
+            if res:
+                details.append("{0} gold, {1} workers".format(res.get('Gold', 0), res.get('Total Workers', 0)))
+            screen.blit(font_warning.render(", ".join(details), True, (90, 90, 90)), (x1 + 60, y + 32))
+            y += ROW
+        hint = "1-{0}: load   N/P: next/previous page   Esc: cancel".format(len(shown))
+        screen.blit(font_warning.render(hint, True, (50, 50, 50)), (x1, y + 4))
+        pygame.display.flip()
+
+        # Wait for a choice
+        choice = None
+        while choice is None:
+            for event in pygame.event.get():
+                if event.type != KEYDOWN:
+                    continue
+                if event.key == K_ESCAPE:
+                    return None
+                elif event.unicode == 'n' and page + 1 < pages:
+                    page += 1
+                    choice = 'page'
+                elif event.unicode == 'p' and page > 0:
+                    page -= 1
+                    choice = 'page'
+                elif event.unicode.isdigit() and 1 <= int(event.unicode) <= len(shown):
+                    return shown[int(event.unicode) - 1].name
+            time.sleep(0.02) # avoid hogging the CPU
+
 def new_render(flag= True):
     ''' Tells everything to repaint themselves'''
     from grid import singleton_grid
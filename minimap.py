@@ -0,0 +1,143 @@
+'''
+An overview of the whole grid, for maps bigger than the screen.
+
+Each cell is one or more pixels (or, on very big maps, cells share pixels and
+one of them is shown), coloured by the square's type and darker the more
+workers it has. The square types and worker counts are kept in NumPy arrays
+and the picture is made from them with pygame.surfarray. After that only the
+pixels of cells that change are rewritten, so drawing it costs a blit per
+frame however big the map is. Clicking the minimap moves the view there.
+
+When the game runs on a simulation thread, the changed cells are found by
+comparing the arrays with the thread's latest snapshot instead.
+'''
+
+import numpy as np
+import pygame
+
+import square
+from events import CellChanged, WorkersChanged
+
+max_shown_workers = 5
+
+
+def palette():
+    ''' The colour of every (type code, number of workers).'''
+    colors = np.array(square.COLOR, float)
+    shade = 1.0 - 0.1 * np.arange(max_shown_workers + 1)
+    return (colors[:, None, :] * shade[None, :, None]).astype(np.uint8)
+
+
+class Minimap(object):
+
+    def __init__(self, state, rect):
+        self.state = state
+        self.rect = pygame.Rect(rect)
+        self.palette = palette()
+        self.surface = None # rebuilt from the grid when None
+        self.changed = []   # cells whose pixels need rewriting
+        self.version = None # the snapshot grid_version shown, if threaded
+        state.events.subscribe(CellChanged, self.on_change)
+        state.events.subscribe(WorkersChanged, self.on_change)
+
+    def needed(self):
+        ''' Whether some of the grid is off the screen.'''
+        grid = self.state.grid
+        return grid.visible_size() != (grid.rows(), grid.cols())
+
+    def on_change(self, event):
+        if self.state.simulation is not None:
+            return # see update()
+        if event.pos is None:
+            self.surface = None
+        elif self.surface is not None:
+            self.changed.append(event.pos)
+
+    def rebuild(self):
+        snapshot = self.state.snapshot
+        if snapshot is not None:
+            codes, workers = snapshot.codes, snapshot.workers
+            self.version = snapshot.grid_version
+        else:
+            squares = self.state.grid.squares
+            codes = [[sq.code for sq in row] for row in squares]
+            workers = [[sq.num_workers for sq in row] for row in squares]
+        # arrays are indexed [c, r], the way surfarray wants them
+        self.codes = np.array(codes, np.int16).T
+        self.workers = np.array(workers, np.int16).T
+        np.clip(self.workers, 0, max_shown_workers, out=self.workers)
+        cols, rows = self.codes.shape
+
+        # Whole pixels per cell if the grid fits, otherwise shrink to fit.
+        cell_px = min(self.rect.width // cols, self.rect.height // rows)
+        if cell_px >= 1:
+            w, h = cols * cell_px, rows * cell_px
+        else:
+            scale = min(float(self.rect.width) / cols, float(self.rect.height) / rows)
+            w, h = max(1, int(cols * scale)), max(1, int(rows * scale))
+        # the cell each pixel column and row shows
+        self.xs = np.arange(w) * cols // w
+        self.ys = np.arange(h) * rows // h
+        pixels = self.palette[self.codes[np.ix_(self.xs, self.ys)],
+                              self.workers[np.ix_(self.xs, self.ys)]]
+        self.surface = pygame.surfarray.make_surface(pixels)
+        self.changed = []
+
+    def pixels_of(self, r, c):
+        ''' The (x, y) pixel slices showing cell (r, c); empty if it is not
+        shown.'''
+        xs, ys = self.xs, self.ys
+        return (slice(np.searchsorted(xs, c), np.searchsorted(xs, c, 'right')),
+                slice(np.searchsorted(ys, r), np.searchsorted(ys, r, 'right')))
+
+    def update(self):
+        ''' Bring the picture up to date with the grid.'''
+        snapshot = self.state.snapshot
+        if snapshot is not None and self.surface is not None and snapshot.grid_version != self.version:
+            codes, workers = snapshot.codes.T, np.minimum(snapshot.workers.T, max_shown_workers)
+            if codes.shape != self.codes.shape:
+                self.surface = None
+            else:
+                c, r = np.nonzero((codes != self.codes) | (workers != self.workers))
+                self.changed = list(zip(r.tolist(), c.tolist()))
+                self.version = snapshot.grid_version
+        if self.surface is None:
+            self.rebuild()
+            return
+        if not self.changed:
+            return
+        squares = self.state.grid.squares
+        pixels = pygame.surfarray.pixels3d(self.surface)
+        for r, c in self.changed:
+            if snapshot is not None:
+                code, n = snapshot.codes[r, c], snapshot.workers[r, c]
+            else:
+                code, n = squares[r][c].code, squares[r][c].num_workers
+            self.codes[c, r] = code
+            self.workers[c, r] = min(n, max_shown_workers)
+            x, y = self.pixels_of(r, c)
+            pixels[x, y] = self.palette[code, self.workers[c, r]]
+        del pixels # unlock the surface
+        self.changed = []
+
+    def paint(self):
+        self.update()
+        screen = pygame.display.get_surface()
+        screen.blit(self.surface, self.rect.topleft)
+        # outline the part of the grid that is on the screen
+        grid = self.state.grid
+        r0, c0 = grid.origin
+        vr, vc = grid.visible_size()
+        x0, x1 = np.searchsorted(self.xs, c0), np.searchsorted(self.xs, c0 + vc)
+        y0, y1 = np.searchsorted(self.ys, r0), np.searchsorted(self.ys, r0 + vr)
+        pygame.draw.rect(screen, (255, 255, 255),
+                         (self.rect.left + x0, self.rect.top + y0, max(x1 - x0, 2), max(y1 - y0, 2)), 1)
+
+    def mouse_press(self, pos):
+        ''' Centre the view on the cell that was clicked. While the minimap
+        isn't shown, clicks go through it (returns False).'''
+        if self.surface is None or not self.needed():
+            return False
+        x, y = pos[0] - self.rect.left, pos[1] - self.rect.top
+        if 0 <= x < len(self.xs) and 0 <= y < len(self.ys):
+            self.state.grid.center_on(int(self.ys[y]), int(self.xs[x]))
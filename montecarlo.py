@@ -0,0 +1,286 @@
+'''
+
+Monte Carlo level balancing. This plays thousands of headless games of each
+level in level.levels and reports how often they are won, how long winning
+takes and how many workers die along the way.
+
+Games are played by bots. A bot looks at the game every so often and performs
+the same actions a player could by clicking on the grid (see Grid.perform).
+Games are spread over a process pool; each worker process plays a batch of
+games and sends the results back together, and the results are added to the
+totals as they arrive.
+
+Usage: python montecarlo.py [--games N] [--bot greedy] [--levels 0,1,2]
+
+'''
+
+import os
+import sys
+import random
+import importlib
+import multiprocessing
+
+# There is no window when balancing levels.
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pygame
+pygame.init()
+
+import level
+from level import months_per_tick, time_description
+from grid import building_cost_vectors
+from gamestate import GameState
+from square import Grass, Tree, Stream, Farm, House, Mine
+from constants import *
+
+
+class Game:
+    ''' What a bot gets to see and do. The actions are the ones a player has
+    when clicking on the grid.'''
+
+    def __init__(self, state):
+        self.state = state
+        self.grid = state.grid
+        self.resource = state.resource
+        self.level = state.level()
+
+    def build(self, mode, r, c):
+        self.grid.perform(mode, (r, c))
+
+    def assign(self, r, c):
+        self.grid.perform(ASSIGN_WORKER, (r, c))
+
+    def remove(self, r, c):
+        self.grid.perform(REMOVE_WORKER, (r, c))
+
+    def destroy(self, r, c):
+        self.grid.perform(DESTROY_BUILDING, (r, c))
+
+    def cells(self, kind):
+        ''' The (r, c) positions of every square of the given class.'''
+        return [(r, c) for r, row in enumerate(self.grid.squares)
+                       for c, sq in enumerate(row) if isinstance(sq, kind)]
+
+    def workers_at(self, pos):
+        r, c = pos
+        return self.grid.squares[r][c].num_workers
+
+    def production(self, name):
+        ''' How much of a resource the grid produces per tick.'''
+        total = 0.0
+        for row in self.grid.squares:
+            for sq in row:
+                total += sq.produce().get(name, 0.0)
+        return total
+
+
+class Bot:
+    ''' A bot policy. act() is called every `interval` ticks.'''
+    interval = 100
+
+    def __init__(self, rng):
+        self.rng = rng
+
+    def act(self, game):
+        pass
+
+class IdleBot(Bot):
+    ''' Never does anything. Useful as a baseline.'''
+
+class RandomBot(Bot):
+    ''' Clicks a random cell in a random mode.'''
+    modes = (BUILD_HOUSE, BUILD_FARM, BUILD_MINE, ASSIGN_WORKER, ASSIGN_WORKER,
+             REMOVE_WORKER, DESTROY_BUILDING)
+
+    def act(self, game):
+        r = self.rng.randrange(game.grid.rows())
+        c = self.rng.randrange(game.grid.cols())
+        game.grid.perform(self.rng.choice(self.modes), (r, c))
+
+class GreedyBot(Bot):
+    ''' Keeps everyone fed, builds houses before the city fills up and puts
+    everyone else to work on gold.'''
+    interval = 25
+
+    def least_worked(self, game, kind):
+        ''' The square of the given kind with the fewest workers, if any has
+        room for another one.'''
+        spots = [pos for pos in game.cells(kind) if game.workers_at(pos) < 5]
+        if not spots:
+            return None
+        return min(spots, key=game.workers_at)
+
+    def build_somewhere(self, game, mode):
+        grass = game.cells(Grass)
+        if grass:
+            r, c = self.rng.choice(grass)
+            game.build(mode, r, c)
+            return True
+        return False
+
+    def act(self, game):
+        res = game.resource
+        workers = res.get_total_workers()
+
+        # Plenty of wood, so send the lumberjacks off to find gold.
+        if res.get('Wood') > 150:
+            for pos in game.cells(Tree):
+                while game.workers_at(pos) > 0:
+                    game.remove(*pos)
+
+        # Houses first, so immigrants have somewhere to live.
+        if workers >= game.grid.population_limit() - 2 and res.has_vector(building_cost_vectors[BUILD_HOUSE]):
+            self.build_somewhere(game, BUILD_HOUSE)
+
+        while res.get('Unemployed') >= 1:
+            hungry = game.production('Food') < 0.006 * res.get_total_workers() \
+                     or res.get('Food') < 30
+            if hungry:
+                kinds = (Farm,)
+            elif res.get('Wood') < 60:
+                kinds = (Tree, Mine, Stream)
+            else:
+                kinds = (Mine, Stream, Tree)
+            for kind in kinds:
+                spot = self.least_worked(game, kind)
+                if spot is not None:
+                    game.assign(*spot)
+                    break
+            else:
+                # nowhere useful to work, so make somewhere
+                mode = BUILD_FARM if hungry else BUILD_MINE
+                if not res.has_vector(building_cost_vectors[mode]) or not self.build_somewhere(game, mode):
+                    break
+
+bots = {
+    'idle': IdleBot,
+    'random': RandomBot,
+    'greedy': GreedyBot,
+}
+
+def get_bot(name):
+    ''' Look up a bot by name, or import one given as "module:Class".'''
+    if name in bots:
+        return bots[name]
+    module, _, cls = name.partition(':')
+    return getattr(importlib.import_module(module), cls)
+
+
+def play(level_index, bot_name, seed, max_ticks=None):
+    ''' Play one game of a level. Returns (level_index, won, months, deaths),
+    where months is how long the game lasted.'''
+    random.seed(seed)
+    state = GameState()
+    state.goto_level(level_index)
+    lvl = state.level()
+    bot = get_bot(bot_name)(random.Random(seed))
+    game = Game(state)
+
+    ticks = int(round(lvl.duration / months_per_tick))
+    if max_ticks is not None:
+        ticks = min(ticks, max_ticks)
+    for tick in range(ticks):
+        if tick % bot.interval == 0:
+            bot.act(game)
+        state.grid.harvest()
+        state.resource.update()
+        if lvl.won(state):
+            return (level_index, True, (tick + 1) * months_per_tick, state.resource.deaths)
+    return (level_index, False, ticks * months_per_tick, state.resource.deaths)
+
+def play_batch(args):
+    ''' Play a batch of games in a worker process and return all the results
+    at once.'''
+    level_index, bot_name, seeds, max_ticks = args
+    return [play(level_index, bot_name, seed, max_ticks) for seed in seeds]
+
+
+class LevelStats:
+    ''' Running totals for one level.'''
+
+    def __init__(self):
+        self.games = 0
+        self.wins = 0
+        self.win_months = []
+        self.deaths = []
+
+    def add(self, won, months, deaths):
+        self.games += 1
+        if won:
+            self.wins += 1
+            self.win_months.append(months)
+        self.deaths.append(deaths)
+
+    def win_rate(self):
+        return float(self.wins) / self.games if self.games else 0.0
+
+    def percentile(self, values, p):
+        values = sorted(values)
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(p * len(values)))]
+
+    def report(self, level_index):
+        lines = ["Level {0}: won {1}/{2} ({3:.1%})".format(
+                    level_index + 1, self.wins, self.games, self.win_rate())]
+        if self.win_months:
+            lines.append("  time to goal: " + ", ".join(
+                "{0} {1}".format(name, time_description(self.percentile(self.win_months, p)))
+                for name, p in (('min', 0.0), ('p10', 0.1), ('median', 0.5), ('p90', 0.9), ('max', 1.0))))
+        if self.deaths:
+            lines.append("  deaths: mean {0:.1f}, median {1}, max {2}".format(
+                float(sum(self.deaths)) / len(self.deaths),
+                self.percentile(self.deaths, 0.5), max(self.deaths)))
+        return '\n'.join(lines)
+
+
+def run(level_indices, bot_name='greedy', games=1000, batch_size=25,
+        processes=None, max_ticks=None, seed=0, progress=None):
+    ''' Play `games` games of each level across a process pool, and return a
+    {level_index: LevelStats} map. progress, if given, is called with the
+    stats after every batch comes back.'''
+    stats = dict((i, LevelStats()) for i in level_indices)
+    tasks = []
+    for i in level_indices:
+        seeds = [seed + i * games + n for n in range(games)]
+        for start in range(0, games, batch_size):
+            tasks.append((i, bot_name, seeds[start:start + batch_size], max_ticks))
+
+    pool = multiprocessing.Pool(processes or multiprocessing.cpu_count())
+    try:
+        for results in pool.imap_unordered(play_batch, tasks):
+            for level_index, won, months, deaths in results:
+                stats[level_index].add(won, months, deaths)
+            if progress is not None:
+                progress(stats)
+    finally:
+        pool.close()
+        pool.join()
+    return stats
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--bot', default='greedy')
+    parser.add_argument('--levels', default=None,
+                        help="comma separated level numbers, counting from 0")
+    parser.add_argument('--batch-size', type=int, default=25)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.levels:
+        indices = [int(i) for i in args.levels.split(',')]
+    else:
+        # The sandbox can't be won, so there is nothing to measure.
+        indices = [i for i, lvl in enumerate(level.levels) if lvl.duration is not None]
+
+    stats = run(indices, args.bot, args.games, args.batch_size, args.processes, seed=args.seed)
+    for i in indices:
+        print(stats[i].report(i))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,8 +1,60 @@
 import pygame
 import random
-import copy
 import math
-from message import show_warning, render_warning
+from array import array
+from hud import Panel, sparkline
+from history import History, tier_names
+from events import ResourceCrossed
+
+# Resources are kept in a fixed-size array of floats. These are their indices,
+# in the order they are displayed.
+resource_names = ('Food', 'Wood', 'Gold', 'Unemployed', 'Total Workers')
+FOOD, WOOD, GOLD, UNEMPLOYED, TOTAL_WORKERS = range(len(resource_names))
+resource_ids = dict((name, i) for i, name in enumerate(resource_names))
+
+# The per-tick sparklines are only redrawn this often, in ticks; redrawing
+# them every frame would cost more than the rest of the HUD put together.
+tick_sparkline_every = 10
+
+# Shown when a worker starves to death.
+starved_warning = "Your workers are starving! Plant some crops and place workers on them."
+
+def cost_vector(resource_map):
+    ''' Compile a {name: amount} map into a tuple of (resource id, amount)
+    pairs, so the names only have to be looked up once.'''
+    return tuple((resource_ids[name], amount) for name, amount in resource_map.items())
+
+
+class ResourceMap(object):
+    ''' A dict-like view of a Resource's amounts, for code that still reads
+    and writes resources by name.'''
+
+    def __init__(self, amounts):
+        self.amounts = amounts
+
+    def __getitem__(self, name):
+        return self.amounts[resource_ids[name]]
+
+    def __setitem__(self, name, amount):
+        self.amounts[resource_ids[name]] = amount
+
+    def __contains__(self, name):
+        return name in resource_ids
+
+    def __iter__(self):
+        return iter(resource_names)
+
+    def __len__(self):
+        return len(resource_names)
+
+    def keys(self):
+        return list(resource_names)
+
+    def values(self):
+        return list(self.amounts)
+
+    def items(self):
+        return list(zip(resource_names, self.amounts))
 
 
 class Resource:
@@ -14,28 +66,50 @@ class Resource:
         'Unemployed': 10,
         'Total Workers': 10
     }
+    default_amounts = array('d', map(default_resources.get, resource_names))
 
     def restore_defaults(self):
-        self.resources = copy.copy(Resource.default_resources)
+        self.amounts[:] = Resource.default_amounts
+        self.deaths = 0 # total deaths this level
+        self.history.clear()
 
     def __init__(self):
-        ''' Initialize the current and previous resource maps, as well as the
+        ''' Initialize the current and previous resource arrays, as well as the
         Font used to draw the resource text.'''
+        # The GameState these resources belong to; set when it joins one.
+        self.state = None
+        # The last few ticks, months and years of every resource.
+        self.history = History(len(resource_names))
+        self.history_tier = 'month' # which one the sparklines show
+        self.amounts = array('d', Resource.default_amounts)
         self.restore_defaults()
-        self.previous_resources = copy.copy(self.resources)
+        # These buffers are reused on every update.
+        self.previous = array('d', self.amounts)
+        self.diff = array('d', [0.0] * len(resource_names))
+        self.resources = ResourceMap(self.amounts)
         self.font = pygame.font.SysFont("arial", 24)
-        self.diff = dict((name, 0) for name in self.resources)
+        # One cached line of text per resource; see paint().
+        self.panels = [Panel(self.render_line) for name in resource_names]
+        self.sparklines = [Panel(self.render_sparkline) for name in resource_names]
+        self.sparkline_samples = None # from a snapshot, while painting
         self.dead_workers = 0 # keeps track of when to add a grave
+        # [resource id, threshold, whether it was at or above it]; see watch()
+        self.watches = []
 
     def get(self, resource_name):
         ''' Given a resource name, return how much of that resource we have.'''
-        return self.resources[resource_name]
+        return self.amounts[resource_ids[resource_name]]
+
+    # has(), spend() and give() take {name: amount} maps. Code that does the
+    # same thing often should compile its map once with cost_vector() and
+    # use the _vector versions below.
 
     def has(self, resource_map):
         ''' For each resource in the keys of resource_map, check whether we have
         that much.'''
-        for name in resource_map:
-            if self.resources[name] < resource_map[name]:
+        amounts = self.amounts
+        for name, amount in resource_map.items():
+            if amounts[resource_ids[name]] < amount:
                 return False
         return True
 
@@ -44,47 +118,173 @@ class Resource:
         count by its value in the map.'''
         if not self.has(resource_map):
             return False
-        for name in resource_map:
-            self.resources[name] -= resource_map[name]
+        amounts = self.amounts
+        for name, amount in resource_map.items():
+            amounts[resource_ids[name]] -= amount
+        if self.watches:
+            self.check_watches()
         return True
 
     def give(self, resource_map):
         ''' Increase the resources for each resource type in the keys by the
         amount in the values of the resource_map.'''
+        amounts = self.amounts
         for name, amount in resource_map.items():
-            self.resources[name] += amount
+            amounts[resource_ids[name]] += amount
+        if self.watches:
+            self.check_watches()
+
+    def watch(self, name, threshold):
+        ''' Post a ResourceCrossed event whenever the resource goes from below
+        threshold to at or above it, or back.'''
+        i = resource_ids[name]
+        self.watches.append([i, threshold, self.amounts[i] >= threshold])
+
+    def clear_watches(self):
+        self.watches = []
+
+    # The warnings that depend only on the resources. Each is shown when a
+    # resource crosses one of warning_thresholds, and taken down when it
+    # crosses back; see on_crossed().
+    starving_warning = "Your workers are starving! Build some farms and place workers on them."
+    crowded_warning = "There are too many unemployed workers. Assign them before more people will come to your city."
+    died_warning = "All of your workers have died! Now would be a good time to restart the level."
+    # (name, threshold) pairs; 'Food' and 'Total Workers' are watched for
+    # running out altogether.
+    warning_thresholds = (('Food', 1e-9), ('Unemployed', 5), ('Total Workers', 1e-9))
+
+    def watch_warnings(self):
+        ''' Watch the thresholds the warnings depend on.'''
+        for name, threshold in Resource.warning_thresholds:
+            self.watch(name, threshold)
+
+    def on_crossed(self, event):
+        ''' Show or take down a warning when a ResourceCrossed event is about
+        one of warning_thresholds.'''
+        if (event.name, event.threshold) not in Resource.warning_thresholds:
+            return
+        state = self.state
+        if event.name == 'Total Workers':
+            if not event.above:
+                state.show_warning(Resource.died_warning)
+            elif state.warning == Resource.died_warning:
+                state.show_warning("")
+        elif event.name == 'Food':
+            if not event.above:
+                if self.amounts[TOTAL_WORKERS] > 0:
+                    state.show_warning(Resource.starving_warning)
+            elif state.warning in (Resource.starving_warning, starved_warning):
+                state.show_warning("")
+        elif event.above:
+            # More idle workers than that, and nobody else comes.
+            if self.amounts[FOOD] > 0:
+                state.show_warning(Resource.crowded_warning)
+        elif state.warning == Resource.crowded_warning:
+            state.show_warning("")
+
+    def check_watches(self):
+        for watch in self.watches:
+            i, threshold, above = watch
+            if (self.amounts[i] >= threshold) != above:
+                watch[2] = not above
+                if self.state is not None:
+                    self.state.events.emit(ResourceCrossed(resource_names[i], threshold, not above))
+
+    def has_vector(self, vector):
+        ''' has() for a vector made by cost_vector().'''
+        amounts = self.amounts
+        for i, amount in vector:
+            if amounts[i] < amount:
+                return False
+        return True
+
+    def spend_vector(self, vector):
+        ''' spend() for a vector made by cost_vector().'''
+        if not self.has_vector(vector):
+            return False
+        amounts = self.amounts
+        for i, amount in vector:
+            amounts[i] -= amount
+        if self.watches:
+            self.check_watches()
+        return True
+
+    def give_vector(self, vector):
+        ''' give() for a vector made by cost_vector().'''
+        amounts = self.amounts
+        for i, amount in vector:
+            amounts[i] += amount
+        if self.watches:
+            self.check_watches()
 
     def kill_worker(self):
         ''' Kill a worker.  Idle workers are killed first, otherwise kill a
         random worker from the grid. '''
-        from grid import singleton_grid
-        
-        if not self.spend({'Unemployed': 1}):
-            singleton_grid.kill_worker_on_grid()
-        
-        total_workers = self.get('Unemployed') + singleton_grid.num_workers_on_grid()
-        if total_workers != 0:
-            show_warning("Your workers are starving! Plant some crops and place workers on them.")
-        self.dead_workers += 1
-        if self.dead_workers == 4: #add a graveyard to the map
-            self.dead_workers = 0
-            singleton_grid.add_grave()
-
-    def update(self):
-        """Consumes some amount of food based on the number of workers"""
-        from grid import singleton_grid
+        self.kill_workers(1)
+
+    def kill_workers(self, n, warning=starved_warning, victims=None):
+        ''' Kill n workers in one go.  Idle workers are killed first, the rest
+        are taken from the grid, and one grave is added for every 4 deaths.
+        The grid is scanned and the warning updated only once, however many
+        workers die. Pass warning=None if the caller shows its own warning.
+
+        If the game tracks individual workers, the victims are chosen by
+        state.workers instead (the hungry are likelier), unless their ids are
+        given.'''
+        grid = self.state.grid
+        if n <= 0:
+            return
+
+        store = self.state.workers
+        if store is not None:
+            if victims is None:
+                victims = store.choose(n)
+            n = len(victims)
+            idle_deaths, squares = store.kill(victims)
+            self.amounts[UNEMPLOYED] -= idle_deaths
+            for (r, c), k in squares:
+                grid.set_workers(r, c, grid.squares[r][c].num_workers - k)
+            busy_workers = grid.num_workers_on_grid()
+        else:
+            # Whole idle workers die first, just like spending one at a time.
+            idle_deaths = min(n, int(math.floor(self.amounts[UNEMPLOYED])))
+            self.amounts[UNEMPLOYED] -= idle_deaths
+            busy_workers = grid.kill_workers_on_grid(n - idle_deaths)
+
+        if warning is not None and self.get('Unemployed') + busy_workers != 0:
+            self.state.show_warning(warning)
+        self.deaths += n
+        self.dead_workers += n
+        graves, self.dead_workers = divmod(self.dead_workers, 4)
+        grid.add_graves(graves)
+
+    def update(self, roll=None):
+        """Consumes some amount of food based on the number of workers. roll is
+        the random number that decides whether a starving worker dies; it is
+        drawn here unless it is given. (If the game tracks individual workers,
+        each one's own hunger decides instead, and roll is not used.)"""
+        amounts = self.amounts
+        store = self.state.workers
         
         # Feed workers.
-        total_workers = self.get('Unemployed') + singleton_grid.num_workers_on_grid()
-        cost = {'Food': total_workers*0.005}
+        total_workers = amounts[UNEMPLOYED] + self.state.grid.num_workers_on_grid()
+        cost = total_workers*0.005
         # If there isn't enough food, then kill one off.
-        if not self.spend(cost) and total_workers > 0.0:
+        if amounts[FOOD] < cost and total_workers > 0.0:
             death_rate = 0.001
-            if random.random() < death_rate*total_workers:
-                self.kill_worker()
-            self.resources['Food'] = 0.0
+            if store is not None:
+                victims = store.update(False, death_rate)
+                self.kill_workers(len(victims), victims=victims)
+            else:
+                if roll is None:
+                    roll = random.random()
+                if roll < death_rate*total_workers:
+                    self.kill_worker()
+            amounts[FOOD] = 0.0
         else: 
-            show_warning("")
+            amounts[FOOD] -= cost
+            if store is not None:
+                store.update(True, 0.0)
             #self.give({'food': 100}) # cannibalism
         
         # Attract workers if gold income is high. Every time they a total of 100 gold, 
@@ -92,79 +292,108 @@ class Resource:
         min_gold_income_per_incoming_worker = 100
         
         # calculate the extra workers added
-        extra_workers = (self.get('Gold') - self.previous_resources['Gold']) \
+        extra_workers = (amounts[GOLD] - self.previous[GOLD]) \
                         / min_gold_income_per_incoming_worker
 
-        if extra_workers > 0:
-            if self.get('Food') > 0:
-                if self.get('Unemployed') < 5:
-                    self.give({'Unemployed': extra_workers})
-                    show_warning("")
-                else:
-                    show_warning("There are too many unemployed workers. Assign them before more people will come to your city.")
-            else:
-                show_warning("Your workers are starving! Build some farms and place workers on them.")  
-        if self.get('Total Workers') == 0.0:
-            show_warning("All of your workers have died! Now would be a good time to restart the level.")
-        # update the record of past resources
-        self.diff = dict(((name, self.resources[name] - self.previous_resources[name]) for name in self.resources))
-        self.previous_resources = copy.copy(self.resources)
+        # (The warnings about all this are shown by on_crossed, when food,
+        # idle workers or the population cross the thresholds that matter.)
+        if extra_workers > 0 and amounts[FOOD] > 0 and amounts[UNEMPLOYED] < 5:
+            amounts[UNEMPLOYED] += extra_workers
+        # update the record of past resources, reusing the same buffers
+        previous, diff = self.previous, self.diff
+        for i in range(len(amounts)):
+            diff[i] = amounts[i] - previous[i]
+        previous[:] = amounts
 
         self.enforce_worker_limit()
-        self.resources['Total Workers'] = self.get_total_workers()
+        if store is not None:
+            store.sync_idle(int(amounts[UNEMPLOYED]))
+        amounts[TOTAL_WORKERS] = self.get_total_workers()
+        self.history.push(amounts)
+        self.check_watches()
         
     def enforce_worker_limit(self):
         ''' Cap the worker count based on the number of house. If there are more
         than capacity, 'kill' off the extra workers (they are 'leaving' because
         there is no space).'''
-        from grid import singleton_grid
-        busy_workers = singleton_grid.num_workers_on_grid()
-        idle_workers = self.get('Unemployed')
-        total_workers = self.get_total_workers()
-        capacity = singleton_grid.population_limit()
+        grid = self.state.grid
+        busy_workers = grid.num_workers_on_grid()
+        total_workers = busy_workers + self.amounts[UNEMPLOYED]
+        capacity = grid.population_limit()
         if total_workers > capacity:
             # First, remove fractional worker, if any
-            self.resources['Unemployed'] = math.floor(idle_workers)
-            total_workers = busy_workers + self.get('Unemployed')
-            show_warning("There is a housing crunch. Build houses before more people will come to your city.")
-            # If still over capacity, kill workers
-            for i in range(int(total_workers - capacity)):
-                self.kill_worker()
+            self.amounts[UNEMPLOYED] = math.floor(self.amounts[UNEMPLOYED])
+            total_workers = busy_workers + self.amounts[UNEMPLOYED]
+            # If still over capacity, kill all of the extra workers at once
+            self.kill_workers(int(total_workers - capacity), warning=None)
+            self.state.show_warning("There is a housing crunch. Build houses before more people will come to your city.")
     
     def get_total_workers(self):
         '''returns the number of idle workers plus the number of workes working'''
-        from grid import singleton_grid
-        busy_workers = singleton_grid.num_workers_on_grid()
-        idle_workers = self.get('Unemployed')
+        busy_workers = self.state.grid.num_workers_on_grid()
+        idle_workers = self.amounts[UNEMPLOYED]
         return busy_workers + idle_workers
 
-    def text_color(self, name):
-        ''' The color of a resource depends on the rate it is changing.'''
-        if name == 'Food' and self.get('Food') == 0:
+    def text_color(self, name, amounts=None, diffs=None):
+        ''' The color of a resource depends on the rate it is changing. The
+        amounts and changes are taken from self unless they are given.'''
+        amounts = self.amounts if amounts is None else amounts
+        diffs = self.diff if diffs is None else diffs
+        if name == 'Food' and amounts[FOOD] == 0:
             return (255, 0, 0)
         
-        diff = self.diff[name]
+        diff = diffs[resource_ids[name]]
         if diff == 0:
             return (0,0,0)
 
         scale = math.log(abs(diff) + 1) * 2000
-        scale = min(scale, 255)
+        # Round to one of 16 shades so the text isn't re-rendered for every
+        # tiny change in the rate.
+        scale = min(int(scale) | 15, 255)
         if diff < 0:
             return (scale, 0, 0)
         return (0, scale, 0)
         
+    def render_line(self, key):
+        name, amount, color = key
+        return self.font.render("{0}: {1}".format(name, amount), True, color)
+
+    def next_history_tier(self):
+        ''' Switch the sparklines to the next coarser tier of history, or
+        back to the finest.'''
+        i = tier_names.index(self.history_tier)
+        self.history_tier = tier_names[(i + 1) % len(tier_names)]
+
+    def render_sparkline(self, key):
+        i, tier, version = key
+        samples = self.sparkline_samples
+        series = self.history.series(tier, i) if samples is None else samples[:, i]
+        return sparkline(series, (180, 24), (200, 200, 230))
+
     def paint(self, x_center, y_base):
-        ''' Redraw the resource levels.'''
+        ''' Redraw the resource levels, each over a faint graph of its recent
+        history. If the game runs on a simulation thread, everything comes
+        from its last snapshot.'''
         screen = pygame.display.get_surface()
-        for i, (name, amount) in enumerate(self.resources.items()):
-            text = self.font.render(
-                    "{0}: {1}".format(name, int(amount)),
-                    True, self.text_color(name))
+        tier = self.history_tier
+        snapshot = self.state.snapshot if self.state is not None else None
+        if snapshot is not None:
+            amounts, diffs = snapshot.amounts, snapshot.diff
+            version, self.sparkline_samples = snapshot.history[tier]
+        else:
+            amounts, diffs = self.amounts, self.diff
+            version, self.sparkline_samples = self.history.version(tier), None
+        if tier == 'tick':
+            version //= tick_sparkline_every
+        for i, (name, amount) in enumerate(zip(resource_names, amounts)):
+            graph = self.sparklines[i].get((i, tier, version))
+            screen.blit(graph, graph.get_rect(centerx=x_center, centery=y_base + 30*i))
+            text = self.panels[i].get((name, int(amount), self.text_color(name, amounts, diffs)))
             textpos = text.get_rect(
                     centerx=x_center,
                     centery=y_base + 30*i)
             screen.blit(text, textpos)
 
-# There is a single resource manager per game.
+# The resource manager of the interactive game (see gamestate.global_state).
 singleton_resource = Resource()
 
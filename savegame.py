@@ -0,0 +1,177 @@
+'''
+Saved games and the index used to browse them.
+
+A save is still a file saves/<name>.sav holding the level number. Next to the
+saves is saves/index.txt, with one line per save:
+
+    <name>\t{"level": 2, "time": 1760000000.0, "resources": {...}, "thumb": "..."}
+
+Saving appends a line, and a later line for a name replaces an earlier one, so
+saving never rewrites the whole index. The browser reads the index once and
+only decodes the entries it shows, so it opens quickly however many saves
+there are.
+'''
+
+import os
+import json
+import time
+
+import pygame
+
+from square import toString, type_codes, COLOR
+
+
+
+class SaveEntry(object):
+    ''' One line of the index. The metadata is only parsed when it is asked
+    for.'''
+
+    def __init__(self, name, raw):
+        self.name = name
+        self.raw = raw
+        self._meta = None
+
+    def meta(self):
+        if self._meta is None:
+            self._meta = json.loads(self.raw)
+        return self._meta
+
+    def level(self):
+        return self.meta()['level']
+
+    def time(self):
+        return self.meta().get('time')
+
+    def resources(self):
+        return self.meta().get('resources', {})
+
+    def thumbnail(self, scale=4):
+        ''' A small picture of the grid, or None if the save has none.'''
+        rows = self.meta().get('thumb')
+        if not rows:
+            return None
+        rows = [row.split(',') for row in rows.split('/')]
+        thumb = pygame.Surface((len(rows[0]), len(rows)))
+        for r, row in enumerate(rows):
+            for c, letter in enumerate(row):
+                thumb.set_at((c, r), COLOR[type_codes[letter]] if letter in type_codes else (0, 0, 0))
+        return pygame.transform.scale(thumb, (thumb.get_width()*scale, thumb.get_height()*scale))
+
+
+class SaveIndex(object):
+
+    def __init__(self, directory='saves'):
+        self.directory = directory
+        self.index_path = os.path.join(directory, 'index.txt')
+        self._entries = None # name -> SaveEntry, read on first use
+        self._lines = 0      # lines in the index file, including replaced ones
+
+    def path(self, name):
+        '''Convert a save name into a proper file path'''
+        return os.path.join(self.directory, name + '.sav')
+
+    def valid_name(self, name):
+        ''' Whether name can be saved under. The index has one tab-separated
+        line per save, so names can't hold tabs or line breaks.'''
+        return not any(c in name for c in '\t\r\n')
+
+    def entries(self):
+        ''' All the saves, newest first.'''
+        if self._entries is None:
+            self._read()
+        return list(reversed(list(self._entries.values())))
+
+    def get(self, name):
+        if self._entries is None:
+            self._read()
+        return self._entries.get(name)
+
+    def __len__(self):
+        if self._entries is None:
+            self._read()
+        return len(self._entries)
+
+    def save(self, name, state):
+        ''' Save the level being played in state, and add it to the index.
+        Raises ValueError if the name isn't valid_name.'''
+        if not self.valid_name(name):
+            raise ValueError("save name {0!r} can't hold tabs or line breaks".format(name))
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        with open(self.path(name), 'w') as f:
+            f.write(str(state.current_level))
+        meta = {
+            'level': state.current_level,
+            'time': time.time(),
+            'resources': dict((k, int(v)) for k, v in state.resource.resources.items()),
+            'thumb': '/'.join(','.join(toString(sq) for sq in row) for row in state.grid.squares),
+        }
+        self._append(name, json.dumps(meta, sort_keys=True))
+
+    def load(self, name, state):
+        ''' Start the saved level in state. Raises IOError if there is no such
+        save.'''
+        with open(self.path(name), 'r') as f:
+            saved_level = int(f.read())
+        state.command(state.goto_level, saved_level)
+
+    def _append(self, name, raw):
+        if self._entries is None:
+            self._read()
+        with open(self.index_path, 'a') as f:
+            f.write(name + '\t' + raw + '\n')
+        self._add(SaveEntry(name, raw))
+        self._lines += 1
+
+    def _add(self, entry):
+        # The entries are kept in the order they were saved in.
+        self._entries.pop(entry.name, None)
+        self._entries[entry.name] = entry
+
+    def _read(self):
+        ''' Read the index, building it from the save files if there isn't
+        one yet. If most of its lines have been replaced, write it out again.'''
+        self._entries = {}
+        self._lines = 0
+        if not os.path.exists(self.index_path):
+            self._rebuild()
+            return
+        with open(self.index_path, 'r') as f:
+            for line in f:
+                name, sep, raw = line.rstrip('\n').partition('\t')
+                if sep:
+                    self._add(SaveEntry(name, raw))
+                    self._lines += 1
+        if self._lines > 2 * len(self._entries) + 100:
+            self._write()
+
+    def _rebuild(self):
+        ''' Index saves that were made before there was an index.'''
+        if not os.path.isdir(self.directory):
+            return
+        filenames = os.listdir(self.directory)
+        filenames.sort(key=lambda f: os.path.getmtime(os.path.join(self.directory, f)))
+        for filename in filenames:
+            name, ext = os.path.splitext(filename)
+            if ext != '.sav':
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                with open(path, 'r') as f:
+                    saved_level = int(f.read())
+            except (IOError, ValueError):
+                continue
+            raw = json.dumps({'level': saved_level, 'time': os.path.getmtime(path)}, sort_keys=True)
+            self._add(SaveEntry(name, raw))
+        self._write()
+
+    def _write(self):
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w') as f:
+            for entry in self._entries.values():
+                f.write(entry.name + '\t' + entry.raw + '\n')
+        os.replace(tmp, self.index_path)
+        self._lines = len(self._entries)
+
+
+save_index = SaveIndex()
@@ -0,0 +1,127 @@
+'''
+Running the game on a thread of its own (application.py --threaded).
+
+Normally the game ticks between frames, so a slow frame or a message box holds
+the game up. A SimulationThread instead ticks a GameState at a fixed rate,
+whatever the screen is doing. Nothing else may touch the state while it runs:
+
+  * After every tick it publishes a Snapshot in state.snapshot, a new
+    immutable record of everything that is drawn (resources and their
+    history, time, warning, and the type and workers of every square). Drawing code reads the latest
+    snapshot; swapping the reference is atomic, so no locks are needed, and
+    while the next tick is worked out the last snapshot stays untouched.
+  * Anything the player does is passed to it with state.command() and is
+    carried out on the thread before the next tick.
+  * Messages the game wants to show (e.g. the level was won) are put in
+    messages for the main thread to show; the game doesn't wait for them.
+
+The square arrays are only copied for a snapshot when a square changed during
+the tick, and each tier of history only when it got a new sample; otherwise
+the previous snapshot's arrays are shared.
+
+    simulation = SimulationThread(global_state)
+    simulation.start()
+'''
+
+import queue
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from events import CellChanged, WorkersChanged
+from history import tier_names
+
+Snapshot = namedtuple('Snapshot', 'ticks current_level time_remaining warning '
+                                  'amounts diff codes workers grid_version history')
+
+
+class SimulationThread(threading.Thread):
+
+    def __init__(self, state, rate=100):
+        super(SimulationThread, self).__init__(name='simulation')
+        self.daemon = True
+        self.state = state
+        self.period = 1.0 / rate
+        self.commands = queue.Queue() # (function, args) to call before a tick
+        self.messages = queue.Queue() # for the main thread to show
+        self.paused = False
+        self.running = True
+        self.ticks = 0
+        self.grid_version = 0
+        self.dirty = True # the square arrays need rebuilding
+        self.codes = self.workers = None
+        state.events.subscribe(CellChanged, self.on_change)
+        state.events.subscribe(WorkersChanged, self.on_change)
+        state.simulation = self
+        self.publish()
+
+    def submit(self, function, *args):
+        self.commands.put((function, args))
+
+    def stop(self):
+        self.running = False
+
+    def on_change(self, event):
+        # Keep the arrays up to date a square at a time where possible.
+        if event.pos is None or self.dirty:
+            self.dirty = True
+        else:
+            r, c = event.pos
+            square = self.state.grid.squares[r][c]
+            self.codes[r, c] = square.code
+            self.workers[r, c] = square.num_workers
+        self.grid_version += 1
+
+    def publish(self):
+        state = self.state
+        previous = state.snapshot
+        if self.dirty:
+            squares = state.grid.squares
+            self.codes = np.array([[sq.code for sq in row] for row in squares], np.int16)
+            self.workers = np.array([[sq.num_workers for sq in row] for row in squares], np.int16)
+            self.dirty = False
+        if previous is not None and previous.grid_version == self.grid_version:
+            codes, workers = previous.codes, previous.workers
+        else:
+            codes, workers = self.codes.copy(), self.workers.copy()
+            codes.flags.writeable = workers.flags.writeable = False
+        resource = state.resource
+        # {tier: (version, samples)}, for the sparklines
+        history = {}
+        for tier in tier_names:
+            version = resource.history.version(tier)
+            if previous is not None and previous.history[tier][0] == version:
+                history[tier] = previous.history[tier]
+            else:
+                samples = resource.history.kept(tier)
+                samples.flags.writeable = False
+                history[tier] = (version, samples)
+        state.snapshot = Snapshot(self.ticks, state.current_level, state.time_remaining,
+                                  state.warning, tuple(resource.amounts), tuple(resource.diff),
+                                  codes, workers, self.grid_version, history)
+
+    def run_commands(self):
+        while True:
+            try:
+                function, args = self.commands.get_nowait()
+            except queue.Empty:
+                return
+            function(*args)
+
+    def run(self):
+        next_tick = time.perf_counter()
+        while self.running:
+            self.run_commands()
+            if not self.paused:
+                self.state.tick()
+                self.ticks += 1
+            self.publish()
+            next_tick += self.period
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -0.25:
+                # Too far behind to catch up; carry on from now.
+                next_tick = time.perf_counter()
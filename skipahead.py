@@ -0,0 +1,197 @@
+'''
+Fast-forwarding a game without playing every tick.
+
+While nobody touches the grid its production is constant, so food, wood and
+gold change by a fixed amount each tick, less what the workers eat, and idle
+workers arrive at a fixed rate while there are fewer than five. The only things
+that break that pattern are food running out, immigration stopping, the houses
+filling up, and the level being won or running out of time. (Once the houses
+are full, newcomers are sent away in the tick they arrive, which is quiet
+again.)
+
+fast_forward() works out in closed form how many ticks can pass before the
+next of those, jumps over all but the last of them, and plays that last one
+with GameState.tick so the real rules deal with whatever happens. During a
+famine each tick kills a worker with a fixed chance, so the tick of the next
+death is drawn from the matching geometric distribution and the game jumps
+straight to it.
+
+    fast_forward(state, 12000)   # ten years, in a few dozen real ticks
+
+Ticks that are jumped over are not seen by telemetry or by the resource
+history.
+'''
+
+import math
+import random
+
+from level import months_per_tick
+from resource import FOOD, WOOD, GOLD, UNEMPLOYED, TOTAL_WORKERS
+from grid import production_vectors
+from square import productivity
+
+# The rules of Resource.update.
+food_per_worker = 0.005
+death_rate = 0.001
+gold_per_immigrant = 100.0
+max_idle_for_immigration = 5
+
+# Ticks of slack left before each event, so rounding never lets a jump pass it.
+MARGIN = 1
+
+
+def production(grid):
+    ''' Food, wood and gold produced by the grid each tick.'''
+    rates = [0.0, 0.0, 0.0]
+    multipliers = grid.output_multipliers()
+    for r, row in enumerate(grid.squares):
+        for c, square in enumerate(row):
+            if square.num_workers:
+                output = productivity(square.num_workers)
+                if multipliers is not None:
+                    output *= multipliers[r, c]
+                for i, rate in production_vectors[square.code]:
+                    rates[i] += rate * output
+    return rates
+
+def first_tick(start, rate, goal):
+    ''' The first tick on which start + tick*rate >= goal, or None.'''
+    if start >= goal:
+        return 0
+    if rate <= 0:
+        return None
+    return int(math.ceil((goal - start) / rate))
+
+
+def fast_forward(state, ticks):
+    ''' Advance state by exactly `ticks` ticks, with the same outcome as
+    calling state.tick() that many times (up to rounding, and with the same
+    odds for starvation deaths).'''
+    if state.workers is not None:
+        # Individual workers learn and go hungry every tick, so there are no
+        # quiet stretches to jump over.
+        for i in range(ticks):
+            state.tick()
+        return
+    while ticks > 0:
+        ticks -= _segment(state, ticks)
+
+def _segment(state, limit):
+    ''' Jump over as many quiet ticks as possible, at most limit - 1, then
+    play one real tick. Returns the number of ticks advanced.'''
+    resource = state.resource
+    amounts = resource.amounts
+    grid = state.grid
+    busy = grid.num_workers_on_grid()
+    idle = amounts[UNEMPLOYED]
+    total = busy + idle
+    capacity = grid.population_limit()
+    # Something happened since the last tick that the closed form doesn't
+    # cover (e.g. gold was spent, or workers were moved).
+    if limit == 1 or abs(amounts[GOLD] - resource.previous[GOLD]) > 1e-9 \
+            or amounts[TOTAL_WORKERS] != total or total > capacity:
+        state.tick()
+        return 1
+
+    food_rate, wood_rate, gold_rate = production(grid)
+    arrivals = gold_rate / gold_per_immigrant
+    lvl = state.level()
+    n = limit
+
+    # The level's deadline and goals.
+    if lvl.duration is not None:
+        n = min(n, int(state.time_remaining / months_per_tick) - MARGIN)
+
+    famine = total > 0 and amounts[FOOD] + food_rate < total * food_per_worker
+    if famine:
+        # Nobody is fed and nobody arrives; only wood and gold change.
+        if lvl.duration is not None:
+            gold_tick = first_tick(amounts[GOLD], gold_rate, lvl.gold_goal)
+            if total >= lvl.population_goal and gold_tick is not None:
+                n = min(n, gold_tick - MARGIN)
+        n = max(n, 1)
+        # The tick of the next death.
+        p = death_rate * total
+        if p >= 1:
+            death = 1
+        else:
+            death = 1 + int(math.log(1.0 - random.random()) / math.log(1.0 - p))
+        roll = 1.0
+        if death <= n:
+            n, roll = death, 0.0
+        _jump(state, n - 1, food_rate, wood_rate, gold_rate, 0.0, famine=True)
+        state.tick(roll)
+        return n
+
+    immigrating = arrivals > 0 and idle < max_idle_for_immigration
+    if immigrating and arrivals < 1 and idle == int(idle) and total + arrivals > capacity:
+        # The houses are full: each newcomer is turned away by
+        # Resource.enforce_worker_limit in the same tick, so nothing changes.
+        immigrating = False
+    if immigrating:
+        n = min(n, int(math.ceil((max_idle_for_immigration - idle) / arrivals)))
+        n = min(n, int((capacity - total) / arrivals) - MARGIN)
+    else:
+        arrivals = 0.0
+
+    if lvl.duration is not None:
+        gold_tick = first_tick(amounts[GOLD], gold_rate, lvl.gold_goal)
+        pop_tick = first_tick(total, arrivals, lvl.population_goal)
+        if gold_tick is not None and pop_tick is not None:
+            n = min(n, max(gold_tick, pop_tick) - MARGIN)
+
+    # Food follows a concave curve while workers arrive, so the ticks on
+    # which there is food left form a run starting at the first one.
+    def food_after(j):
+        return amounts[FOOD] + j * food_rate \
+            - food_per_worker * (j * total + arrivals * j * (j - 1) / 2.0)
+    if arrivals == 0 and food_rate >= total * food_per_worker:
+        pass # food never runs out
+    elif n > 1 and food_after(1) > 1e-9:
+        low, high = 1, n
+        while low < high:
+            mid = (low + high + 1) // 2
+            if food_after(mid) > 1e-9:
+                low = mid
+            else:
+                high = mid - 1
+        n = min(n, low - MARGIN)
+    else:
+        n = 1
+    n = max(n, 1)
+
+    _jump(state, n - 1, food_rate, wood_rate, gold_rate, arrivals)
+    state.tick()
+    return n
+
+def _jump(state, j, food_rate, wood_rate, gold_rate, arrivals, famine=False):
+    ''' Apply j quiet ticks at once.'''
+    if j <= 0:
+        return
+    resource = state.resource
+    amounts = resource.amounts
+    busy = state.grid.num_workers_on_grid()
+    total = busy + amounts[UNEMPLOYED]
+    if famine:
+        amounts[FOOD] = 0.0
+    else:
+        amounts[FOOD] += j * food_rate - food_per_worker * (j * total + arrivals * j * (j - 1) / 2.0)
+    amounts[WOOD] += j * wood_rate
+    amounts[GOLD] += j * gold_rate
+    amounts[UNEMPLOYED] += j * arrivals
+    amounts[TOTAL_WORKERS] = busy + amounts[UNEMPLOYED]
+
+    # What the last of the jumped ticks would have left behind.
+    previous, diff = resource.previous, resource.diff
+    diff[FOOD] = 0.0 if famine else food_rate - food_per_worker * (total + arrivals * (j - 1))
+    diff[WOOD] = wood_rate
+    diff[GOLD] = gold_rate
+    diff[UNEMPLOYED] = arrivals
+    diff[TOTAL_WORKERS] = arrivals
+    previous[:] = amounts
+    # Resource.update records the total before it is brought up to date.
+    previous[TOTAL_WORKERS] -= arrivals
+
+    state.ticks += j
+    if state.level().duration is not None:
+        state.time_remaining -= j * months_per_tick
@@ -0,0 +1,385 @@
+'''
+
+Build-order solver. This searches over build and worker-assignment decisions
+for a level and reports the fastest win it knows of.
+
+The search works on an abstract model of the game rather than on Grid and
+Resource objects. A state is a flat list of numbers: the resources, how many
+houses, farms and mines have been built, and how many workers are on each kind
+of square. Workers on one kind of square are assumed to be spread evenly over
+those squares, which is the best you can do when production grows with the
+square root of the number of workers (see square.productivity).
+
+Decisions are taken once every `step_ticks` ticks. Between decisions
+production is constant, so a whole step is computed in closed form by step(),
+which updates the state in place. States are ranked by an estimate of the time
+left until the goals are met, the best `beam_width` are kept at each step, and
+states that have been seen before (after rounding the resources) are skipped
+using a bounded transposition table.
+
+Usage: python solver.py [--levels 0,1] [--beam-width 500] [--step-ticks 100]
+
+'''
+
+import os
+import sys
+import math
+from collections import OrderedDict
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pygame
+pygame.init()
+
+import level
+from level import months_per_tick, time_description
+from grid import building_costs, buildings
+from resource import Resource
+import square
+from square import square_types, Grass, House, Farm, Mine, Stream, Tree
+from constants import *
+
+# Indices into a state vector.
+FOOD, WOOD, GOLD, IDLE,                     \
+HOUSES, FARMS, MINES, FREE,                 \
+ON_FARMS, ON_MINES, ON_STREAMS, ON_TREES    \
+= range(12)
+STATE_SIZE = 12
+
+# The workable kinds of square, with where their square counts and worker
+# counts live in a state vector. Trees and streams can't be built, so their
+# counts come from the level instead.
+FARM_KIND, MINE_KIND, STREAM_KIND, TREE_KIND = range(4)
+kind_classes = (Farm, Mine, Stream, Tree)
+kind_workers = (ON_FARMS, ON_MINES, ON_STREAMS, ON_TREES)
+kind_names = ('farms', 'mines', 'streams', 'trees')
+
+# What each build mode adds to the state.
+build_slots = {BUILD_HOUSE: HOUSES, BUILD_FARM: FARMS, BUILD_MINE: MINES}
+resource_slots = {'Food': FOOD, 'Wood': WOOD, 'Gold': GOLD}
+
+max_workers_per_square = 5
+food_per_worker = 0.005
+gold_per_immigrant = 100.0
+house_capacity = square.HOUSING[House.code]
+
+
+def production_rate(cls):
+    ''' (resource slot, amount per tick) for one worker on a square of the
+    given class, taken straight from its produce() rule.'''
+    sq = cls()
+    sq.num_workers = 1
+    (name, amount), = sq.produce().items()
+    return resource_slots[name], amount
+
+def even_output(rate, squares, workers):
+    ''' Output of `workers` spread as evenly as possible over `squares`.'''
+    if squares == 0:
+        return 0.0
+    q, rem = divmod(int(workers), squares)
+    return rate * (rem * math.sqrt(q + 1) + (squares - rem) * math.sqrt(q))
+
+
+class Model:
+    ''' The fixed facts about a level that states don't need to carry.'''
+
+    def __init__(self, lvl):
+        if lvl.adjacency:
+            raise ValueError("the solver doesn't model adjacency bonuses")
+        self.level = lvl
+        counts = dict((cls, 0) for cls in square.types)
+        for row in lvl.grid:
+            for code in row:
+                counts[square_types[code]] += 1
+        # Only houses are counted as holding workers. Squares of types the
+        # state has no place for can be left out if they do nothing (like
+        # graves).
+        unknown = [cls.__name__ for cls in square.types if square.HOUSING[cls.code] and cls is not House]
+        unknown += [cls.__name__ for cls, n in counts.items() if n and cls not in (Grass, House) + kind_classes
+                    and (cls().workable() or cls().buildable()) and cls.__name__ not in unknown]
+        if unknown:
+            raise ValueError("the solver doesn't model these square types: " + ', '.join(unknown))
+        self.trees = counts[Tree]
+        self.streams = counts[Stream]
+        self.initial = dict(H=counts[House], F=counts[Farm], M=counts[Mine], G=counts[Grass])
+        self.rates = [production_rate(cls) for cls in kind_classes]
+        self.costs = dict((mode, [(resource_slots[name], amount) for name, amount in cost.items()])
+                          for mode, cost in building_costs.items())
+        self.goal_ticks = int(round(lvl.duration / months_per_tick))
+
+    def initial_state(self):
+        s = [0.0] * STATE_SIZE
+        res = Resource.default_resources
+        s[FOOD], s[WOOD], s[GOLD], s[IDLE] = res['Food'], res['Wood'], res['Gold'], res['Unemployed']
+        s[HOUSES], s[FARMS], s[MINES] = self.initial['H'], self.initial['F'], self.initial['M']
+        s[FREE] = self.initial['G']
+        return s
+
+    def squares(self, s, kind):
+        if kind == FARM_KIND:
+            return int(s[FARMS])
+        if kind == MINE_KIND:
+            return int(s[MINES])
+        if kind == STREAM_KIND:
+            return self.streams
+        return self.trees
+
+    def output(self, s, slot):
+        ''' Production of one resource per tick.'''
+        total = 0.0
+        for kind in range(4):
+            kind_slot, rate = self.rates[kind]
+            if kind_slot == slot:
+                total += even_output(rate, self.squares(s, kind), s[kind_workers[kind]])
+        return total
+
+    def busy(self, s):
+        return s[ON_FARMS] + s[ON_MINES] + s[ON_STREAMS] + s[ON_TREES]
+
+    def step(self, s, ticks):
+        ''' Advance the state by `ticks` ticks in place, following the same
+        rules as Grid.harvest and Resource.update. Returns the tick (counting
+        from 1) on which the goals are met, 0 if they are not met during the
+        step, or -1 if the workers would starve. No containers are allocated,
+        so this can be called millions of times.'''
+        food_rate = self.output(s, FOOD)
+        wood_rate = self.output(s, WOOD)
+        gold_rate = self.output(s, GOLD)
+        busy = self.busy(s)
+        total = busy + s[IDLE]
+        capacity = s[HOUSES] * house_capacity
+
+        # Immigrants arrive each tick while there are fewer than 5 idle
+        # workers and room in the houses.
+        arrivals = gold_rate / gold_per_immigrant
+        immigrating = 0
+        if arrivals > 0:
+            if s[IDLE] < 5:
+                immigrating = int(math.ceil((5 - s[IDLE]) / arrivals))
+            if total < capacity:
+                immigrating = min(immigrating, int(math.ceil((capacity - total) / arrivals)))
+            else:
+                immigrating = 0
+            immigrating = min(immigrating, ticks)
+
+        # Everyone alive at the start of a tick eats. Food changes by a
+        # concave function of time, so it is lowest at one of the two ends.
+        m = immigrating
+        eaten = food_per_worker * (ticks * total + arrivals * (m * (m - 1) / 2.0 + m * (ticks - m)))
+        food = s[FOOD] + ticks * food_rate - eaten
+        if food < 0:
+            return -1
+
+        # When would the goals be met?
+        lvl = self.level
+        won = 0
+        if gold_rate > 0 or s[GOLD] >= lvl.gold_goal:
+            gold_tick = max(1, int(math.ceil((lvl.gold_goal - s[GOLD]) / gold_rate))) \
+                        if s[GOLD] < lvl.gold_goal else 1
+            if total >= lvl.population_goal:
+                pop_tick = 1
+            elif arrivals > 0 and total + arrivals * m >= lvl.population_goal:
+                pop_tick = int(math.ceil((lvl.population_goal - total) / arrivals))
+            else:
+                pop_tick = ticks + 1
+            won = max(gold_tick, pop_tick)
+            if won > ticks:
+                won = 0
+
+        s[FOOD] = food
+        s[WOOD] += ticks * wood_rate
+        s[GOLD] += ticks * gold_rate
+        s[IDLE] = min(s[IDLE] + arrivals * m, capacity - busy)
+        return won
+
+    def estimate(self, s):
+        ''' A rough guess at the number of ticks left before the goals are met.
+        Used to rank states; it is not a bound.'''
+        wood_rate = self.output(s, WOOD)
+        gold_rate = self.output(s, GOLD)
+        lvl = self.level
+        gold_left = max(0.0, lvl.gold_goal - s[GOLD])
+        pop_left = max(0.0, lvl.population_goal - self.busy(s) - s[IDLE])
+        houses_left = max(0.0, lvl.population_goal - s[HOUSES] * house_capacity) / house_capacity
+        wood_left = max(0.0, houses_left * 50 - s[WOOD])
+        return max(gold_left / (gold_rate + 1e-3),
+                   pop_left * gold_per_immigrant / (gold_rate + 1e-3),
+                   wood_left / (wood_rate + 1e-3))
+
+    def key(self, s):
+        ''' The transposition table key: building and worker counts exactly,
+        resources rounded.'''
+        return (int(s[HOUSES]), int(s[FARMS]), int(s[MINES]),
+                int(s[ON_FARMS]), int(s[ON_MINES]), int(s[ON_STREAMS]), int(s[ON_TREES]),
+                int(s[IDLE]), int(s[FOOD] // 5), int(s[WOOD] // 5), int(s[GOLD] // 10))
+
+    def children(self, s):
+        ''' (action, state) for every decision that can be taken from s. An
+        action is a tuple of simple moves: ('build', mode),
+        ('assign', kind, count) and ('move', from_kind, to_kind).'''
+        builds = [()]
+        for mode, slot in build_slots.items():
+            if s[FREE] >= 1 and all(s[r] >= amt for r, amt in self.costs[mode]):
+                builds.append((('build', mode),))
+
+        idle = int(s[IDLE])
+        for build in builds:
+            base = list(s)
+            for move in build:
+                self.apply(base, move)
+            yield build, base
+            if idle >= 1:
+                for kind in range(4):
+                    room = self.room(base, kind)
+                    if room > 0:
+                        child = list(base)
+                        move = ('assign', kind, min(idle, room))
+                        self.apply(child, move)
+                        yield build + (move,), child
+
+        for src in range(4):
+            if s[kind_workers[src]] < 1:
+                continue
+            for dst in range(4):
+                if dst != src and self.room(s, dst) > 0:
+                    child = list(s)
+                    move = ('move', src, dst)
+                    self.apply(child, move)
+                    yield (move,), child
+
+    def room(self, s, kind):
+        return self.squares(s, kind) * max_workers_per_square - int(s[kind_workers[kind]])
+
+    def apply(self, s, move):
+        if move[0] == 'build':
+            mode = move[1]
+            for slot, amount in self.costs[mode]:
+                s[slot] -= amount
+            s[build_slots[mode]] += 1
+            s[FREE] -= 1
+        elif move[0] == 'assign':
+            s[IDLE] -= move[2]
+            s[kind_workers[move[1]]] += move[2]
+        else:
+            s[kind_workers[move[1]]] -= 1
+            s[kind_workers[move[2]]] += 1
+
+
+class TranspositionTable:
+    ''' Remembers the earliest tick each state key was reached, forgetting the
+    least recently used keys once it holds `size` of them.'''
+
+    def __init__(self, size):
+        self.size = size
+        self.table = OrderedDict()
+        self.evictions = 0
+
+    def seen(self, key, tick):
+        ''' Record that key was reached at tick. Returns True if it had
+        already been reached at that tick or earlier.'''
+        best = self.table.get(key)
+        if best is not None and best <= tick:
+            self.table.move_to_end(key)
+            return True
+        self.table[key] = tick
+        self.table.move_to_end(key)
+        if len(self.table) > self.size:
+            self.table.popitem(last=False)
+            self.evictions += 1
+        return False
+
+
+class Solution:
+    ''' The result of a search: the tick the level is won on (None if no win
+    was found) and the decisions that lead there, as (tick, action) pairs.'''
+
+    def __init__(self, level_index, ticks, plan, explored):
+        self.level_index = level_index
+        self.ticks = ticks
+        self.plan = plan
+        self.explored = explored
+
+    def months(self):
+        return None if self.ticks is None else self.ticks * months_per_tick
+
+    def describe(self):
+        head = "Level {0}: ".format(self.level_index + 1)
+        if self.ticks is None:
+            return head + "no win found ({0} states explored)".format(self.explored)
+        lines = [head + "won in {0} ({1} states explored)".format(
+                    time_description(self.months()), self.explored)]
+        for tick, action in self.plan:
+            for move in action:
+                lines.append("  {0:>20}: {1}".format(time_description(tick * months_per_tick) or 'start',
+                                                      describe_move(move)))
+        return '\n'.join(lines)
+
+def describe_move(move):
+    if move[0] == 'build':
+        return "build a " + buildings[move[1]].__name__.lower()
+    if move[0] == 'assign':
+        return "assign {0} to {1}".format(move[2], kind_names[move[1]])
+    return "move one from {0} to {1}".format(kind_names[move[1]], kind_names[move[2]])
+
+
+def solve(level_index, beam_width=500, step_ticks=100, table_size=1000000):
+    ''' Beam search for the fastest win of a level.'''
+    model = Model(level.levels[level_index])
+    table = TranspositionTable(table_size)
+    # a node is (state, parent node, tick, action that led here)
+    beam = [(model.initial_state(), None, 0, ())]
+    explored = 0
+    best = None
+
+    for tick in range(0, model.goal_ticks, step_ticks):
+        ticks = min(step_ticks, model.goal_ticks - tick)
+        candidates = []
+        for node in beam:
+            for action, child in model.children(node[0]):
+                explored += 1
+                if table.seen(model.key(child), tick):
+                    continue
+                won = model.step(child, ticks)
+                if won < 0:
+                    continue
+                child_node = (child, node, tick, action)
+                if won > 0 and (best is None or tick + won < best[0]):
+                    best = (tick + won, child_node)
+                candidates.append((model.estimate(child), -child[GOLD], len(candidates), child_node))
+        if best is not None or not candidates:
+            break
+        candidates.sort()
+        beam = [c[-1] for c in candidates[:beam_width]]
+
+    if best is None:
+        return Solution(level_index, None, [], explored)
+    plan = []
+    node = best[1]
+    while node is not None:
+        if node[3]:
+            plan.append((node[2], node[3]))
+        node = node[1]
+    plan.reverse()
+    return Solution(level_index, best[0], plan, explored)
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--levels', default=None,
+                        help="comma separated level numbers, counting from 0")
+    parser.add_argument('--beam-width', type=int, default=500)
+    parser.add_argument('--step-ticks', type=int, default=100)
+    parser.add_argument('--table-size', type=int, default=1000000)
+    args = parser.parse_args(argv)
+
+    if args.levels:
+        indices = [int(i) for i in args.levels.split(',')]
+    else:
+        indices = [i for i, lvl in enumerate(level.levels) if lvl.duration is not None]
+    for i in indices:
+        print(solve(i, args.beam_width, args.step_ticks, args.table_size).describe())
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,4 +1,7 @@
+import os
+import json
 from math import sqrt
+from collections import namedtuple
 import pygame
 from constants import *
 from imagecache import singleton_image_cache
@@ -10,142 +13,138 @@ def productivity(num_workers):
 
 def fromString(abbrev):
     ''' Return the Square constructor associated with the given letter.'''
-    return {
-        'G': Grass,
-        'T': Tree,
-        'S': Stream,
-        'F': Farm,
-        'H': House,
-        'M': Mine,
-        'Gr': Grave,
-    }[abbrev]()
+    return square_types[abbrev]()
+
+def toString(square):
+    ''' The letter(s) a square is written as in a grid description.'''
+    return square_letters[type(square)]
 
 class Square:
+    ''' A square of the grid. Each kind of square is a subclass made from
+    buildings.json (see load_types below); what it does is looked up in the
+    per-type tables by its code rather than written as methods.'''
+    # One font shared by every square; it is created when first painted.
+    font = None
+    code = None
+
     def __init__(self):
         # squares are unworked by default.
         self.num_workers = 0   
-        self.font = pygame.font.SysFont("arial", 28)
         
 
-    def paint(self, x, y, width, height):
-        screen = pygame.display.get_surface()
+    def paint(self, x, y, width, height, screen=None):
+        if screen is None:
+            screen = pygame.display.get_surface()
         grass = singleton_image_cache.get("grass.png")
 
         screen.blit(grass, (x, y))
-        if self.get_img_name() is not None:
-            image = singleton_image_cache.get(self.get_img_name())
+        sprite = SPRITE[self.code]
+        if sprite is not None:
+            image = singleton_image_cache.get(sprite)
             leftPadding = (width - image.get_width())/2
             topPadding = (height - image.get_height())/2
             screen.blit(image, (x + leftPadding, y + topPadding))
         
         # if the square is workable, display the number of workers on it.
-        if self.workable() and self.num_workers > 0:
-            worker_text = self.font.render(str(self.num_workers), True, (0,0,0))
+        if self.num_workers > 0 and WORKABLE[self.code]:
+            if Square.font is None:
+                Square.font = pygame.font.SysFont("arial", 28)
+            worker_text = Square.font.render(str(self.num_workers), True, (0,0,0))
             screen.blit(worker_text, (x,y))
             
     def get_img_name(self):
-        abstract  # this isn't implemented for an abstract Square.
+        return SPRITE[self.code]
 
     def worked(self):
         return self.num_workers != 0
 
-    def workable(self):    abstract
-    def buildable(self):   abstract
-    def produce(self):     abstract
-    def destroyable(self): abstract
-
-class Grave(Square):
-    def workable(self):
-        return False
-    def buildable(self):
-        return False
-    def produce(self):
-        return {}
-    def destroyable(self):
-        return False
-    def get_img_name(self):
-        return 'grave.png'
-
-class Nature(Square):
-    def workable(self):
-        return True
-
-    def destroyable(self):
-        return False
-
-class Grass(Nature):
-    def buildable(self):
-        return True
-    
-    def get_img_name(self):
-        return None #'grass.png'
-        
     def workable(self):
-        return False
-
-    def produce(self):
-        return {}
-    
-class Tree(Nature):
-    def buildable(self):
-        return False
-
-    def get_img_name(self):
-        return 'tree.png'
-
-    def produce(self):
-        return {'Wood': 0.1*productivity(self.num_workers)}
-
-class Stream(Nature):
-    def buildable(self):
-        return False
-
-    def get_img_name(self):
-        return 'stream.png'
+        return WORKABLE[self.code]
 
-    def produce(self):
-        ''' Streams produce gold more slowly.'''
-        return {'Gold': 0.07*productivity(self.num_workers)}
-
-class Building(Square):
     def buildable(self):
-        return False
-
-    def workable(self):
-        return True
+        return BUILDABLE[self.code]
 
     def destroyable(self):
-        return True
-
-class House(Building):
-    def get_img_name(self):
-        return 'house.png'
-
-    def workable(self):
-        return False
-
-    def produce(self):
-        return {}
-
-class Farm(Building):
-    def get_img_name(self):
-        return 'farm.png'
-        
-    def workable(self):
-        return True
-
-    def produce(self):
-        ''' A farm produces some food.'''
-        return {'Food': 0.05*productivity(self.num_workers)}
-
-class Mine(Building):
-    def get_img_name(self):
-        return 'mine.png'
-        
-    def workable(self):
-        return True
+        return DESTROYABLE[self.code]
 
     def produce(self):
-        ''' Mines produce gold quickly.'''
-        return {'Gold': 0.1*productivity(self.num_workers)}
-
+        n = productivity(self.num_workers)
+        return dict((name, rate*n) for name, rate in PRODUCES[self.code])
+
+# What is drawn for a square when only its type and workers are known (e.g.
+# from a simthread.Snapshot); Square.paint(cell, ...) draws it.
+Cell = namedtuple('Cell', 'code num_workers')
+
+def load_types(path=None):
+    ''' Read the square types from buildings.json and compile them into the
+    tables below, indexed by type code (the type's position in the file), with
+    a Square subclass for each type in square_classes.'''
+    global types, type_codes, WORKABLE, BUILDABLE, DESTROYABLE, SPRITE, \
+           COLOR, PRODUCES, HOUSING, build_types
+    if path is None:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'buildings.json')
+    with open(path) as f:
+        desc = json.load(f)['types']
+    for t in desc:
+        mode = t.get('build', {}).get('mode')
+        if mode is not None and mode not in build_modes:
+            raise ValueError("{0} in {1} has unknown build mode {2!r}; use one of {3}".format(
+                             t['name'], path, mode, ', '.join(sorted(build_modes))))
+
+    types = []
+    square_classes.clear()
+    for code, t in enumerate(desc):
+        cls = type(str(t['name']), (Square,), {'code': code})
+        square_classes[t['name']] = cls
+        types.append(cls)
+    type_codes = dict((t['letter'], code) for code, t in enumerate(desc))
+    WORKABLE = tuple(bool(t['workable']) for t in desc)
+    BUILDABLE = tuple(bool(t['buildable']) for t in desc)
+    DESTROYABLE = tuple(bool(t['destroyable']) for t in desc)
+    SPRITE = tuple(t.get('sprite') for t in desc)
+    COLOR = tuple(tuple(t.get('color', (0, 0, 0))) for t in desc)
+    PRODUCES = tuple(tuple(t.get('produces', {}).items()) for t in desc)
+    HOUSING = tuple(t.get('housing', 0) for t in desc)
+
+    # Interface mode -> (type code, build description). Types that don't
+    # name one of the build modes get a new mode of their own.
+    build_types = {}
+    next_mode = REMOVE_WORKER + 1
+    for code, t in enumerate(desc):
+        if 'build' not in t:
+            continue
+        build = t['build']
+        if 'mode' in build:
+            mode = build_modes[build['mode']]
+        else:
+            mode, next_mode = next_mode, next_mode + 1
+        build_types[mode] = (code, build)
+
+    square_types.clear()
+    square_types.update((t['letter'], types[code]) for code, t in enumerate(desc))
+    square_letters.clear()
+    square_letters.update((cls, letter) for letter, cls in square_types.items())
+
+
+# The interface modes a type in buildings.json can name as its build mode.
+build_modes = {
+    'BUILD_HOUSE': BUILD_HOUSE,
+    'BUILD_FARM' : BUILD_FARM,
+    'BUILD_MINE' : BUILD_MINE,
+}
+
+# The square classes by name, and the letters used for each kind of square in
+# grid descriptions.
+square_classes = {}
+square_types = {}
+square_letters = {}
+load_types()
+
+# The types the game's code refers to by name.
+Grass  = square_classes['Grass']
+Tree   = square_classes['Tree']
+Stream = square_classes['Stream']
+Farm   = square_classes['Farm']
+House  = square_classes['House']
+Mine   = square_classes['Mine']
+Grave  = square_classes['Grave']
@@ -0,0 +1,164 @@
+'''
+Per-tick telemetry for studying the economy.
+
+Each tick, GameState.tick records a row: the resources and how much they
+changed, the deaths so far, the warning being shown and the level clock.
+Level.update marks the row when a level is won or runs out of time. Rows go
+into preallocated typed arrays, one per column; when the arrays are full they
+are handed to a writer thread and fresh ones are used, so recording a tick is
+only a handful of array stores.
+
+The file is a sequence of records, each a kind byte and a little-endian
+uint32 length followed by the payload. Values are in the machine's byte
+order.
+
+    H  a JSON list of [column name, array typecode] pairs
+    S  the UTF-8 text of the next warning; warnings are numbered from 0
+    B  a uint32 row count, then each column's values back to back
+
+Use load(path) to read a run back into NumPy arrays:
+
+    run = telemetry.load('run.tlm')
+    run['gold'], run['food_diff'], run['warnings'][run['warning'][0]]
+
+'''
+
+import json
+import queue
+import struct
+import threading
+from array import array
+
+from resource import resource_names
+
+# Events marked by Level.update.
+NO_EVENT, WON, TIMED_OUT = range(3)
+
+def _column_name(name):
+    return name.lower().replace(' ', '_')
+
+columns = ([('tick', 'q'), ('level', 'b'), ('time_remaining', 'd')]
+           + [(_column_name(name), 'd') for name in resource_names]
+           + [(_column_name(name) + '_diff', 'd') for name in resource_names]
+           + [('deaths', 'q'), ('warning', 'q'), ('event', 'b')])
+
+_record = struct.Struct('<cI')
+_count = struct.Struct('<I')
+
+
+class Telemetry(object):
+
+    def __init__(self, path, block_size=4096):
+        self.path = path
+        self.block_size = block_size
+        self.row = 0        # next row in the current block
+        self.ticks = 0
+        self.warnings = {}  # warning text -> number
+        self.buffers = self._new_buffers()
+        self.queue = queue.Queue()
+        self.file = open(path, 'wb')
+        self._write(b'H', json.dumps(columns).encode('utf-8'))
+        self.writer = threading.Thread(target=self._run_writer, name='telemetry')
+        self.writer.daemon = True
+        self.writer.start()
+
+    def _new_buffers(self):
+        return [array(code, bytes(array(code).itemsize * self.block_size)) for name, code in columns]
+
+    def record_tick(self, state):
+        ''' Add a row for the tick that was just played in state.'''
+        # A full block is only handed over now, so mark() can still reach
+        # the last row of it.
+        if self.row == self.block_size:
+            self.flush()
+        resource = state.resource
+        b = self.buffers
+        i = self.row
+        b[0][i] = self.ticks
+        b[1][i] = state.current_level
+        b[2][i] = state.time_remaining or 0.0
+        n = len(resource_names)
+        for j in range(n):
+            b[3 + j][i] = resource.amounts[j]
+            b[3 + n + j][i] = resource.diff[j]
+        b[-3][i] = resource.deaths
+        warning = self.warnings.get(state.warning)
+        if warning is None:
+            warning = self.warnings[state.warning] = len(self.warnings)
+            self.queue.put((b'S', state.warning.encode('utf-8')))
+        b[-2][i] = warning
+        b[-1][i] = NO_EVENT
+        self.ticks += 1
+        self.row += 1
+
+    def mark(self, event):
+        ''' Mark the last row recorded with a level event.'''
+        if self.row > 0:
+            self.buffers[-1][self.row - 1] = event
+
+    def flush(self):
+        ''' Hand the rows so far to the writer thread and start new buffers.'''
+        if self.row == 0:
+            return
+        self.queue.put((b'B', (self.row, self.buffers)))
+        self.buffers = self._new_buffers()
+        self.row = 0
+
+    def close(self):
+        ''' Write out everything and wait for the writer to finish.'''
+        self.flush()
+        self.queue.put(None)
+        self.writer.join()
+        self.file.close()
+
+    def _write(self, kind, payload):
+        self.file.write(_record.pack(kind, len(payload)))
+        self.file.write(payload)
+
+    def _run_writer(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            kind, payload = item
+            if kind == b'B':
+                rows, buffers = payload
+                payload = _count.pack(rows) + b''.join(buf[:rows].tobytes() for buf in buffers)
+            self._write(kind, payload)
+        self.file.flush()
+
+
+def load(path):
+    ''' Read a telemetry file into a dict of NumPy arrays, one per column,
+    plus 'warnings', the list of warning texts.'''
+    import numpy as np
+    with open(path, 'rb') as f:
+        data = f.read()
+    cols = None
+    blocks = []
+    warnings = []
+    pos = 0
+    while pos + _record.size <= len(data):
+        kind, length = _record.unpack_from(data, pos)
+        pos += _record.size
+        payload = data[pos:pos + length]
+        pos += length
+        if len(payload) < length:
+            break # a truncated run
+        if kind == b'H':
+            cols = [(name, np.dtype(code)) for name, code in json.loads(payload)]
+        elif kind == b'S':
+            warnings.append(payload.decode('utf-8'))
+        elif kind == b'B':
+            blocks.append(payload)
+    parts = dict((name, []) for name, dtype in cols)
+    for payload in blocks:
+        rows, = _count.unpack_from(payload)
+        offset = _count.size
+        for name, dtype in cols:
+            parts[name].append(np.frombuffer(payload, dtype, rows, offset))
+            offset += rows * dtype.itemsize
+    run = {'warnings': warnings}
+    for name, dtype in cols:
+        run[name] = np.concatenate(parts[name]) if parts[name] else np.zeros(0, dtype)
+    return run
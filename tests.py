@@ -6,6 +6,7 @@ from grid       import *
 from square     import *
 from interface  import *
 from imagecache import *
+from hud        import sparkline
 
 import unittest
 
@@ -52,6 +53,128 @@ class OurTests(unittest.TestCase):
         workers = singleton_resource.get('workers')
         self.assertFalse(singleton_resource.spend({'workers': workers + 1}))
     
+    def test_resource_buffers_are_reused(self):
+        ''' Updating resources reuses the same arrays, and the by-name view
+        still works.'''
+        from resource import FOOD
+        singleton_resource.restore_defaults()
+        amounts, previous, diff = singleton_resource.amounts, singleton_resource.previous, singleton_resource.diff
+        singleton_resource.update()
+        self.assertTrue(singleton_resource.amounts is amounts)
+        self.assertTrue(singleton_resource.previous is previous)
+        self.assertTrue(singleton_resource.diff is diff)
+        self.assertTrue(diff[FOOD] < 0)
+        singleton_resource.resources['Wood'] += 5
+        self.assertEqual(singleton_resource.get('Wood'), Resource.default_resources['Wood'] + 5)
+        self.assertEqual(dict(singleton_resource.resources.items())['Wood'], singleton_resource.get('Wood'))
+
+    def test_hud_panels_render_only_on_change(self):
+        ''' Painting the resources again with nothing changed doesn't render
+        any text.'''
+        if pygame.display.get_surface() is None:
+            pygame.display.set_mode((800, 600))
+        singleton_resource.paint(700, 250)
+        renders = [p.renders for p in singleton_resource.panels]
+        singleton_resource.paint(700, 250)
+        self.assertEqual([p.renders for p in singleton_resource.panels], renders)
+        singleton_resource.resources['Gold'] += 10
+        singleton_resource.paint(700, 250)
+        self.assertEqual(singleton_resource.panels[GOLD].renders, renders[GOLD] + 1)
+
+    def test_sparklines_are_not_redrawn_every_tick(self):
+        ''' The sparklines are only rendered again when their graph has moved
+        on by a month, or by several ticks on the per-tick tier.'''
+        if pygame.display.get_surface() is None:
+            pygame.display.set_mode((800, 600))
+        res = Resource()
+        res.paint(700, 250)
+        renders = [p.renders for p in res.sparklines]
+        for t in range(20):
+            res.history.push(res.amounts)
+            res.paint(700, 250)
+        self.assertEqual([p.renders for p in res.sparklines], renders)
+        res.history_tier = 'tick'
+        for t in range(20):
+            res.history.push(res.amounts)
+            res.paint(700, 250)
+        self.assertTrue(all(p.renders - n <= 3 for p, n in zip(res.sparklines, renders)))
+
+    def test_clicks_go_through_the_hit_index(self):
+        ''' A click on a mode button sets its mode, and a click on the map
+        acts on the cell under it.'''
+        house = singleton_interface.buttons[0]
+        self.assertTrue(singleton_interface.hit_index.find(house.rect.center) is house)
+        singleton_interface.mouse_press(house.rect.center)
+        self.assertEqual(singleton_interface.get_mode(), BUILD_HOUSE)
+        singleton_interface.mouse_press((25, 25))
+        self.assertTrue(isinstance(singleton_grid.squares[0][0], House))
+        self.assertEqual(singleton_interface.hit_index.find((790, 590)), None)
+
+    def test_mode_cursor(self):
+        ''' Setting a mode switches the OS cursor, or hides it when the mode
+        image has to be drawn in software.'''
+        singleton_interface.set_mode(BUILD_FARM)
+        if singleton_interface.hardware_cursor:
+            self.assertEqual(pygame.mouse.get_cursor(), singleton_interface.cursors[BUILD_FARM])
+        else:
+            self.assertFalse(pygame.mouse.get_visible())
+
+    def test_history_stays_bounded(self):
+        ''' A long run keeps only the newest samples of each tier, and the
+        coarser tiers hold averages.'''
+        from history import History
+        h = History(2, length=10)
+        for t in range(5000):
+            h.push((t, 1.0))
+        self.assertEqual(list(h.series('tick', 0)), list(range(4990, 5000)))
+        self.assertEqual(h.rings['tick'].samples.shape, (10, 2))
+        self.assertEqual(list(h.series('month', 0)), [t*100 + 49.5 for t in range(40, 50)])
+        self.assertEqual(list(h.series('year', 1)), [1.0]*4)
+        graph = sparkline(h.series('tick', 0), (30, 12), (0, 0, 255))
+        self.assertEqual(graph.get_size(), (30, 12))
+
+    def test_unknown_build_mode(self):
+        ''' A building naming a build mode that doesn't exist is an error, and
+        the types already loaded are left alone.'''
+        import json, os, tempfile
+        import square
+        fd, path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'types': [{'name': 'Tower', 'letter': 'X', 'workable': False,
+                                  'buildable': False, 'destroyable': True,
+                                  'build': {'mode': 'BUILD_TOWR', 'cost': {}}}]}, f)
+        try:
+            self.assertRaises(ValueError, square.load_types, path)
+        finally:
+            os.remove(path)
+        self.assertTrue(square.square_types['H'] is House)
+
+    def test_mode_buttons_fit_on_the_screen(self):
+        ''' However many buildings there are, the mode buttons fit across the
+        screen; the usual six keep their usual places.'''
+        from button import button_row
+        self.assertEqual(button_row(6), ([20 + 130*i for i in range(6)], 110))
+        for count in (7, 9, 12):
+            xs, width = button_row(count)
+            self.assertTrue(xs[-1] + width <= 800)
+            self.assertTrue(all(b - a > width for a, b in zip(xs, xs[1:])))
+
+    def test_harvest_uses_the_type_tables(self):
+        ''' Harvesting from the compiled tables gives what each square's
+        produce() says.'''
+        import square
+        self.assertTrue(square.types[square.type_codes['F']] is Farm)
+        for r, c in [(rows//2 + 1, cols//2), (rows//2 + 1, cols//2 - 1), (rows//2 - 1, cols//2 - 2)]:
+            singleton_grid.squares[r][c].num_workers = 2
+        expected = dict(singleton_resource.resources.items())
+        for row in singleton_grid.squares:
+            for sq in row:
+                for name, amount in sq.produce().items():
+                    expected[name] += amount
+        singleton_grid.harvest()
+        for name, amount in expected.items():
+            self.assertAlmostEqual(singleton_resource.get(name), amount)
+
     def test_building_costs_money(self):
         ''' Check that building a farm reduces the amount of money.'''
         # grab the initial resources, to see whether they go down after we build the farm.
@@ -103,6 +226,26 @@ class OurTests(unittest.TestCase):
         
         self.assertEqual(initial_workers, final_workers)
 
+    def test_housing_crunch_kills_in_one_batch(self):
+        '''Demolishing a house over a full city removes every extra worker
+        and adds one grave per four deaths.'''
+        singleton_resource.restore_defaults()
+        singleton_resource.dead_workers = 0
+        grid_action(0, 0, BUILD_HOUSE)
+        singleton_resource.resources['Unemployed'] = 20
+        for c in range(cols):
+            singleton_grid.squares[1][c] = Tree()
+            singleton_grid.squares[1][c].num_workers = 1
+
+        grid_action(0, 0, DESTROY_BUILDING)
+        singleton_resource.enforce_worker_limit()
+
+        self.assertEqual(singleton_resource.get_total_workers(), 10)
+        self.assertEqual(singleton_resource.get('Unemployed'), 0)
+        graves = sum(isinstance(sq, Grave) for row in singleton_grid.squares for sq in row)
+        self.assertEqual(graves, (20 + cols - 10) // 4)
+        self.assertEqual(singleton_resource.dead_workers, (20 + cols - 10) % 4)
+
     def test_harvest(self):
         '''Thoroughly testing harvest would require setting up lots of grids,
         which would be a lot of work. For now, we will just verify that food
@@ -157,19 +300,40 @@ class OurTests(unittest.TestCase):
 
     def test_level_timing(self):
         '''Assert that time remaining goes down.'''
-        from level import levels, current_level
-        l = levels[current_level]
-        t1 = l.time_remaining
+        from gamestate import global_state
+        l = global_state.level()
+        t1 = global_state.time_remaining
         l.update()
-        t2 = l.time_remaining
+        t2 = global_state.time_remaining
         l.update()
-        t3 = l.time_remaining
+        t3 = global_state.time_remaining
         self.assertTrue(t1 > t2 > t3)
 
+    def test_level_grid_is_seeded_and_cached(self):
+        ''' A level's map depends only on its seed, and is generated once.'''
+        import level
+        counts = {'H': 1, 'M': 1, 'F': 1, 'S': 5, 'T': 3}
+        a = level.Level(60, 100, 10, counts, seed=42)
+        b = level.Level(60, 100, 10, counts, seed=42)
+        self.assertEqual(a.grid, b.grid)
+        self.assertTrue(a.grid is a.grid)
+        self.assertEqual(len(a.grid), rows)
+        self.assertEqual(sum(row.count('S') for row in a.grid), 5)
+
+    def test_level_grid_keeps_long_codes(self):
+        ''' Squares with codes longer than a letter survive the cached layout.'''
+        import level
+        from grid import grid_from_description
+        from square import Grave
+        lvl = level.Level(60, 100, 10, {'H': 1, 'Gr': 2}, seed=3)
+        self.assertEqual(sum(row.count('Gr') for row in lvl.grid), 2)
+        squares = grid_from_description(lvl.grid)
+        self.assertEqual(sum(isinstance(sq, Grave) for row in squares for sq in row), 2)
+
     def test_sandbox_level(self):
         ''' Test that the sandbox level is unbeatable. '''
         import level
-        level.current_level = len(level.levels) - 1
+        level.goto_level(len(level.levels) - 1)
         self.assertTrue(isinstance(level.levels[level.current_level], level.SandboxLevel))
         # Give the player tons of gold
         singleton_resource.give({'gold': 100000000})
@@ -177,6 +341,774 @@ class OurTests(unittest.TestCase):
         # This is the sandbox, so the level should not have changed
         self.assertTrue(isinstance(level.levels[level.current_level], level.SandboxLevel))
 
+class SaveIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.dir)
+
+    def test_saves_are_indexed(self):
+        ''' Saving adds to the index, a later save replaces an earlier one
+        with the same name, and a fresh index reads them back.'''
+        from gamestate import GameState
+        from savegame import SaveIndex
+        state = GameState()
+        state.goto_level(1)
+        index = SaveIndex(self.dir)
+        index.save('first', state)
+        index.save('second', state)
+        state.goto_level(2)
+        index.save('first', state)
+
+        index = SaveIndex(self.dir)
+        self.assertEqual([e.name for e in index.entries()], ['first', 'second'])
+        self.assertEqual(index.get('first').level(), 2)
+        self.assertEqual(index.get('second').resources()['Gold'], int(state.resource.get('Gold')))
+        self.assertEqual(index.get('first').thumbnail(1).get_size(), (cols, rows))
+        index.load('second', state)
+        self.assertEqual(state.current_level, 1)
+
+    def test_old_saves_are_indexed(self):
+        ''' Saves made before the index existed are found.'''
+        import os
+        from savegame import SaveIndex
+        with open(os.path.join(self.dir, 'old.sav'), 'w') as f:
+            f.write('3')
+        index = SaveIndex(self.dir)
+        self.assertEqual(index.get('old').level(), 3)
+        self.assertEqual(index.get('old').thumbnail(), None)
+        self.assertTrue(os.path.exists(index.index_path))
+
+    def test_names_that_would_break_the_index_are_refused(self):
+        ''' A tab or line break in a name would split its index line.'''
+        from gamestate import GameState
+        from savegame import SaveIndex
+        state = GameState()
+        state.goto_level(0)
+        index = SaveIndex(self.dir)
+        for name in ('a\tb', 'a\nb'):
+            self.assertFalse(index.valid_name(name))
+            self.assertRaises(ValueError, index.save, name, state)
+        index.save('fine name', state)
+        self.assertEqual([e.name for e in SaveIndex(self.dir).entries()], ['fine name'])
+
+class GameStateTests(unittest.TestCase):
+
+    def test_games_are_independent(self):
+        ''' Two GameStates don't share grids, resources, levels or warnings.'''
+        from gamestate import GameState, global_state
+        a, b = GameState(), GameState()
+        a.goto_level(0)
+        b.goto_level(1)
+        a.resource.give({'Gold': 50})
+        a.show_warning("only a")
+        a.tick()
+        self.assertEqual(b.resource.get('Gold'), 0)
+        self.assertEqual(b.current_level, 1)
+        self.assertNotEqual(b.warning, "only a")
+        self.assertTrue(a.grid is not b.grid and a.grid is not global_state.grid)
+        self.assertTrue(a.time_remaining < a.level().duration)
+
+    def test_host_over_a_socket(self):
+        ''' A client can create, drive and inspect a session.'''
+        import asyncio, json, host
+
+        async def client():
+            served = asyncio.get_running_loop().create_future()
+            server = asyncio.ensure_future(host.Host().serve(port=0, ready=served.set_result))
+            port = (await served).sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            replies = []
+            for request in ({'op': 'new', 'level': 0, 'rate': 0},
+                            {'op': 'step', 'session': 1, 'ticks': 10},
+                            {'op': 'state', 'session': 1},
+                            {'op': 'act', 'session': 7, 'action': 'assign', 'r': 0, 'c': 0}):
+                writer.write((json.dumps(request) + '\n').encode('utf-8'))
+                replies.append(json.loads(await reader.readline()))
+            writer.close()
+            server.cancel()
+            return replies
+
+        new, step, state, bad = asyncio.run(client())
+        self.assertEqual(new, {'ok': True, 'session': 1})
+        self.assertTrue(step['ok'])
+        self.assertEqual(state['state']['ticks'], 10)
+        self.assertEqual(len(state['state']['grid']), rows)
+        self.assertFalse(bad['ok'])
+
+class VecEnvTests(unittest.TestCase):
+
+    def test_matches_the_game(self):
+        ''' A batch of worlds follows the same rules as a GameState.'''
+        import numpy as np
+        import vecenv
+        from gamestate import GameState
+        desc = GameState().levels[0].grid
+        mine = [(r, row.index('M')) for r, row in enumerate(desc) if 'M' in row][0]
+        farm = [(r, row.index('F')) for r, row in enumerate(desc) if 'F' in row][0]
+        script = {0: (ASSIGN_WORKER,) + mine, 1: (ASSIGN_WORKER,) + mine,
+                  2: (ASSIGN_WORKER,) + farm, 50: (BUILD_FARM, 0, 0) if desc[0][0] == 'G' else (NORMAL, 0, 0),
+                  60: (REMOVE_WORKER,) + mine}
+
+        state = GameState()
+        state.goto_level(0)
+        env = vecenv.VecEnv(3, level_index=0, seed=0)
+        for tick in range(300):
+            mode, r, c = script.get(tick, (NORMAL, 0, 0))
+            if mode != NORMAL:
+                state.grid.perform(mode, (r, c))
+            state.tick()
+            env.step(np.tile([mode, r, c], (3, 1)))
+
+        for name, i in vecenv.resource_index.items():
+            self.assertAlmostEqual(state.resource.get(name), env.resources[0, i])
+            self.assertAlmostEqual(env.resources[2, i], env.resources[0, i])
+        self.assertEqual(state.grid.num_workers_on_grid(), env.busy[0])
+
+    def test_graves_on_a_full_grid(self):
+        ''' With no grass left, graves replace buildings in both, the last
+        house is spared, and a town without houses gets no graves.'''
+        import numpy as np
+        import vecenv
+        from gamestate import GameState
+        desc = ['FMTS' * 3] * 11
+        desc[0] = 'H' + desc[0][1:]
+        desc[5] = 'H' + desc[5][1:]
+        for count, houses in ((200, 2), (200, 0)):
+            if houses == 0:
+                desc = [row.replace('H', 'F') for row in desc]
+            state = GameState()
+            state.grid.squares = [[fromString(letter) for letter in row] for row in desc]
+            env = vecenv.VecEnv(1, level_index=0, seed=0)
+            env.types[0] = [[vecenv.type_codes[letter] for letter in row] for row in desc]
+            env.workers[0] = 0
+            env.houses[0] = (env.types[0] == vecenv.HOUSE).sum()
+            for r, c in ((0, 1), (1, 0), (2, 1)):
+                state.grid.set_workers(r, c, 2)
+                env.workers[0, r, c] = 2
+            env.busy[0] = env.workers[0].sum()
+            env.resources[0] = state.resource.amounts
+            state.grid.add_graves(count)
+            env.add_graves(0, count)
+            # which house is spared is up to chance
+            codes = [vecenv.type_codes[toString(sq)] for row in state.grid.squares for sq in row]
+            self.assertEqual(np.bincount(codes, minlength=7).tolist(),
+                             np.bincount(env.types[0].ravel(), minlength=7).tolist())
+            self.assertEqual(state.grid.num_workers_on_grid(), env.busy[0])
+            self.assertAlmostEqual(state.resource.get('Unemployed'), env.resources[0, vecenv.IDLE])
+            self.assertEqual((env.types[0] == vecenv.HOUSE).sum(), min(houses, 1))
+
+    def test_other_housing_types(self):
+        ''' Any type with housing counts as a house on the grid, and the
+        models refuse types they can't hold.'''
+        import grid, square, level, solver, vecenv
+        from gamestate import GameState
+        saved = square.HOUSING
+        housing = list(saved)
+        housing[Farm.code] = 5
+        square.HOUSING = grid.HOUSING = tuple(housing)
+        try:
+            state = GameState()
+            state.grid.squares = [[Farm(), Grass()], [Grass(), Grass()]]
+            self.assertEqual(state.grid.num_houses(), 1)
+            self.assertFalse(state.grid.demolish(0, 0))
+            self.assertEqual(vecenv.unmodelled_types(), ['Farm'])
+            self.assertRaises(ValueError, vecenv.VecEnv, 1)
+            self.assertRaises(ValueError, solver.Model, level.levels[0])
+        finally:
+            square.HOUSING = grid.HOUSING = saved
+
+class EventTests(unittest.TestCase):
+
+    def test_changes_are_posted(self):
+        ''' The grid and resources post events when they change, and only
+        then.'''
+        from gamestate import GameState
+        from events import WorkersChanged, CellChanged, ResourceCrossed, WarningChanged
+        state = GameState()
+        state.goto_level(0)
+        seen = []
+        for kind in (WorkersChanged, CellChanged, ResourceCrossed, WarningChanged):
+            state.events.subscribe(kind, seen.append)
+        r, c = [(r, c) for r, row in enumerate(state.grid.squares)
+                       for c, sq in enumerate(row) if isinstance(sq, Farm)][0]
+        state.grid.perform(ASSIGN_WORKER, (r, c))
+        state.show_warning("hello")
+        state.show_warning("hello")
+        state.resource.give({'Gold': state.level().gold_goal})
+        self.assertEqual(seen, [WorkersChanged((r, c), 1), WarningChanged("hello"),
+                                ResourceCrossed('Gold', state.level().gold_goal, True)])
+        self.assertTrue(state.goals_changed)
+
+    def test_warnings_follow_crossings(self):
+        ''' The resource warnings go up when a resource crosses a threshold,
+        come down when it crosses back, and nothing is posted in between.'''
+        from gamestate import GameState
+        from events import WarningChanged
+        from resource import Resource
+        state = GameState()
+        state.goto_level(0)
+        seen = []
+        state.events.subscribe(WarningChanged, seen.append)
+        state.resource.spend({'Unemployed': 6})
+        state.resource.give({'Unemployed': 2})
+        self.assertEqual(state.warning, Resource.crowded_warning)
+        state.resource.spend({'Food': state.resource.get('Food')})
+        self.assertEqual(state.warning, Resource.starving_warning)
+        state.tick()
+        state.resource.give({'Food': 50})
+        self.assertEqual(state.warning, "")
+        self.assertEqual(seen, [WarningChanged(Resource.crowded_warning),
+                                WarningChanged(Resource.starving_warning), WarningChanged("")])
+
+    def test_panels_render_when_set(self):
+        ''' A panel driven by set() renders once per new key.'''
+        from hud import Panel
+        panel = Panel(lambda key: pygame.Surface((1, 1)))
+        panel.set("a")
+        for i in range(3):
+            panel.current()
+        panel.set("b")
+        panel.current()
+        self.assertEqual((panel.key, panel.renders), ("b", 2))
+
+class MinimapTests(unittest.TestCase):
+
+    def test_minimap_follows_the_grid(self):
+        ''' A changed cell is redrawn on the minimap, and clicking the minimap
+        scrolls the view.'''
+        from gamestate import GameState
+        from minimap import Minimap
+        import square
+        state = GameState()
+        state.grid.squares = [[Grass() for c in range(40)] for r in range(30)]
+        minimap = Minimap(state, (0, 0, 120, 120))
+        self.assertTrue(minimap.needed())
+        minimap.update()
+        self.assertEqual(minimap.surface.get_size(), (120, 90))
+        state.grid.set_square(2, 5, Farm())
+        minimap.update()
+        self.assertEqual(tuple(minimap.surface.get_at((5*3 + 1, 2*3 + 1)))[:3], square.COLOR[Farm.code])
+        minimap.mouse_press((60, 45))
+        self.assertEqual(state.grid.origin, (15 - rows//2, 20 - cols//2))
+
+    def test_hidden_minimap_lets_clicks_through(self):
+        ''' On a grid that fits the screen the minimap isn't drawn, so a click
+        where it would be goes to whatever is underneath.'''
+        from gamestate import GameState
+        from minimap import Minimap
+        from interface import Interface
+        clicks = []
+        class Below(object):
+            def mouse_press(self, pos):
+                clicks.append(pos)
+        interface = Interface()
+        state = GameState()
+        state.goto_level(0)
+        minimap = Minimap(state, (610, 470, 180, 80))
+        interface.add_widget((600, 400, 200, 150), Below())
+        interface.add_widget(minimap.rect, minimap)
+        minimap.update()
+        self.assertFalse(minimap.needed())
+        interface.mouse_press((650, 500))
+        self.assertEqual(clicks, [(650, 500)])
+
+class HeatmapTests(unittest.TestCase):
+
+    def test_heatmap_tints_by_output(self):
+        ''' Worked squares are tinted more the more they make, and the overlay
+        is only rebuilt when workers change.'''
+        from gamestate import GameState
+        from heatmap import Heatmap
+        state = GameState()
+        state.grid.squares = [[Grass() for c in range(20)] for r in range(20)]
+        state.grid.set_square(0, 0, Farm())
+        state.grid.set_square(0, 1, Farm())
+        state.grid.set_workers(0, 0, 1)
+        state.grid.set_workers(0, 1, 4)
+        heatmap = Heatmap(state)
+        heatmap.toggle()
+        self.assertEqual(heatmap.resource, 'Food')
+        overlay = heatmap.render()
+        alpha = lambda c, r: overlay.get_at((c*Grid.cell_width + 5, r*Grid.cell_height + 5))[3]
+        self.assertEqual(alpha(2, 0), 0)
+        self.assertTrue(0 < alpha(0, 0) < alpha(1, 0))
+        heatmap.paint()
+        painted = heatmap.overlay
+        heatmap.paint()
+        self.assertIs(heatmap.overlay, painted)
+        state.grid.set_workers(0, 0, 2)
+        heatmap.paint()
+        self.assertIsNot(heatmap.overlay, painted)
+
+    def test_heatmap_follows_skill(self):
+        ''' With workers tracked one by one, the overlay is rebuilt as they
+        get more skilled, though nothing was moved.'''
+        from gamestate import GameState
+        from heatmap import Heatmap
+        state = GameState()
+        state.track_workers()
+        state.goto_level(0)
+        heatmap = Heatmap(state)
+        heatmap.toggle()
+        farm = [(r, c) for r, row in enumerate(state.grid.squares)
+                for c, sq in enumerate(row) if isinstance(sq, Farm)][0]
+        for k in range(3):
+            state.grid.perform(ASSIGN_WORKER, farm)
+        state.grid.origin = (max(farm[0] - 1, 0), max(farm[1] - 1, 0))
+        heatmap.paint()
+        key, output = heatmap.key, heatmap.output().sum()
+        for i in range(200):
+            state.tick()
+        heatmap.paint()
+        self.assertNotEqual(heatmap.key, key)
+        self.assertTrue(heatmap.output().sum() > output)
+
+class AdjacencyTests(unittest.TestCase):
+
+    def test_models_refuse_adjacency(self):
+        ''' The shipped levels have no bonuses, since VecEnv and the solver
+        would get them wrong, and both refuse a level that has them.'''
+        import level, solver, vecenv
+        self.assertFalse(any(lvl.adjacency for lvl in level.levels))
+        lvl = level.Level(60, 100, 10, {'H': 1, 'F': 1, 'S': 2}, seed=1,
+                          adjacency={('Farm', 'Stream'): 0.2})
+        self.assertRaises(ValueError, solver.Model, lvl)
+        saved = level.levels
+        level.levels = (lvl,)
+        try:
+            self.assertRaises(ValueError, vecenv.VecEnv, 2, 0)
+        finally:
+            level.levels = saved
+
+    def test_neighbours_change_output(self):
+        ''' A farm by a stream makes more, and changing one square updates its
+        neighbours just as working everything out again would.'''
+        from gamestate import GameState
+        from adjacency import Adjacency
+        import numpy as np
+        state = GameState()
+        state.grid.squares = [[Grass() for c in range(6)] for r in range(5)]
+        state.grid.set_adjacency({('Farm', 'Stream'): 0.2, ('Mine', 'Mine'): -0.1})
+        state.grid.set_square(0, 0, Farm())
+        state.grid.set_square(1, 1, Stream())
+        state.grid.set_square(0, 1, Stream())
+        state.grid.set_square(3, 3, Mine())
+        state.grid.set_square(3, 4, Mine())
+        self.assertAlmostEqual(state.grid.multiplier(0, 0), 1.4)
+        self.assertAlmostEqual(state.grid.multiplier(3, 3), 0.9)
+        self.assertEqual(state.grid.multiplier(2, 2), 1.0)
+        state.grid.demolish(3, 4)
+        self.assertEqual(state.grid.multiplier(3, 3), 1.0)
+        fresh = Adjacency({('Farm', 'Stream'): 0.2, ('Mine', 'Mine'): -0.1})
+        fresh.rebuild(state.grid.squares)
+        self.assertTrue(np.allclose(fresh.multipliers, state.grid.adjacency.multipliers))
+
+        state.resource.restore_defaults()
+        state.grid.set_workers(0, 0, 4)
+        food = state.resource.get('Food')
+        state.grid.harvest()
+        self.assertAlmostEqual(state.resource.get('Food') - food, 0.05 * 2 * 1.4)
+
+class WorkerStoreTests(unittest.TestCase):
+
+    def check_counts(self, state):
+        import numpy as np
+        store = state.workers
+        counts = [sq.num_workers for row in state.grid.squares for sq in row]
+        self.assertEqual(list(store.counts), counts)
+        self.assertEqual(store.idle, int(state.resource.get('Unemployed')))
+        self.assertEqual(len(store), sum(counts) + store.idle)
+        skills = [store.skill[store.cell == i].sum() for i in range(len(counts))]
+        self.assertTrue(np.allclose(store.skills, skills, atol=1e-3))
+
+    def test_store_follows_the_head_counts(self):
+        ''' The store keeps up with clicks, demolitions and starvation, and
+        skilled workers make more.'''
+        from gamestate import GameState
+        state = GameState()
+        state.track_workers()
+        state.goto_level(0)
+        self.check_counts(state)
+        worked = [(r, c) for r, row in enumerate(state.grid.squares)
+                  for c, sq in enumerate(row) if sq.workable()]
+        for pos in worked:
+            for k in range(2):
+                state.grid.perform(ASSIGN_WORKER, pos)
+        state.grid.perform(REMOVE_WORKER, worked[0])
+        self.check_counts(state)
+        for i in range(200):
+            state.tick()
+        self.check_counts(state)
+        self.assertTrue(state.grid.multiplier(*worked[1]) > 1.0)
+        state.grid.perform(REMOVE_WORKER, worked[0])
+        self.assertEqual(state.grid.multiplier(*worked[0]), 1.0)
+
+        # Starve everyone: the store decides who dies.
+        state.resource.resources['Food'] = 0
+        for r, row in enumerate(state.grid.squares):
+            for c, sq in enumerate(row):
+                if isinstance(sq, Farm):
+                    state.grid.demolish(r, c)
+        for i in range(3000):
+            state.tick()
+        self.assertTrue(state.resource.deaths > 0)
+        self.check_counts(state)
+
+    def test_store_grows(self):
+        from workers import WorkerStore, IDLE
+        import numpy as np
+        store = WorkerStore(4)
+        store.counts = np.zeros(1, np.int32)
+        store.rows = store.cols = 1
+        ids = store.spawn(100000)
+        store.place(ids, np.full(len(ids), IDLE, np.int32))
+        self.assertEqual(len(store), 100000)
+        store.sync_cell(0, 10)
+        store.kill(ids[:5])
+        self.assertEqual(store.idle + store.counts[0], 99995)
+        self.assertEqual(len(set(store.free[:store.nfree])), store.nfree)
+
+class TerrainTests(unittest.TestCase):
+
+    def test_terrain_is_seeded(self):
+        ''' The same seed gives the same map, with streams, trees and a house,
+        in a form grid_from_description takes.'''
+        from terrain import terrain_grid_desc
+        desc = terrain_grid_desc(60, 80, seed=3)
+        self.assertEqual(desc, terrain_grid_desc(60, 80, seed=3))
+        self.assertNotEqual(desc, terrain_grid_desc(60, 80, seed=4))
+        self.assertEqual((len(desc), len(desc[0])), (60, 80))
+        text = ''.join(desc)
+        for letter in 'GTSH':
+            self.assertIn(letter, text)
+        self.assertEqual(text.count('H'), 1)
+        squares = grid_from_description(desc)
+        self.assertTrue(isinstance(squares[0][0], Square))
+
+class SimulationThreadTests(unittest.TestCase):
+
+    def test_ticks_on_its_own(self):
+        ''' The thread keeps ticking while the main thread is busy, carries
+        out commands, and publishes read-only snapshots.'''
+        from gamestate import GameState
+        from simthread import SimulationThread
+        import time
+        state = GameState()
+        state.goto_level(0)
+        simulation = SimulationThread(state, rate=200)
+        first = state.snapshot
+        pos = next((r, c) for r, row in enumerate(state.grid.squares)
+                   for c, sq in enumerate(row) if sq.workable())
+        state.command(state.grid.perform, ASSIGN_WORKER, pos)
+        self.assertEqual(state.grid.squares[pos[0]][pos[1]].num_workers, 0)
+        simulation.start()
+        time.sleep(0.3) # a very slow frame
+        simulation.stop()
+        simulation.join()
+        snapshot = state.snapshot
+        self.assertTrue(snapshot.ticks >= 20)
+        self.assertEqual(snapshot.workers[pos], 1)
+        self.assertEqual(first.workers[pos], 0)
+        self.assertFalse(snapshot.codes.flags.writeable)
+        self.assertEqual(snapshot.amounts, tuple(state.resource.amounts))
+
+    def test_drawing_only_reads_snapshots(self):
+        ''' Changes made on the simulation thread don't touch what the main
+        thread is drawing; the grid and sparklines are drawn from snapshots.'''
+        from gamestate import GameState
+        from simthread import SimulationThread
+        if pygame.display.get_surface() is None:
+            pygame.display.set_mode((800, 600))
+        state = GameState()
+        state.goto_level(0)
+        simulation = SimulationThread(state)
+        state.grid.paint()
+        view = state.grid.view
+        pos = next((r, c) for r, row in enumerate(state.grid.squares)
+                   for c, sq in enumerate(row) if sq.workable())
+        state.grid.perform(ASSIGN_WORKER, pos) # as the thread would
+        self.assertTrue(state.grid.view is view)
+        simulation.publish()
+        state.grid.paint()
+        self.assertFalse(state.grid.view is view)
+
+        for i in range(3):
+            state.tick()
+            simulation.publish()
+        version, samples = state.snapshot.history['tick']
+        self.assertFalse(samples.flags.writeable)
+        self.assertEqual(tuple(samples[-1]), tuple(state.resource.amounts))
+        state.tick() # not published yet
+        state.resource.history_tier = 'tick'
+        state.resource.paint(700, 250)
+        self.assertTrue(state.resource.sparkline_samples is samples)
+        year = state.snapshot.history['year']
+        simulation.publish()
+        self.assertTrue(state.snapshot.history['year'] is year) # no new sample
+
+class CaptureTests(unittest.TestCase):
+
+    def test_frames_are_saved_or_dropped(self):
+        ''' Kept frames are saved as PNGs by the encoder process; when it
+        can't keep up, frames are dropped instead of waiting.'''
+        import os
+        import shutil
+        import tempfile
+        import time
+        from capture import Capture
+        directory = tempfile.mkdtemp()
+        try:
+            surface = pygame.Surface((64, 48))
+            surface.fill((10, 200, 30))
+            capture = Capture(directory, every=2, queue_size=1)
+            started = time.time()
+            for i in range(200):
+                capture.frame(surface)
+            self.assertTrue(time.time() - started < 2)
+            self.assertEqual(capture.queued + capture.dropped, 100)
+            self.assertTrue(capture.dropped > 0)
+            capture.close()
+            names = sorted(os.listdir(directory))
+            self.assertEqual(len(names), capture.queued)
+            picture = pygame.image.load(os.path.join(directory, names[0]))
+            self.assertEqual(tuple(picture.get_at((5, 5)))[:3], (10, 200, 30))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_replay_follows_the_levels(self):
+        ''' A session records clicks by level and tick in the level, and plays
+        back through a level timing out, without waiting for anyone to
+        acknowledge the message.'''
+        import os
+        import shutil
+        import tempfile
+        import level
+        import capture
+        from gamestate import global_state
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'session.jsonl')
+        saved = global_state.levels
+        # levels that time out after a few ticks
+        global_state.levels = tuple(level.Level(0.05, 10**9, 10**9, {'H': 1, 'F': 2}, seed=n)
+                                    for n in (1, 2))
+        try:
+            global_state.goto_level(0)
+            recorder = capture.Recorder(global_state, path)
+            global_state.goto_level(1) # as from the menu
+            for i in range(3):
+                global_state.tick()
+            farm = next((r, c) for r, row in enumerate(global_state.grid.squares)
+                        for c, sq in enumerate(row) if isinstance(sq, Farm))
+            global_state.command(recorder.click, ASSIGN_WORKER, farm)
+            global_state.headless = True
+            for i in range(10):
+                global_state.tick()
+            recorder.close()
+            session = capture.read_session(path)
+            self.assertEqual([line['level'] for line in session[:4]], [0, 1, 1, 1])
+            self.assertEqual((session[1]['from'], session[1]['tick']), (0, 0))
+            self.assertEqual((session[2]['tick'], session[2]['r'], session[2]['c']), (3,) + farm)
+            self.assertEqual(session[3]['from'], 1)
+
+            global_state.headless = False
+            global_state.goto_level(0)
+            frames = capture.replay(session, os.path.join(directory, 'frames'), every=2)
+            self.assertEqual(global_state.current_level, 1)
+            self.assertTrue(frames.queued >= 3)
+            self.assertFalse(global_state.headless)
+        finally:
+            global_state.headless = False
+            global_state.levels = saved
+            global_state.goto_level(0)
+            shutil.rmtree(directory)
+
+class FrameGovernorTests(unittest.TestCase):
+
+    def test_idles_and_wakes(self):
+        ''' The rate drops once the same picture has been drawn for a while,
+        and comes back on input or a different picture.'''
+        import time
+        from governor import FrameGovernor, ACTIVE, IDLE
+        governor = FrameGovernor(fps=100, idle_fps=4, idle_after=0.05)
+        governor.frame('a')
+        self.assertEqual(governor.state, ACTIVE)
+        time.sleep(0.06)
+        governor.frame('a')
+        self.assertEqual(governor.state, IDLE)
+        self.assertEqual((governor.fps, governor.ticks_per_frame), (4, 25))
+        governor.frame('a', had_input=True)
+        self.assertEqual(governor.state, ACTIVE)
+        time.sleep(0.06)
+        governor.frame('a')
+        governor.frame('b')
+        self.assertEqual((governor.fps, governor.ticks_per_frame), (100, 1))
+        self.assertEqual(governor.stats()['idle_frames'], 2)
+
+class AllocationProfilerTests(unittest.TestCase):
+
+    def test_report(self):
+        ''' Blocks a phase still holds are counted against it and its line;
+        garbage only shows in the peak.'''
+        import os
+        import tempfile
+        from allocprofile import AllocationProfiler, load, per_tick
+        path = os.path.join(tempfile.mkdtemp(), 'alloc.jsonl')
+        profiler = AllocationProfiler(path, window=2)
+        kept = []
+        for i in range(3):
+            profiler.begin()
+            kept.append([object() for j in range(1000)])
+            profiler.end('logic')
+            garbage = [object() for j in range(1000)]
+            del garbage
+            profiler.end('render')
+            profiler.tick()
+        profiler.close()
+        windows = load(path)
+        self.assertEqual([(w['tick'], w['ticks']) for w in windows], [(0, 2), (2, 1)])
+        logic, render = windows[0]['phases']['logic'], windows[0]['phases']['render']
+        self.assertTrue(logic['blocks'] >= 2000)
+        self.assertTrue(logic['top'][0]['site'].startswith('tests.py:'))
+        self.assertTrue(render['bytes'] < 1000 < render['peak_bytes'])
+        self.assertTrue(per_tick(windows)['logic'][0] >= 1000)
+
+class SkipAheadTests(unittest.TestCase):
+
+    def test_matches_ticking(self):
+        ''' Fast-forwarding a fed economy gives the same state as playing
+        every tick, including winning the level.'''
+        from gamestate import GameState
+        from skipahead import fast_forward
+        games = []
+        for i in range(2):
+            state = GameState()
+            state.goto_level(0)
+            for r, row in enumerate(state.grid.squares):
+                for c, sq in enumerate(row):
+                    if sq.workable():
+                        for k in range(3):
+                            state.grid.perform(ASSIGN_WORKER, (r, c))
+            games.append(state)
+        ticked, skipped = games
+        for i in range(3000):
+            ticked.tick()
+        fast_forward(skipped, 3000)
+        self.assertEqual(skipped.current_level, ticked.current_level)
+        self.assertAlmostEqual(skipped.time_remaining, ticked.time_remaining)
+        self.assertEqual(skipped.warning, ticked.warning)
+        for a, b in zip(ticked.resource.amounts, skipped.resource.amounts):
+            self.assertAlmostEqual(a, b)
+
+    def test_counts_the_ticks(self):
+        ''' The ticks jumped over count towards the level's ticks.'''
+        from gamestate import GameState
+        from skipahead import fast_forward
+        state = GameState()
+        state.goto_level(0)
+        for r, row in enumerate(state.grid.squares):
+            for c, sq in enumerate(row):
+                if isinstance(sq, Farm):
+                    state.grid.perform(ASSIGN_WORKER, (r, c))
+        start = state.level_ticks()
+        fast_forward(state, 500)
+        self.assertEqual(state.current_level, 0)
+        self.assertEqual(state.level_ticks(), start + 500)
+
+class TelemetryTests(unittest.TestCase):
+
+    def test_run_reads_back(self):
+        ''' Ticks recorded across several blocks load back as columns, with
+        the win marked.'''
+        import os, tempfile
+        import telemetry
+        from gamestate import GameState
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            state = GameState()
+            state.goto_level(0)
+            state.telemetry = telemetry.Telemetry(path, block_size=16)
+            warning = state.warning
+            golds = []
+            for i in range(40):
+                state.tick()
+                golds.append(state.resource.get('Gold'))
+            state.resource.give({'Gold': 1000, 'Unemployed': 20})
+            state.tick()
+            state.telemetry.close()
+
+            run = telemetry.load(path)
+            self.assertEqual(list(run['tick']), list(range(41)))
+            self.assertEqual(list(run['gold'][:40]), golds)
+            self.assertEqual(list(run['event']), [telemetry.NO_EVENT]*40 + [telemetry.WON])
+            self.assertEqual(run['warnings'][run['warning'][0]], warning)
+        finally:
+            os.remove(path)
+
+    def test_win_on_the_last_row_of_a_block(self):
+        ''' A level event on the last row of a full block is kept.'''
+        import os, tempfile
+        import telemetry
+        from gamestate import GameState
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            state = GameState()
+            state.goto_level(0)
+            state.telemetry = telemetry.Telemetry(path, block_size=8)
+            for i in range(7):
+                state.tick()
+            state.resource.give({'Gold': 1000, 'Unemployed': 20})
+            state.tick()
+            state.telemetry.close()
+            run = telemetry.load(path)
+            self.assertEqual(list(run['event']), [telemetry.NO_EVENT]*7 + [telemetry.WON])
+        finally:
+            os.remove(path)
+
+class MonteCarloTests(unittest.TestCase):
+
+    def test_batch_of_headless_games(self):
+        ''' Bots can play short games, and the results add up.'''
+        import montecarlo
+        results = montecarlo.play_batch((0, 'greedy', [1, 2], 300))
+        self.assertEqual(len(results), 2)
+        stats = montecarlo.LevelStats()
+        for level_index, won, months, deaths in results:
+            self.assertEqual(level_index, 0)
+            self.assertTrue(months <= 3.0 + 1e-9)
+            stats.add(won, months, deaths)
+        self.assertEqual(stats.games, 2)
+        self.assertTrue(0.0 <= stats.win_rate() <= 1.0)
+
+class SolverTests(unittest.TestCase):
+
+    def test_first_level_is_solvable(self):
+        ''' The solver finds a win for the first level inside its time limit.'''
+        import solver
+        import level
+        solution = solver.solve(0, beam_width=50)
+        self.assertTrue(solution.ticks is not None)
+        self.assertTrue(solution.months() <= level.levels[0].duration)
+        self.assertTrue(len(solution.plan) > 0)
+
+    def test_transposition_table_is_bounded(self):
+        import solver
+        table = solver.TranspositionTable(2)
+        self.assertFalse(table.seen('a', 5))
+        self.assertTrue(table.seen('a', 7))
+        self.assertFalse(table.seen('a', 3))
+        table.seen('b', 0)
+        table.seen('c', 0)
+        self.assertEqual(len(table.table), 2)
+        self.assertEqual(table.evictions, 1)
+        self.assertFalse(table.seen('a', 9))
+
 if __name__ == '__main__':
     ''' run the tests! '''
     unittest.main()
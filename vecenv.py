@@ -0,0 +1,313 @@
+'''
+
+A vectorized environment that plays K copies of the Migration Sensation
+economy in lockstep, for training policies.
+
+Every world's state lives in stacked NumPy arrays: square types and worker
+counts of shape (K, rows, cols) and resources of shape (K, 5). One call to
+step() applies a batch of actions, harvests, feeds and grows the population
+and checks the level goals for all K worlds at once, following the same rules
+as Grid.perform, Grid.harvest, Resource.update and Level.update. The rare
+events that touch a single square (starving workers being removed from the
+grid and graves being dug) are handled only for the worlds they happen in.
+
+    env = VecEnv(1024, level_index=1, seed=0)
+    obs = env.reset()
+    obs, reward, done, info = env.step(actions)
+
+An action is a row (mode, r, c), where mode is one of the interface modes in
+constants.py and NORMAL means "do nothing". Worlds that finish are reset
+automatically; reward is 1 for a win and -1 for running out of time.
+
+'''
+
+import numpy as np
+
+import level
+from level import months_per_tick
+from grid import building_costs
+from resource import Resource, resource_ids as resource_index
+from resource import FOOD, WOOD, GOLD, UNEMPLOYED as IDLE, TOTAL_WORKERS as TOTAL
+import square
+from square import square_letters, Grass, Tree, Stream, Farm, House, Mine, Grave
+from constants import *
+
+# Square type codes are the ones in square.py, and so are the letters they
+# come from.
+type_letters = tuple(square_letters[cls] for cls in square.types)
+type_codes = dict((letter, code) for code, letter in enumerate(type_letters))
+GRASS, TREE, STREAM, FARM, HOUSE, MINE, GRAVE = (cls.code for cls in (Grass, Tree, Stream, Farm, House, Mine, Grave))
+
+build_types = dict((mode, code) for mode, (code, build) in square.build_types.items())
+
+max_workers_per_square = 5
+food_per_worker = 0.005
+death_rate = 0.001
+gold_per_immigrant = 100.0
+house_capacity = square.HOUSING[HOUSE]
+
+def unmodelled_types():
+    ''' The names of the square types the worlds can't hold: each world only
+    counts one type of house, and only the interface's own build modes are
+    taken as actions.'''
+    names = []
+    for cls in square.types:
+        if square.HOUSING[cls.code] > 0 and cls is not House:
+            names.append(cls.__name__)
+    for mode, (code, build) in square.build_types.items():
+        if mode not in (BUILD_HOUSE, BUILD_FARM, BUILD_MINE):
+            names.append(square.types[code].__name__)
+    return names
+deaths_per_grave = 4
+
+def _square_tables():
+    ''' Per-type flag and production tables, taken from the square classes.'''
+    n = len(type_letters)
+    workable = np.zeros(n, bool)
+    buildable = np.zeros(n, bool)
+    destroyable = np.zeros(n, bool)
+    rates = np.zeros((n, 3))
+    for code, cls in enumerate(square.types):
+        sq = cls()
+        workable[code] = sq.workable()
+        buildable[code] = sq.buildable()
+        destroyable[code] = sq.destroyable()
+        sq.num_workers = 1
+        for name, amount in sq.produce().items():
+            rates[code, resource_index[name]] = amount
+    return workable, buildable, destroyable, rates
+
+WORKABLE, BUILDABLE, DESTROYABLE, RATES = _square_tables()
+SQRT = np.sqrt(np.arange(max_workers_per_square + 1))
+
+# COSTS[mode] is the resource vector a build mode costs; other modes cost
+# nothing.
+COSTS = np.zeros((REMOVE_WORKER + 1, 5))
+for _mode, _cost in building_costs.items():
+    if _mode > REMOVE_WORKER:
+        continue # a type VecEnv refuses; see unmodelled_types()
+    for _name, _amount in _cost.items():
+        COSTS[_mode, resource_index[_name]] = _amount
+
+
+class VecEnv:
+    ''' K worlds stepped together. Besides the grids, each world keeps its
+    production per tick, its number of workers on the grid and its number of
+    houses up to date as squares change, so a tick costs O(K) rather than
+    O(K * rows * cols).'''
+
+    def __init__(self, num_worlds, level_index=0, seed=None):
+        ''' Create num_worlds worlds. level_index may be a single level or
+        one per world; the sandbox level can't be used since it never ends.'''
+        self.num_worlds = k = num_worlds
+        self.rng = np.random.default_rng(seed)
+        self.level_index = np.broadcast_to(np.asarray(level_index), (k,)).copy()
+        lvls = [level.levels[i] for i in self.level_index]
+        if any(lvl.adjacency for lvl in lvls):
+            raise ValueError("VecEnv doesn't model adjacency bonuses")
+        unknown = unmodelled_types()
+        if unknown:
+            raise ValueError("VecEnv doesn't model these square types: " + ', '.join(unknown))
+        self.layouts = np.array([[[type_codes[letter] for letter in row] for row in lvl.grid]
+                                 for lvl in lvls], np.int8)
+        self.layout_houses = (self.layouts == HOUSE).sum(axis=(1, 2))
+        self.duration = np.array([lvl.duration for lvl in lvls], float)
+        self.gold_goal = np.array([lvl.gold_goal for lvl in lvls], float)
+        self.population_goal = np.array([lvl.population_goal for lvl in lvls], float)
+        self.default_resources = np.array(Resource.default_amounts)
+
+        shape = self.layouts.shape
+        self.types = np.empty(shape, np.int8)
+        self.workers = np.zeros(shape, np.int8)
+        self.resources = np.empty((k, 5))
+        self.production = np.zeros((k, 3))
+        self.busy = np.zeros(k, np.int64)
+        self.houses = np.zeros(k, np.int64)
+        self.previous_gold = np.empty(k)
+        self.time_remaining = np.empty(k)
+        self.dead_workers = np.zeros(k, np.int64)
+        self.deaths = np.zeros(k, np.int64)
+        self.world = np.arange(k)
+        # the square type each mode builds, or -1
+        self.build_type = np.full(REMOVE_WORKER + 1, -1, np.int8)
+        for mode, code in build_types.items():
+            self.build_type[mode] = code
+        self.reset()
+
+    def reset(self, mask=None):
+        ''' Restart every world, or only those where mask is true.'''
+        if mask is None:
+            mask = np.ones(self.num_worlds, bool)
+        self.types[mask] = self.layouts[mask]
+        self.workers[mask] = 0
+        self.resources[mask] = self.default_resources
+        self.production[mask] = 0.0
+        self.busy[mask] = 0
+        self.houses[mask] = self.layout_houses[mask]
+        self.previous_gold[mask] = self.resources[mask, GOLD]
+        self.time_remaining[mask] = self.duration[mask]
+        self.dead_workers[mask] = 0
+        self.deaths[mask] = 0
+        return self.observe()
+
+    def observe(self):
+        return {
+            'types': self.types,
+            'workers': self.workers,
+            'resources': self.resources,
+            'time_remaining': self.time_remaining,
+        }
+
+    def step(self, actions):
+        ''' Advance every world by one tick. actions is an int array of shape
+        (K, 3) holding (mode, r, c) for each world.'''
+        actions = np.asarray(actions)
+        self.apply_actions(actions[:, 0], actions[:, 1], actions[:, 2])
+        self.harvest()
+        self.update_resources()
+        won, lost = self.update_levels()
+
+        reward = won.astype(float) - lost
+        done = won | lost
+        info = {'won': won, 'lost': lost, 'deaths': self.deaths.copy()}
+        if done.any():
+            self.reset(done)
+        return self.observe(), reward, done, info
+
+    def apply_actions(self, mode, r, c):
+        ''' Grid.perform for every world at once. Only the clicked square of
+        each world is read or written.'''
+        w = self.world
+        res = self.resources
+        old_cell = cell = self.types[w, r, c]
+        old_here = here = self.workers[w, r, c]
+
+        # building
+        cost = COSTS[mode]
+        new_type = self.build_type[mode]
+        build = (new_type >= 0) & BUILDABLE[cell] & (res >= cost).all(axis=1)
+        res -= cost * build[:, None]
+        cell = np.where(build, new_type, cell)
+
+        # assigning and removing workers
+        assign = (mode == ASSIGN_WORKER) & WORKABLE[cell] & (res[:, IDLE] >= 1) \
+                 & (here < max_workers_per_square)
+        remove = (mode == REMOVE_WORKER) & WORKABLE[cell] & (here > 0)
+        change = assign.astype(np.int8) - remove
+        here = here + change
+        res[:, IDLE] -= change
+
+        # demolishing; the last house always stays
+        destroy = (mode == DESTROY_BUILDING) & DESTROYABLE[cell] \
+                  & ((self.houses > 1) | (cell != HOUSE))
+        res[:, IDLE] += np.where(destroy, here, 0)
+        here = np.where(destroy, 0, here).astype(np.int8)
+        cell = np.where(destroy, GRASS, cell).astype(np.int8)
+
+        self.types[w, r, c] = cell
+        self.workers[w, r, c] = here
+        self.production += RATES[cell] * SQRT[here][:, None] - RATES[old_cell] * SQRT[old_here][:, None]
+        self.busy += here.astype(np.int64) - old_here
+        self.houses += (cell == HOUSE).astype(np.int64) - (old_cell == HOUSE)
+
+    def harvest(self):
+        ''' Grid.harvest for every world at once.'''
+        self.resources[:, :3] += self.production
+
+    def update_resources(self):
+        ''' Resource.update for every world at once: feed the workers, let
+        some starve, attract immigrants and enforce the housing limit.'''
+        res = self.resources
+        total = self.busy + res[:, IDLE]
+
+        # feeding
+        cost = total * food_per_worker
+        fed = res[:, FOOD] >= cost
+        starving = ~fed & (total > 0)
+        res[:, FOOD] = np.where(fed, res[:, FOOD] - cost, np.where(starving, 0.0, res[:, FOOD]))
+        if starving.any():
+            dies = starving & (self.rng.random(self.num_worlds) < death_rate * total)
+            self.kill(dies.astype(np.int64))
+
+        # immigration
+        extra = (res[:, GOLD] - self.previous_gold) / gold_per_immigrant
+        arrive = (extra > 0) & (res[:, FOOD] > 0) & (res[:, IDLE] < 5)
+        res[:, IDLE] += np.where(arrive, extra, 0.0)
+        self.previous_gold[:] = res[:, GOLD]
+
+        # housing limit
+        capacity = self.houses * house_capacity
+        crowded = self.busy + res[:, IDLE] > capacity
+        if crowded.any():
+            res[crowded, IDLE] = np.floor(res[crowded, IDLE])
+            excess = np.where(crowded, self.busy + res[:, IDLE] - capacity, 0).astype(np.int64)
+            self.kill(np.maximum(excess, 0))
+
+        res[:, TOTAL] = self.busy + res[:, IDLE]
+
+    def kill(self, counts):
+        ''' Resource.kill_workers for every world: counts[k] workers die in
+        world k, idle ones first.'''
+        if not counts.any():
+            return
+        res = self.resources
+        idle = np.minimum(counts, np.floor(res[:, IDLE]).astype(np.int64))
+        res[:, IDLE] -= idle
+        self.deaths += counts
+        self.dead_workers += counts
+
+        # Only a few worlds ever need workers taken off the grid or graves
+        # dug, so those are done one world at a time.
+        for k in np.flatnonzero(counts > idle):
+            self.kill_on_grid(k, counts[k] - idle[k])
+        for k in np.flatnonzero(self.dead_workers >= deaths_per_grave):
+            graves, self.dead_workers[k] = divmod(self.dead_workers[k], deaths_per_grave)
+            self.add_graves(k, graves)
+
+    def kill_on_grid(self, k, n):
+        ''' Remove n random workers from world k's grid, farmers last.'''
+        workers = self.workers[k].ravel()
+        farm = (self.types[k] == FARM).ravel()
+        pool = np.concatenate([np.repeat(np.flatnonzero(~farm), workers[~farm]),
+                               np.repeat(np.flatnonzero(farm), workers[farm])])
+        others = int(workers[~farm].sum())
+        victims = np.concatenate([self.rng.permutation(pool[:others]),
+                                  self.rng.permutation(pool[others:])])[:n]
+        np.subtract.at(workers, victims, 1)
+        self.busy[k] = workers.sum()
+        self.production[k] = (RATES[self.types[k]] * SQRT[self.workers[k]][..., None]).sum(axis=(0, 1))
+
+    def add_graves(self, k, n):
+        ''' Grid.add_graves for world k: dig n graves on free grass, then
+        demolish random buildings for the rest (sparing the last house). A
+        world with no houses gets no graves.'''
+        types, workers = self.types[k].ravel(), self.workers[k].ravel()
+        if self.houses[k] == 0:
+            return
+        free = np.flatnonzero(BUILDABLE[types])
+        spots = self.rng.choice(free, min(n, len(free)), replace=False)
+        destroyable = self.rng.permutation(np.flatnonzero(DESTROYABLE[types] & ~BUILDABLE[types]))
+        houses = self.houses[k]
+        demolished = []
+        for spot in destroyable[:n - len(spots)]:
+            if types[spot] == HOUSE:
+                if houses == 1:
+                    continue
+                houses -= 1
+            demolished.append(spot)
+        # Free the workers, just like demolishing would
+        self.resources[k, IDLE] += workers[demolished].sum()
+        workers[demolished] = 0
+        types[spots] = GRAVE
+        types[demolished] = GRAVE
+        self.houses[k] = houses
+        self.busy[k] = workers.sum()
+        self.production[k] = (RATES[self.types[k]] * SQRT[self.workers[k]][..., None]).sum(axis=(0, 1))
+
+    def update_levels(self):
+        ''' Level.update for every world: returns (won, lost) masks.'''
+        res = self.resources
+        won = (res[:, TOTAL] >= self.population_goal) & (res[:, GOLD] >= self.gold_goal)
+        self.time_remaining -= months_per_tick
+        lost = ~won & (self.time_remaining <= 0)
+        return won, lost